@@ -0,0 +1,74 @@
+"""
+Decides how tables are stored between tasks.
+
+Intermediate artifacts - Parquet files that a later task of the same plan reads -
+are switched to memory-mapped Arrow IPC (".arrow"), which the next script loads
+without decoding. Parquet is kept for everything nobody in the plan reads again,
+i.e. final and user-facing outputs. Scripts read and write both through the
+artifact_io helper in script_lib/, which is put on the import path of every
+script we run.
+"""
+import os
+import sys
+
+ARROW_ARTIFACTS = os.environ.get("ARROW_ARTIFACTS", "1") not in ("0", "false", "off")
+
+SCRIPT_LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "script_lib")
+
+ARROW_HINT = (
+    "Files ending in .arrow are Arrow IPC artifacts: load them with "
+    "`from artifact_io import read_table; df = read_table(name)` and save them with "
+    "`from artifact_io import write_table; write_table(df, name)`, never with the Parquet functions."
+)
+
+# Make artifact_io importable here (for the dependency check) and in every script
+if SCRIPT_LIB_DIR not in sys.path:
+    sys.path.append(SCRIPT_LIB_DIR)
+_python_path = os.environ.get("PYTHONPATH", "")
+if SCRIPT_LIB_DIR not in _python_path.split(os.pathsep):
+    os.environ["PYTHONPATH"] = os.pathsep.join(p for p in (_python_path, SCRIPT_LIB_DIR) if p)
+
+
+def intermediate_name(artifact: str) -> str:
+    return os.path.splitext(artifact)[0] + ".arrow"
+
+
+def use_arrow_for_intermediates(plan: list) -> tuple:
+    """
+    Renames every Parquet artifact that is produced and later consumed within the
+    plan to an .arrow artifact, in the artifact lists and the descriptions.
+    Returns (plan, {old name: new name}).
+    """
+    produced = set()
+    consumed = set()
+    for task in plan:
+        produced.update(task.get("output_artifacts") or [])
+        consumed.update(task.get("input_artifacts") or [])
+    taken = produced | consumed
+    renamed = {}
+    for artifact in sorted(produced & consumed):
+        if not artifact.lower().endswith(".parquet"):
+            continue
+        new_name = intermediate_name(artifact)
+        if new_name in taken:
+            continue
+        renamed[artifact] = new_name
+    if not renamed:
+        return plan, renamed
+
+    rewritten = []
+    for task in plan:
+        task = dict(task)
+        for field in ("input_artifacts", "output_artifacts"):
+            task[field] = [renamed.get(a, a) for a in task.get(field) or []]
+        description = task.get("description") or ""
+        touched = False
+        for old, new in renamed.items():
+            if old in description or new in task["input_artifacts"] + task["output_artifacts"]:
+                description = description.replace(old, new)
+                touched = True
+        if touched and (task.get("tool_needed") or "").lower() == "python":
+            description = f"{description}\n{ARROW_HINT}"
+        task["description"] = description
+        rewritten.append(task)
+    return rewritten, renamed
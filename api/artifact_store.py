@@ -0,0 +1,199 @@
+"""
+Persistent store of finished tasks, so a rerun with a tweaked question or one
+re-uploaded file only regenerates and executes the part of the DAG whose inputs
+actually changed.
+
+An entry is keyed by the task's tool, description and declared outputs plus the
+content hash of every input artifact. Because upstream outputs are hashed, a
+changed file dirties exactly the tasks downstream of it. The entry keeps the
+output artifacts, the task's stdout (the peek forwarded to dependents) and the
+script that produced them together with its hash.
+
+The lookup happens before code generation, so a clean task costs neither an LLM
+call nor a process. Entries are evicted least recently used first once the
+store exceeds ARTIFACT_STORE_MAX_MB.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+ARTIFACT_STORE_ENABLED = os.environ.get("ARTIFACT_STORE", "1") not in ("0", "false", "off")
+ARTIFACT_STORE_DIR = os.environ.get("ARTIFACT_STORE_DIR", "artifact_store")
+ARTIFACT_STORE_MAX_BYTES = int(os.environ.get("ARTIFACT_STORE_MAX_MB", 1024)) * 1024 * 1024
+# Tasks that touch live URLs (scraping) are not reused unless this is set
+ARTIFACT_STORE_LIVE_URLS = os.environ.get("ARTIFACT_STORE_LIVE_URLS", "0") in ("1", "true", "on")
+
+_URL_PATTERN = re.compile(r"https?://", re.IGNORECASE)
+_HASH_CHUNK_SIZE = 1024 * 1024
+_META_FILE = "meta.json"
+# Input hashes remembered; every session's workspace adds its own paths
+_MAX_CACHED_HASHES = 4096
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entry_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ArtifactStore:
+    def __init__(self, root: str = ARTIFACT_STORE_DIR, max_bytes: int = ARTIFACT_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (path, size, mtime) -> sha256, so big uploads aren't re-hashed for every task;
+        # least recently used first, bounded by _MAX_CACHED_HASHES
+        self._hashes = collections.OrderedDict()
+        self._hashes_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _hash_input(self, path: str) -> str:
+        stat = os.stat(path)
+        signature = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._hashes_lock:
+            digest = self._hashes.get(signature)
+            if digest is not None:
+                self._hashes.move_to_end(signature)
+                return digest
+        digest = file_sha256(path)
+        with self._hashes_lock:
+            self._hashes[signature] = digest
+            while len(self._hashes) > _MAX_CACHED_HASHES:
+                self._hashes.popitem(last=False)
+        return digest
+
+    def task_key(self, task: dict, work_dir: str):
+        """
+        Key of a task in this workspace, or None if it can't be reused (a missing
+        input, a live URL, no declared outputs).
+        """
+        description = task.get("description") or ""
+        if _URL_PATTERN.search(description) and not ARTIFACT_STORE_LIVE_URLS:
+            return None
+        if not task.get("output_artifacts"):
+            return None
+        inputs = {}
+        for artifact in task.get("input_artifacts") or []:
+            path = os.path.join(work_dir, artifact)
+            if not os.path.isfile(path):
+                return None
+            inputs[artifact] = self._hash_input(path)
+        payload = {
+            "tool": (task.get("tool_needed") or "").lower(),
+            "description": description,
+            "outputs": sorted(task.get("output_artifacts") or []),
+            "inputs": sorted(inputs.items()),
+        }
+        return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def restore(self, key: str, task: dict, work_dir: str):
+        """
+        Copies a stored task's outputs (and script) into the workspace. Returns the
+        entry's metadata, or None on a miss.
+        """
+        entry = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry, _META_FILE)) as f:
+                meta = json.load(f)
+            for artifact in task.get("output_artifacts") or []:
+                target = os.path.join(work_dir, artifact)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # copies, not links: a later task rewriting the file must not change the store
+                shutil.copy2(os.path.join(entry, "outputs", artifact), target)
+            if meta.get("code") is not None:
+                with open(os.path.join(work_dir, f"script_task_{task.get('task_id')}.py"), "w") as f:
+                    f.write(meta["code"])
+            # the meta file's mtime is the LRU clock
+            os.utime(os.path.join(entry, _META_FILE))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return meta
+
+    def save(self, key: str, task: dict, work_dir: str, output: str):
+        """Stores the outputs of a task that just succeeded, then enforces the quota."""
+        entry = self._entry_dir(key)
+        staging = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        script_path = os.path.join(work_dir, f"script_task_{task.get('task_id')}.py")
+        code = None
+        if (task.get("tool_needed") or "").lower() == "python" and os.path.exists(script_path):
+            with open(script_path) as f:
+                code = f.read()
+        try:
+            os.makedirs(os.path.join(staging, "outputs"))
+            for artifact in task.get("output_artifacts") or []:
+                target = os.path.join(staging, "outputs", artifact)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(os.path.join(work_dir, artifact), target)
+            meta = {
+                "task_id": task.get("task_id"),
+                "description": task.get("description"),
+                "output": output,
+                "code": code,
+                "code_sha256": hashlib.sha256(code.encode()).hexdigest() if code is not None else None,
+                "created_at": time.time(),
+            }
+            with open(os.path.join(staging, _META_FILE), "w") as f:
+                json.dump(meta, f)
+            with self._lock:
+                shutil.rmtree(entry, ignore_errors=True)
+                os.replace(staging, entry)
+        except OSError as e:
+            # a task whose outputs can't be stored simply won't be reused
+            print(f"Could not store the artifacts of task {task.get('task_id')}: {e}")
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the store fits in max_bytes."""
+        with self._lock:
+            try:
+                names = [n for n in os.listdir(self.root) if not n.endswith(".tmp")]
+            except OSError:
+                return
+            entries = []
+            for name in names:
+                path = self._entry_dir(name)
+                try:
+                    accessed = os.path.getmtime(os.path.join(path, _META_FILE))
+                except OSError:
+                    accessed = 0
+                entries.append((accessed, path, _entry_size(path)))
+            total = sum(size for _, _, size in entries)
+            for _, path, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+store = ArtifactStore() if ARTIFACT_STORE_ENABLED else None
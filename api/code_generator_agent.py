@@ -2,21 +2,21 @@
 # pip install google-genai
 
 import base64
-import os
-from google import genai
 from google.genai import types
+import llm
 import json
 from dotenv import load_dotenv 
 load_dotenv()  # Load environment variables from .env file
 
-def generate_code(task: dict, last_task_output: str = None) -> str:
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
+async def generate_code(task: dict, last_task_output: str = None, data_manifest: str = None) -> str:
     text = f"""Task details: Description: {task.get('description')}, Input artifacts: {task.get('input_artifacts')}, Output artifacts: {task.get('output_artifacts')}"""
     
     if last_task_output:
         text += f"\n\nContext from last task output: {last_task_output}"
+
+    if data_manifest:
+        # schema of the input files, profiled at upload time
+        text += f"\n\n{data_manifest}"
     
     model = "gemini-2.0-flash"
     contents = [
@@ -58,7 +58,7 @@ Your generated script will be executed in a new, isolated environment.
 
 # CORE INSTRUCTIONS & BEST PRACTICES
 
-- Use Parquet, Not CSV: For all operations involving pandas DataFrames, you MUST use the Parquet file format for both reading (pd.read_parquet()) and writing (df.to_parquet()). Parquet is faster and preserves data types.
+- Use Parquet or Arrow, Not CSV: For all operations involving pandas DataFrames, read and write the columnar file formats, never CSV. Files ending in .parquet are read with pd.read_parquet() and written with df.to_parquet(). Files ending in .arrow are Arrow IPC intermediates: you MUST read them with `from artifact_io import read_table; df = read_table("file.arrow")` and write them with `from artifact_io import write_table; write_table(df, "file.arrow")`, never with the Parquet functions. Both formats are faster than CSV and preserve data types.
     
 - Use DuckDB for SQL: If the task requires running SQL queries on files (like Parquet or CSV), you MUST use the duckdb Python library. Execute the query and fetch the results into a pandas DataFrame. For example: df = duckdb.sql('SELECT * FROM "path/to/file.parquet"').df().
     
@@ -88,12 +88,12 @@ Your entire output will be saved directly to a .py file and executed"""),
         ],
     )
 
-    response = client.models.generate_content(
+    text = await llm.generate_text(
         model=model,
         contents=contents,
         config=generate_content_config,
     )
-    return response.text
+    return text
     # for chunk in client.models.generate_content(
     #     model=model,
     #     contents=contents,
@@ -0,0 +1,136 @@
+"""
+Per-request time budget.
+
+run_pipeline starts a Deadline and installs it in a context variable, so the
+planner, the agents (through llm.generate_text) and the script executor all see
+the same budget without it being passed through every call. asyncio tasks copy
+the context when they are created, so concurrent plan tasks share it too.
+
+Every stage gets its own timeout, capped by what is left of the budget minus a
+reserve kept for writing a best-effort answer. Time spent in each stage is
+accumulated for the Server-Timing header / job events; stages of concurrent
+tasks add up, so their sum can exceed the wall time.
+"""
+import contextlib
+import contextvars
+import os
+import time
+
+# The README promises an answer within 3 minutes; leave headroom for the response itself
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 170))
+# Kept free at the end of the budget for the fallback answer
+DEADLINE_RESERVE_SECONDS = float(os.environ.get("DEADLINE_RESERVE_SECONDS", 10))
+# Below this much remaining time, retries, repair rounds and peeks are skipped
+DEADLINE_LOW_SECONDS = float(os.environ.get("DEADLINE_LOW_SECONDS", 45))
+LLM_CALL_TIMEOUT_SECONDS = float(os.environ.get("LLM_CALL_TIMEOUT_SECONDS", 60))
+SCRIPT_TIMEOUT_SECONDS = float(os.environ.get("SCRIPT_TIMEOUT_SECONDS", 90))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage can't start (or didn't finish) within the request's budget."""
+    pass
+
+
+class Deadline:
+    def __init__(self, budget_seconds: float = REQUEST_DEADLINE_SECONDS, reserve_seconds: float = DEADLINE_RESERVE_SECONDS):
+        self.budget_seconds = budget_seconds
+        self.reserve_seconds = reserve_seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_seconds
+        self.timings = {}
+
+    def remaining(self) -> float:
+        """Seconds left for work, i.e. without the reserve."""
+        return self.expires_at - self.reserve_seconds - time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def low(self) -> bool:
+        """True once optional work (retries, repair rounds, peeks) should be skipped."""
+        return self.remaining() < DEADLINE_LOW_SECONDS
+
+    def timeout(self, stage_timeout: float) -> float:
+        """The timeout for the next stage: its own limit, capped by the budget left."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.budget_seconds:.0f}s exceeded")
+        return min(stage_timeout, remaining)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def add(self, name: str, seconds: float):
+        """Accounts time measured elsewhere (e.g. in a shared task) to `name`."""
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def report(self) -> dict:
+        """Seconds per stage plus the total wall time, rounded for display."""
+        report = {name: round(seconds, 3) for name, seconds in self.timings.items()}
+        report["total"] = round(self.elapsed(), 3)
+        return report
+
+    def server_timing(self) -> str:
+        """The report as a Server-Timing header value (durations in milliseconds)."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.report().items())
+
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current():
+    """The Deadline of the request being served, or None outside of one."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def running(budget_seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Makes a new Deadline current for the block (and every task created in it)."""
+    deadline = Deadline(budget_seconds)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Accounts the block to `name` on the current deadline, if there is one."""
+    deadline = current()
+    if deadline is None:
+        yield
+        return
+    with deadline.stage(name):
+        yield
+
+
+def account(name: str, seconds: float):
+    """Adds `seconds` to stage `name` on the current deadline, if there is one."""
+    deadline = current()
+    if deadline is not None:
+        deadline.add(name, seconds)
+
+
+def stage_timeout(stage_timeout: float):
+    """Timeout for a stage under the current deadline (just `stage_timeout` without one)."""
+    deadline = current()
+    if deadline is None:
+        return stage_timeout
+    return deadline.timeout(stage_timeout)
+
+
+def remaining_timeout():
+    """What is left of the current deadline's budget as a timeout, None without one."""
+    deadline = current()
+    if deadline is None:
+        return None
+    return deadline.timeout(deadline.remaining())
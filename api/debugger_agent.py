@@ -3,18 +3,23 @@
 
 import json
 import base64
+import asyncio
 import os
-from google import genai
 from google.genai import types
+import llm
 from dotenv import load_dotenv
 load_dotenv()
 
-def debug_code(task: dict,last_task_output:str, failed_code: str, error_message: str) -> str:
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
+# Models cycled through when asking for several repair candidates at once
+CANDIDATE_MODELS = [m.strip() for m in os.environ.get("DEBUG_CANDIDATE_MODELS", DEFAULT_MODEL).split(",") if m.strip()]
+# Temperatures cycled through for the candidates; None keeps the model default
+CANDIDATE_TEMPERATURES = [None, 0.4, 0.9, 1.3]
+
+async def debug_code(task: dict,last_task_output:str, failed_code: str, error_message: str,
+                     model: str = None, temperature: float = None) -> str:
 
-    model = "gemini-2.5-flash-lite"
+    model = model or DEFAULT_MODEL
     contents = [
         types.Content(
             role="user",
@@ -36,6 +41,7 @@ def debug_code(task: dict,last_task_output:str, failed_code: str, error_message:
         ),
     ]
     generate_content_config = types.GenerateContentConfig(
+        temperature=temperature,
         system_instruction=[
             types.Part.from_text(text="""# ROLE AND GOAL
 You are a world-class, automated Python debugging service. Your sole purpose is to receive a Python script that has failed, analyze the error, and provide a fully corrected version of the script that is ready for immediate re-execution.
@@ -62,6 +68,7 @@ Before writing any code, you must internally follow these steps:
 * **Return the Complete Script:** Your output **MUST** be the entire, fully corrected Python script from top to bottom. Do not provide only the changed lines or a patch.
 * **Preserve Original Intent:** The corrected script must still achieve the `ORIGINAL TASK`'s goal. It must use the same input and output file paths that were defined in the failed script.
 * **Maintain Best Practices:** Ensure the corrected code is clean, readable, and continues to follow any best practices mentioned in the original code (like logging progress with `print` statements).
+* **Arrow Artifacts:** Files ending in `.arrow` are Arrow IPC files, not Parquet. If the script reads or writes one with `pd.read_parquet()` / `df.to_parquet()` (or `pd.read_csv()` / `df.to_csv()`), replace those calls with `from artifact_io import read_table, write_table`, then `df = read_table("task_1_movies.arrow")` and `write_table(df, "task_2_summary.arrow")`. Keep `pd.read_parquet()` / `df.to_parquet()` for files ending in `.parquet`.
 
 ---
 # OUTPUT SPECIFICATION
@@ -72,13 +79,34 @@ Before writing any code, you must internally follow these steps:
         ],
     )
 
-    response = client.models.generate_content(
+    text = await llm.generate_text(
         model=model,
         contents=contents,
         config=generate_content_config,
     )
-    # print(response.text)
-    return response.text
+    return text
+
+
+async def debug_candidates(task: dict, last_task_output: str, failed_code: str, error_message: str,
+                           k: int) -> list:
+    """
+    Asks for k repair candidates at once, varying model and temperature so they
+    differ. Failed or empty generations are dropped.
+    """
+    calls = [
+        debug_code(task, last_task_output, failed_code, error_message,
+                   model=CANDIDATE_MODELS[i % len(CANDIDATE_MODELS)],
+                   temperature=CANDIDATE_TEMPERATURES[i % len(CANDIDATE_TEMPERATURES)])
+        for i in range(k)
+    ]
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    candidates = []
+    for result in results:
+        if isinstance(result, BaseException):
+            print(f"Repair candidate generation failed: {result}")
+        elif result:
+            candidates.append(result)
+    return candidates
     # for chunk in client.models.generate_content_stream(
     #     model=model,
     #     contents=contents,
@@ -0,0 +1,226 @@
+"""
+Decides whether the imports of a generated script can be satisfied, without
+importing anything into the server process, and installs what is missing.
+
+- Availability is checked with importlib.util.find_spec (no module code runs).
+- Import names are mapped to distribution names (bs4 -> beautifulsoup4, ...).
+- Verdicts are cached in memory, and PyPI lookups also on disk, across requests.
+- DEPENDENCY_ALLOWLIST / DEPENDENCY_ALLOWLIST_FILE restrict what may be installed;
+  with DEPENDENCY_OFFLINE=1 PyPI is never contacted and only the allowlist counts.
+- DEPENDENCY_WHEELHOUSE installs from a local wheel directory (pip --no-index).
+- DEPENDENCY_SITE_DIR is a shared target directory for installs, added to the
+  import path of the server and every script it runs. Pre-build it off the
+  request path with `python dependency_resolver.py --prebuild`.
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import requests
+
+DEPENDENCY_OFFLINE = os.environ.get("DEPENDENCY_OFFLINE", "0") in ("1", "true", "on")
+DEPENDENCY_WHEELHOUSE = os.environ.get("DEPENDENCY_WHEELHOUSE")
+DEPENDENCY_SITE_DIR = os.environ.get("DEPENDENCY_SITE_DIR")
+DEPENDENCY_CACHE_PATH = os.environ.get("DEPENDENCY_CACHE_PATH", "dependency_verdicts.json")
+PYPI_TIMEOUT_SECONDS = float(os.environ.get("PYPI_TIMEOUT_SECONDS", 5))
+
+# Import names whose distribution on PyPI is called something else
+IMPORT_TO_DIST = {
+    "bs4": "beautifulsoup4",
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "PIL": "pillow",
+    "cv2": "opencv-python-headless",
+    "yaml": "pyyaml",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "docx": "python-docx",
+    "pptx": "python-pptx",
+    "fitz": "pymupdf",
+    "Crypto": "pycryptodome",
+    "Levenshtein": "python-levenshtein",
+    "magic": "python-magic",
+    "serial": "pyserial",
+    "jwt": "pyjwt",
+    "git": "gitpython",
+    "OpenSSL": "pyopenssl",
+    "attr": "attrs",
+    "google": "google-genai",
+    "mpl_toolkits": "matplotlib",
+}
+
+
+class DependencyError(Exception):
+    """Custom exception for dependency issues."""
+    pass
+
+
+def _load_allowlist():
+    names = []
+    if os.environ.get("DEPENDENCY_ALLOWLIST"):
+        names += os.environ["DEPENDENCY_ALLOWLIST"].split(",")
+    path = os.environ.get("DEPENDENCY_ALLOWLIST_FILE")
+    if path and os.path.exists(path):
+        with open(path) as f:
+            names += [line.split("#")[0] for line in f]
+    names = {_normalize(n) for n in names if n.strip()}
+    return names or None
+
+
+def _normalize(dist: str) -> str:
+    return dist.strip().lower().replace("_", "-")
+
+
+def dist_name(module: str) -> str:
+    return IMPORT_TO_DIST.get(module, module)
+
+
+if DEPENDENCY_SITE_DIR:
+    # Make the shared environment importable here and in every process we start
+    DEPENDENCY_SITE_DIR = os.path.abspath(DEPENDENCY_SITE_DIR)
+    os.makedirs(DEPENDENCY_SITE_DIR, exist_ok=True)
+    if DEPENDENCY_SITE_DIR not in sys.path:
+        sys.path.append(DEPENDENCY_SITE_DIR)
+    python_path = os.environ.get("PYTHONPATH", "")
+    if DEPENDENCY_SITE_DIR not in python_path.split(os.pathsep):
+        os.environ["PYTHONPATH"] = os.pathsep.join(p for p in (python_path, DEPENDENCY_SITE_DIR) if p)
+
+
+class DependencyResolver:
+    def __init__(self):
+        self.allowlist = _load_allowlist()
+        self._available = set()
+        self._lock = threading.Lock()
+        self._install_locks = {}
+        self._pypi_verdicts = self._load_verdicts()
+        self.cache_hits = 0
+        self.installs = 0
+
+    # -- verdict cache -----------------------------------------------------
+
+    def _load_verdicts(self) -> dict:
+        try:
+            with open(DEPENDENCY_CACHE_PATH) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_verdicts(self):
+        tmp_path = f"{DEPENDENCY_CACHE_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._pypi_verdicts, f)
+            os.replace(tmp_path, DEPENDENCY_CACHE_PATH)
+        except OSError as e:
+            print(f"Could not persist dependency verdicts: {e}")
+
+    # -- checks --------------------------------------------------------------
+
+    def is_available(self, module: str, work_dir: str = None) -> bool:
+        """True if `module` can be imported by a script, found without importing it."""
+        if module in self._available:
+            self.cache_hits += 1
+            return True
+        if module in sys.stdlib_module_names or module in sys.builtin_module_names:
+            found = True
+        elif work_dir and (
+            os.path.exists(os.path.join(work_dir, f"{module}.py"))
+            or os.path.isdir(os.path.join(work_dir, module))
+        ):
+            # a helper module shipped next to the script
+            found = True
+        else:
+            try:
+                found = importlib.util.find_spec(module) is not None
+            except (ImportError, ValueError):
+                found = False
+        if found:
+            self._available.add(module)
+        return found
+
+    def is_installable(self, dist: str) -> bool:
+        """Allowlist first; otherwise ask PyPI (cached), unless running offline."""
+        if self.allowlist is not None:
+            return _normalize(dist) in self.allowlist
+        if DEPENDENCY_OFFLINE:
+            return False
+        key = _normalize(dist)
+        if key in self._pypi_verdicts:
+            self.cache_hits += 1
+            return self._pypi_verdicts[key]
+        try:
+            response = requests.get(f"https://pypi.org/pypi/{dist}/json", timeout=PYPI_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            # don't cache network failures
+            raise DependencyError(f"Could not verify '{dist}' with PyPI: {e}")
+        verdict = response.status_code == 200
+        with self._lock:
+            self._pypi_verdicts[key] = verdict
+            self._save_verdicts()
+        return verdict
+
+    # -- installation --------------------------------------------------------
+
+    def pip_command(self, dists: list) -> list:
+        command = [sys.executable, "-m", "pip", "install", "--disable-pip-version-check"]
+        if DEPENDENCY_WHEELHOUSE:
+            command += ["--no-index", "--find-links", DEPENDENCY_WHEELHOUSE]
+        if DEPENDENCY_SITE_DIR:
+            command += ["--target", DEPENDENCY_SITE_DIR]
+        return command + list(dists)
+
+    def install(self, dist: str):
+        with self._lock:
+            lock = self._install_locks.setdefault(_normalize(dist), threading.Lock())
+        # Concurrent requests missing the same package wait for a single install
+        with lock:
+            print(f"Installing '{dist}'...")
+            subprocess.run(self.pip_command([dist]), check=True, capture_output=True, text=True)
+            importlib.invalidate_caches()
+            self.installs += 1
+            print(f"Successfully installed '{dist}'.")
+
+    def ensure(self, modules: set, work_dir: str = None):
+        """Makes every module importable, or raises DependencyError. Blocking; run it in a thread."""
+        for module in sorted(modules):
+            if self.is_available(module, work_dir):
+                continue
+            dist = dist_name(module)
+            print(f"Dependency '{module}' not found, resolving distribution '{dist}'...")
+            if not self.is_installable(dist):
+                raise DependencyError(f"LLM hallucinated a non-existent or disallowed package: '{module}'")
+            try:
+                self.install(dist)
+            except subprocess.CalledProcessError as e:
+                raise DependencyError(f"Could not install '{dist}': {e.stderr.strip()[-500:]}")
+            if not self.is_available(module, work_dir):
+                raise DependencyError(f"Installed '{dist}' but '{module}' is still not importable")
+
+    async def ensure_async(self, modules: set, work_dir: str = None):
+        # Fast path without a thread hop when everything is already known to be available
+        if all(module in self._available for module in modules):
+            self.cache_hits += len(modules)
+            return
+        await asyncio.to_thread(self.ensure, modules, work_dir)
+
+    def prebuild(self):
+        """Installs the whole allowlist into the shared environment ahead of time."""
+        if not self.allowlist:
+            print("DEPENDENCY_ALLOWLIST / DEPENDENCY_ALLOWLIST_FILE is empty, nothing to pre-build.")
+            return
+        print(f"Pre-building {len(self.allowlist)} packages into {DEPENDENCY_SITE_DIR or sys.prefix}")
+        subprocess.run(self.pip_command(sorted(self.allowlist)), check=True)
+
+
+resolver = DependencyResolver()
+
+
+if __name__ == "__main__":
+    if "--prebuild" in sys.argv:
+        resolver.prebuild()
+    else:
+        print("usage: python dependency_resolver.py --prebuild")
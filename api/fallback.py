@@ -0,0 +1,48 @@
+"""
+Best-effort answer for requests that ran out of time: a final_output.json in the
+shape the questions ask for, with placeholders where no answer was computed.
+"""
+import json
+import os
+import re
+
+# Present in a workspace whose final_output.json is a fallback, so it is never cached
+FALLBACK_MARKER = ".fallback_answer"
+
+_JSON_KEY_PATTERN = re.compile(r'"([^"\n]{1,80})"\s*:')
+_NUMBERED_QUESTION_PATTERN = re.compile(r"^\s*(\d{1,2})[.)]\s+\S", re.MULTILINE)
+
+
+def placeholder_answer(questions: str):
+    """
+    A JSON object with the keys quoted in the questions, or else a JSON array with
+    one entry per numbered question. Every answer is null.
+    """
+    keys = list(dict.fromkeys(_JSON_KEY_PATTERN.findall(questions or "")))
+    if keys:
+        return {key: None for key in keys}
+    numbers = [int(n) for n in _NUMBERED_QUESTION_PATTERN.findall(questions or "")]
+    if numbers:
+        return [None] * max(len(set(numbers)), max(numbers))
+    return [None]
+
+
+def write_fallback(work_dir: str, questions: str):
+    """
+    Returns the final result for a request that ran out of time. A final_output.json
+    already written by a task is kept; otherwise placeholders are written.
+    """
+    path = os.path.join(work_dir, "final_output.json")
+    result = None
+    try:
+        with open(path) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if result is None:
+        result = placeholder_answer(questions)
+        with open(path, "w") as f:
+            json.dump(result, f)
+    with open(os.path.join(work_dir, FALLBACK_MARKER), "w") as f:
+        f.write("deadline exceeded\n")
+    return result
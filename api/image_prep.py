@@ -0,0 +1,145 @@
+"""
+Prepares images for the vision agent: detects the real MIME type from the file's
+bytes and shrinks oversized images before they are uploaded.
+
+Identical images (same content hash and dimensions) are prepared once and
+deduplicated, see fingerprint().
+
+Images larger than VISION_MAX_PIXELS (on their longest side) are downscaled, and
+images still above VISION_MAX_IMAGE_KB are recompressed as JPEG with decreasing
+quality. Pillow is imported lazily; without it images are sent as they are.
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+VISION_MAX_PIXELS = int(os.environ.get("VISION_MAX_PIXELS", 1536))
+VISION_MAX_IMAGE_BYTES = int(os.environ.get("VISION_MAX_IMAGE_KB", 1024)) * 1024
+VISION_JPEG_QUALITIES = (90, 80, 70, 55, 40)
+# Prepared images kept in memory, so the same chart in several tasks/requests is shrunk once
+VISION_PREP_CACHE_ENTRIES = int(os.environ.get("VISION_PREP_CACHE_ENTRIES", 64))
+
+# (magic prefix, MIME type) of the formats Gemini accepts inline
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def detect_mime_type(data: bytes, filename: str = None) -> str:
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    guessed = mimetypes.guess_type(filename or "")[0]
+    return guessed or "application/octet-stream"
+
+
+def _dimensions(data: bytes):
+    """(width, height) read from the image header only, or (None, None)."""
+    try:
+        from PIL import Image
+        return Image.open(io.BytesIO(data)).size
+    except Exception:
+        return None, None
+
+
+def fingerprint(data: bytes) -> tuple:
+    """Cheap identity of an image: sha256 of its bytes plus its dimensions."""
+    width, height = _dimensions(data)
+    return hashlib.sha256(data).hexdigest(), width, height
+
+
+class PreparedImage:
+    """Bytes ready for an inline part, plus what we know about the original."""
+    def __init__(self, name: str, data: bytes, mime_type: str, width: int = None, height: int = None,
+                 original_bytes: int = None, fingerprint: tuple = None):
+        self.name = name
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.original_bytes = original_bytes if original_bytes is not None else len(data)
+        self.fingerprint = fingerprint
+
+    def renamed(self, name: str):
+        return PreparedImage(name, self.data, self.mime_type, self.width, self.height,
+                             self.original_bytes, self.fingerprint)
+
+
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def _downscale(data: bytes, mime_type: str, max_pixels: int, max_bytes: int):
+    """Returns (data, mime type, width, height) after resizing / recompressing if needed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime_type, None, None
+
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if max(width, height) <= max_pixels and len(data) <= max_bytes:
+        return data, mime_type, width, height
+
+    image.load()
+    if max(width, height) > max_pixels:
+        image.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+    width, height = image.size
+
+    if image.mode in ("RGBA", "LA", "P") and mime_type == "image/png":
+        # keep transparency (and crisp chart lines) as long as the PNG fits the budget
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue(), "image/png", width, height
+
+    if image.mode != "RGB":
+        background = Image.new("RGB", image.size, "white")
+        converted = image.convert("RGBA")
+        background.paste(converted, mask=converted.split()[-1])
+        image = background
+    for quality in VISION_JPEG_QUALITIES:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            break
+    return buffer.getvalue(), "image/jpeg", width, height
+
+
+def prepare_image(path: str, max_pixels: int = VISION_MAX_PIXELS, max_bytes: int = VISION_MAX_IMAGE_BYTES) -> PreparedImage:
+    """Reads an image and returns it within the pixel / byte budget. Blocking; run it in a thread."""
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.basename(path)
+    identity = fingerprint(data) + (max_pixels, max_bytes)
+    with _prepared_lock:
+        cached = _prepared.get(identity)
+        if cached is not None:
+            _prepared.move_to_end(identity)
+            return cached.renamed(name)
+
+    mime_type = detect_mime_type(data, name)
+    try:
+        prepared, mime_type, width, height = _downscale(data, mime_type, max_pixels, max_bytes)
+    except Exception as e:
+        # Pillow can't read it (e.g. HEIC without a plugin): let Gemini have the original
+        print(f"Could not downscale {name}: {e}")
+        prepared, width, height = data, None, None
+    image = PreparedImage(name, prepared, mime_type, width, height, original_bytes=len(data),
+                          fingerprint=identity[:3])
+    with _prepared_lock:
+        _prepared[identity] = image
+        while len(_prepared) > VISION_PREP_CACHE_ENTRIES:
+            _prepared.popitem(last=False)
+    return image
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import sys
+import time
+
+# Number of workflows executed at the same time by the job workers
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 2))
+# Jobs waiting for a worker; submissions beyond this are rejected instead of queued
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 20))
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+
+SHUTDOWN_ERROR = "Server shutting down"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+    pass
+
+
+class Job:
+    """A single queued workflow run and the progress events it has reported so far."""
+    def __init__(self, job_id: str, runner):
+        self.job_id = job_id
+        # coroutine function taking an `on_event` callback and returning the final result
+        self.runner = runner
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def add_event(self, event: dict):
+        event = {"seq": len(self.events), "time": time.time(), **event}
+        self.events.append(event)
+        # wake up every stream waiting on this job, then re-arm for the next event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_event(self, seq: int, timeout: float):
+        """Waits until an event with sequence number >= seq exists (or the timeout passes)."""
+        if len(self.events) > seq:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": self.events,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Bounded job queue drained by a fixed number of worker coroutines.
+
+    submit() never blocks: once JOB_QUEUE_SIZE jobs are waiting it raises
+    QueueFullError so the API can shed load with a 503.
+    """
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, max_queue: int = JOB_QUEUE_SIZE,
+                 retention_seconds: int = JOB_RETENTION_SECONDS):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.retention_seconds = retention_seconds
+        self.jobs = {}
+        self._queue = None
+        self._workers = []
+        self._stopping = False
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def start(self):
+        if self._workers:
+            return
+        self._stopping = False
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Cancels the workers and fails every job that hasn't finished (running ones through
+        their worker, queued ones here), so pollers and SSE streams get a final event.
+        """
+        self._stopping = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in self.jobs.values():
+            if not job.done:
+                job.status = "failed"
+                job.error = SHUTDOWN_ERROR
+                job.finished_at = time.time()
+                self.failed += 1
+                job.add_event({"type": "finished", "status": job.status, "error": job.error})
+
+    def admit(self) -> bool:
+        """
+        Cheap admission check done before the upload is received, so rejected
+        clients don't pay for sending their files. Counts the rejection if full.
+        """
+        if self._queue is not None and self._queue.full():
+            self.rejected += 1
+            return False
+        return True
+
+    def submit(self, job_id: str, runner) -> Job:
+        if self._queue is None:
+            raise RuntimeError("JobManager.start() must be called before submitting jobs")
+        self._prune()
+        job = Job(job_id, runner)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queue} jobs waiting)")
+        self.jobs[job_id] = job
+        self.submitted += 1
+        job.add_event({"type": "queued", "queue_position": self._queue.qsize()})
+        return job
+
+    def submit_finished(self, job_id: str, result) -> Job:
+        """Records a job that needs no worker because its result is already known (e.g. cached)."""
+        self._prune()
+        job = Job(job_id, runner=None)
+        job.status = "succeeded"
+        job.result = result
+        job.started_at = job.finished_at = time.time()
+        self.jobs[job_id] = job
+        self.submitted += 1
+        self.succeeded += 1
+        job.add_event({"type": "finished", "status": job.status, "cached": True})
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def metrics(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_capacity": self.max_queue,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retained_jobs": len(self.jobs),
+        }
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.done and job.finished_at < cutoff:
+                del self.jobs[job_id]
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            self.running += 1
+            job.status = "running"
+            job.started_at = time.time()
+            job.add_event({"type": "started", "worker": index})
+            try:
+                job.result = await job.runner(job.add_event)
+                # TaskOrchestrator reports workflow failures as a result dict, not an exception
+                if isinstance(job.result, dict) and job.result.get("status") == "failed":
+                    job.status = "failed"
+                    job.error = job.result.get("reason") or job.result.get("last_error")
+                    self.failed += 1
+                else:
+                    job.status = "succeeded"
+                    self.succeeded += 1
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = SHUTDOWN_ERROR if self._stopping else "Job was cancelled"
+                self.failed += 1
+                raise
+            except Exception as e:
+                print(f"Job {job.job_id} failed: {e}", file=sys.stderr)
+                job.status = "failed"
+                job.error = str(e)
+                self.failed += 1
+            finally:
+                self.running -= 1
+                job.finished_at = time.time()
+                job.add_event({"type": "finished", "status": job.status, "error": job.error})
+                self._queue.task_done()
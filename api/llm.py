@@ -0,0 +1,223 @@
+"""
+Single entry point for every Gemini call made by the agents, so cross-cutting
+concerns (shared clients, response caching, deadlines, tracing, rate limits,
+...) live in one place instead of four.
+"""
+import asyncio
+import contextvars
+import re
+import time
+
+from google.genai import errors
+
+import deadline
+import llm_cache
+import llm_client
+import llm_trace
+import rate_limiter
+import tracing
+
+# Gemini's status codes worth another try: quota exhausted / model overloaded
+RETRYABLE_CODES = (429, 503)
+# Tokens Gemini counts for an inline image, whatever its size
+IMAGE_TOKENS = 258
+
+# Calls in flight by cache key; identical concurrent calls (one chart used by two
+# vision tasks, two requests with the same prompt) share a single request
+_inflight = {}
+coalesced_calls = 0
+
+
+class _SharedCall:
+    """
+    A network call shared by every caller of the same key. Its task runs in an empty
+    context, so no caller's deadline, span or trace leaks into it; what it measured
+    is handed back in `attributes` for the caller that started it.
+    """
+    def __init__(self, priority: int):
+        # the most urgent priority among the callers, used when (re)queueing for quota
+        self.priority = priority
+        self.attributes = {}
+        self.queued_seconds = 0.0
+        self.task = None
+
+
+def _retry_after(error: errors.APIError) -> float:
+    """The retryDelay of a quota error (e.g. "17s"), if the server sent one."""
+    details = error.details.get("error", {}).get("details") if isinstance(error.details, dict) else None
+    for detail in details or []:
+        match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+async def _send(model: str, contents: list, config, client, tokens: int, shared: _SharedCall):
+    """
+    One generate_content call under the rate limiter (see rate_limiter.py): waits for
+    a key with quota left, and retries 429 / 503 answers with backoff, on whichever
+    key is free by then.
+    """
+    for attempt in range(rate_limiter.LLM_RETRY_ATTEMPTS + 1):
+        # Waiting for quota and the call itself are each bounded by LLM_CALL_TIMEOUT_SECONDS;
+        # the callers' deadlines bound how long they wait for the result, see _cached_or_generated
+        started = time.monotonic()
+        try:
+            lease = await asyncio.wait_for(rate_limiter.limiter.acquire(model, tokens, shared.priority),
+                                           timeout=deadline.stage_timeout(deadline.LLM_CALL_TIMEOUT_SECONDS))
+        finally:
+            shared.queued_seconds += time.monotonic() - started
+        try:
+            call_client = client or llm_client.registry.get(model, lease.api_key)
+            response = await asyncio.wait_for(
+                call_client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=config,
+                ),
+                timeout=deadline.stage_timeout(deadline.LLM_CALL_TIMEOUT_SECONDS),
+            )
+        except errors.APIError as e:
+            if e.code not in RETRYABLE_CODES or attempt == rate_limiter.LLM_RETRY_ATTEMPTS:
+                raise
+            cooldown = lease.throttled(attempt, _retry_after(e))
+            print(f"Gemini {e.code} for {model} on key {lease.key.index}, "
+                  f"retrying (attempt {attempt + 2}, key cooling down {cooldown:.1f}s)")
+            continue
+        finally:
+            lease.release()
+        usage = response.usage_metadata
+        if usage is not None:
+            lease.settle(usage.total_token_count or 0)
+        shared.attributes.update({"llm.queue_seconds": lease.queued_seconds, "llm.retries": attempt,
+                                  "llm.key": lease.key.index})
+        return response
+
+
+async def _generate(model: str, contents: list, config, client, key, shared: _SharedCall) -> str:
+    response = await _send(model, contents, config, client, _estimated_tokens(contents, config), shared)
+    text = response.text
+    usage = response.usage_metadata
+    if usage is not None:
+        shared.attributes.update({"llm.prompt_tokens": usage.prompt_token_count,
+                                  "llm.response_tokens": usage.candidates_token_count})
+
+    # Empty answers are treated as failures by the callers, don't pin them in the cache
+    cache = llm_cache.cache
+    if cache.enabled and text:
+        await cache.set(key, text)
+    return text
+
+
+def _forget(key: str, shared: _SharedCall, call: asyncio.Task):
+    if _inflight.get(key) is shared:
+        del _inflight[key]
+    if not call.cancelled():
+        # mark the exception as retrieved even if every caller was cancelled meanwhile
+        call.exception()
+
+
+def _prompt_bytes(contents: list, config) -> int:
+    """Size of the text and inline data sent with a call, system prompt included."""
+    parts = list(getattr(config, "system_instruction", None) or [])
+    for content in contents:
+        parts += content.parts or []
+    total = 0
+    for part in parts:
+        if getattr(part, "text", None):
+            total += len(part.text.encode())
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and inline.data:
+            total += len(inline.data)
+    return total
+
+
+def _estimated_tokens(contents: list, config) -> int:
+    """Prompt tokens of a call before sending it, for the tokens-per-minute buckets."""
+    parts = list(getattr(config, "system_instruction", None) or [])
+    for content in contents:
+        parts += content.parts or []
+    tokens = 0
+    for part in parts:
+        if getattr(part, "text", None):
+            # ~4 bytes per token for English text and code
+            tokens += len(part.text.encode()) // 4
+        if getattr(part, "inline_data", None) is not None:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+async def _replay(trace: llm_trace.Trace, key: str, model: str, config) -> str:
+    """Answers from the trace being replayed; never touches the network."""
+    entry = trace.lookup(key, llm_trace.agent_signature(model, config))
+    if trace.replay_latency:
+        await asyncio.sleep(entry["latency_ms"] / 1000)
+    return entry["response"]
+
+
+async def _cached_or_generated(model: str, contents: list, config, client, key: str) -> tuple:
+    """Returns (text, source) where source is "cache", "coalesced" or "network"."""
+    global coalesced_calls
+    cache = llm_cache.cache
+    if cache.enabled:
+        cached = await cache.get(key)
+        if cached is not None:
+            return cached, "cache"
+
+    shared = _inflight.get(key)
+    source = "network"
+    priority = rate_limiter.current_priority()
+    if shared is None or shared.task.get_loop() is not asyncio.get_running_loop():
+        shared = _SharedCall(priority)
+        # an empty context: the call outlives its first caller and serves the others too
+        shared.task = asyncio.create_task(_generate(model, contents, config, client, key, shared),
+                                          context=contextvars.Context())
+        _inflight[key] = shared
+        shared.task.add_done_callback(lambda done: _forget(key, shared, done))
+    else:
+        coalesced_calls += 1
+        source = "coalesced"
+        # takes effect the next time the call queues for quota (e.g. after a 429)
+        shared.priority = min(shared.priority, priority)
+
+    # shielded: one caller being cancelled (or running out of time) must not cancel
+    # the call for the others; each caller waits no longer than its own deadline allows
+    text = await asyncio.wait_for(asyncio.shield(shared.task), timeout=deadline.remaining_timeout())
+    if source == "network":
+        deadline.account("llm_queue", shared.queued_seconds)
+        tracing.annotate(**shared.attributes)
+    return text, source
+
+
+async def _traced_call(model: str, contents: list, config, client) -> tuple:
+    """Returns (text, source), answering from / recording into the request's llm_trace."""
+    key = llm_cache.make_key(model, contents, config)
+    trace = llm_trace.current()
+    if trace is not None and trace.replay:
+        return await _replay(trace, key, model, config), "replay"
+
+    started = time.monotonic()
+    text, source = await _cached_or_generated(model, contents, config, client, key)
+    if trace is not None:
+        try:
+            trace.record(key, llm_trace.agent_signature(model, config), model, text,
+                         time.monotonic() - started, source)
+        except OSError as e:
+            print(f"Could not record LLM call in {trace.path}: {e}")
+    return text, source
+
+
+async def generate_text(model: str, contents: list, config, client=None) -> str:
+    """
+    Returns the text of `generate_content`, served from llm_cache when possible.
+    The shared client for `model` comes from llm_client unless one is passed in.
+    Calls are recorded into / answered from the request's trace, see llm_trace.py,
+    and each one is an llm_call span (sizes, tokens, source), see tracing.py.
+    Network calls are rate limited and spread over the API keys, see rate_limiter.py.
+    """
+    with tracing.span("llm_call", **{"llm.model": model,
+                                     "llm.prompt_bytes": _prompt_bytes(contents, config)}) as span:
+        text, source = await _traced_call(model, contents, config, client)
+        if span is not None:
+            span.set(**{"llm.source": source, "llm.response_bytes": len((text or "").encode())})
+        return text
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# "memory", "sqlite" (memory in front of an on-disk SQLite file) or "off"
+LLM_CACHE = os.environ.get("LLM_CACHE", "memory").lower()
+LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1000))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_MAX_MB = int(os.environ.get("LLM_CACHE_MAX_MB", 256))
+
+
+def _part_fingerprint(part) -> dict:
+    """Describes a types.Part by its text, or by a hash of its inline bytes."""
+    if getattr(part, "text", None) is not None:
+        return {"text": part.text}
+    inline = getattr(part, "inline_data", None)
+    if inline is not None:
+        return {"mime_type": inline.mime_type, "sha256": hashlib.sha256(inline.data or b"").hexdigest()}
+    return {"other": part.model_dump(mode="json", exclude_none=True)}
+
+
+def make_key(model: str, contents: list, config) -> str:
+    """
+    Content-addressed cache key: model, system prompt, the remaining generation
+    config, and the text / image-byte hashes of every content part.
+    """
+    system = []
+    settings = {}
+    if config is not None:
+        system = [_part_fingerprint(p) for p in (config.system_instruction or [])]
+        settings = config.model_dump(mode="json", exclude_none=True, exclude={"system_instruction", "http_options"})
+    payload = {
+        "model": model,
+        "system": system,
+        "config": settings,
+        "contents": [
+            {"role": c.role, "parts": [_part_fingerprint(p) for p in (c.parts or [])]}
+            for c in contents
+        ],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU with a TTL per entry."""
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    On-disk cache shared by every worker process on the host. Entries expire
+    after the TTL; beyond max_entries / max_bytes the least recently read go first.
+    """
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_bytes: int = LLM_CACHE_MAX_MB * 1024 * 1024, ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:  # commits, or rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode()), now + self.ttl_seconds, now),
+            )
+            self._evict(db, now)
+
+    def _evict(self, db, now: float):
+        self.evictions += db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,)).rowcount
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            self.evictions += 1
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+
+class LLMCache:
+    """Front object used by llm.py: a memory tier, an optional disk tier, and hit/miss counters."""
+    def __init__(self, memory: MemoryCache = None, disk: SQLiteCache = None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory is not None or self.disk is not None
+
+    async def get(self, key: str):
+        value = self.memory.get(key) if self.memory is not None else None
+        if value is None and self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                # a broken cache must never fail the request
+                print(f"LLM cache read failed: {e}")
+            if value is not None and self.memory is not None:
+                self.memory.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str):
+        self.stores += 1
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except sqlite3.Error as e:
+                print(f"LLM cache write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite" if self.disk is not None else "memory" if self.memory is not None else "off",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "memory_entries": len(self.memory) if self.memory is not None else 0,
+            "evictions": (self.memory.evictions if self.memory is not None else 0)
+                         + (self.disk.evictions if self.disk is not None else 0),
+        }
+
+
+def build_cache(backend: str = LLM_CACHE) -> LLMCache:
+    if backend == "off":
+        return LLMCache()
+    if backend == "sqlite":
+        return LLMCache(memory=MemoryCache(), disk=SQLiteCache())
+    return LLMCache(memory=MemoryCache())
+
+
+cache = build_cache()
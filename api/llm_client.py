@@ -0,0 +1,128 @@
+"""
+Process-wide registry of genai.Client instances.
+
+Building a client per call throws away pooled HTTP connections and TLS sessions.
+The registry hands out one long-lived client per distinct configuration, each
+backed by its own keep-alive httpx pools (sync and async).
+
+Per-model settings come from GEMINI_MODEL_CONFIG, a JSON object such as
+    {"gemini-2.5-flash": {"base_url": "http://127.0.0.1:9000", "timeout_seconds": 60}}
+Tests and benchmarks can point everything at a fake server with GEMINI_BASE_URL,
+or replace client construction entirely with registry.set_factory().
+
+With several keys in GEMINI_API_KEYS there is one client per key; which key a
+call uses is decided by rate_limiter.py.
+"""
+import json
+import os
+import threading
+
+import httpx
+from google import genai
+from google.genai import types
+from dotenv import load_dotenv
+load_dotenv()
+
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL")
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", 64))
+LLM_HTTP_MAX_KEEPALIVE = int(os.environ.get("LLM_HTTP_MAX_KEEPALIVE", 32))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", 120))
+LLM_HTTP_TIMEOUT_SECONDS = float(os.environ.get("LLM_HTTP_TIMEOUT_SECONDS", 120))
+
+
+def _load_model_config() -> dict:
+    raw = os.environ.get("GEMINI_MODEL_CONFIG")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        print(f"Ignoring invalid GEMINI_MODEL_CONFIG: {e}")
+        return {}
+
+
+def _default_factory(api_key: str, base_url: str, timeout_seconds: float) -> genai.Client:
+    limits = httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(timeout_seconds)
+    http_options = types.HttpOptions(
+        base_url=base_url,
+        timeout=int(timeout_seconds * 1000),
+        # Our own pools so keep-alive and limits are under our control
+        httpx_client=httpx.Client(limits=limits, timeout=timeout),
+        httpx_async_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+class ClientRegistry:
+    """Hands out shared genai clients keyed by (api key, base url, timeout)."""
+    def __init__(self, factory=None):
+        self._factory = factory or _default_factory
+        self._clients = {}
+        self._overrides = {}
+        self._lock = threading.Lock()
+        self.model_config = _load_model_config()
+        self.created = 0
+
+    def settings_for(self, model: str = None, api_key: str = None) -> tuple:
+        config = self.model_config.get(model, {}) if model else {}
+        api_key = api_key or config.get("api_key") or os.environ.get("GEMINI_API_KEY")
+        base_url = config.get("base_url") or GEMINI_BASE_URL
+        timeout_seconds = float(config.get("timeout_seconds", LLM_HTTP_TIMEOUT_SECONDS))
+        return api_key, base_url, timeout_seconds
+
+    def api_keys(self, model: str = None) -> list:
+        """The keys calls to `model` may use: its pinned api_key, else GEMINI_API_KEYS / GEMINI_API_KEY."""
+        config = self.model_config.get(model, {}) if model else {}
+        if config.get("api_key"):
+            return [config["api_key"]]
+        keys = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
+        return keys or [os.environ.get("GEMINI_API_KEY")]
+
+    def get(self, model: str = None, api_key: str = None) -> genai.Client:
+        if model in self._overrides:
+            return self._overrides[model]
+        settings = self.settings_for(model, api_key)
+        client = self._clients.get(settings)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(settings)
+                if client is None:
+                    client = self._factory(*settings)
+                    self._clients[settings] = client
+                    self.created += 1
+        return client
+
+    def get_async(self, model: str = None, api_key: str = None):
+        """The async interface (`client.aio`) of the shared client for a model."""
+        return self.get(model, api_key).aio
+
+    def register(self, model: str, client):
+        """Pins a specific client (e.g. a fake) for one model."""
+        self._overrides[model] = client
+
+    def set_factory(self, factory):
+        """Replaces how clients are built; drops every client created so far."""
+        self._factory = factory
+        self._clients = {}
+        self._overrides = {}
+
+    async def aclose(self):
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                await client.aio.aclose()
+                client.close()
+            except Exception as e:
+                print(f"Error while closing a genai client: {e}")
+
+
+registry = ClientRegistry()
+
+
+def get_client(model: str = None) -> genai.Client:
+    return registry.get(model)
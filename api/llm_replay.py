@@ -0,0 +1,106 @@
+"""
+Re-runs a recorded request offline, see llm_trace.py.
+
+    python llm_replay.py llm_traces/<session_id> [--repeat 5] [--latency] [--profile out.prof]
+
+The trace's inputs are copied into a scratch workspace and its plan is executed
+by TaskOrchestrator.execute_workflow with every LLM call answered from
+calls.jsonl, so only execution-side work (subprocesses, I/O, dependency checks)
+is left. Prints the wall time and stage timings of each run, how the calls were
+matched, and whether the final result is the recorded one. --profile writes
+cProfile stats of the whole replay for e.g. snakeviz.
+
+The artifact store is off and dependency checks are offline unless the
+environment says otherwise, so a replay really executes every task and makes no
+network calls of its own (scripts that download data still do).
+"""
+import os
+
+# Read by the modules below at import time
+os.environ.setdefault("ARTIFACT_STORE", "0")
+os.environ.setdefault("DEPENDENCY_OFFLINE", "1")
+
+import argparse
+import asyncio
+import cProfile
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+import deadline
+import llm_trace
+import worker_pool
+from orchestrator import TaskOrchestrator
+
+
+async def replay_once(trace_dir: str, request: dict, replay_latency: bool, budget_seconds: float) -> dict:
+    """Executes the recorded plan once in a fresh workspace and reports how it went."""
+    trace = llm_trace.Trace(trace_dir, replay=True, replay_latency=replay_latency)
+    with tempfile.TemporaryDirectory(prefix="replay_") as scratch:
+        work_dir = os.path.join(scratch, "workspace")
+        shutil.copytree(os.path.join(trace_dir, llm_trace.INPUTS_DIR), work_dir)
+        with llm_trace.installed(trace), deadline.running(budget_seconds) as run_deadline:
+            started = time.perf_counter()
+            orchestrator = TaskOrchestrator(request["plan"], work_dir=work_dir,
+                                            data_profiles=request.get("data_profiles"))
+            final_result = await orchestrator.execute_workflow()
+            wall_seconds = time.perf_counter() - started
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "stage_timings": run_deadline.report(),
+        "llm_calls": dict(trace.stats),
+        "matches_recording": final_result == request.get("final_result"),
+        "final_result": final_result,
+    }
+
+
+async def replay(trace_dir: str, repeat: int = 1, replay_latency: bool = False,
+                 budget_seconds: float = deadline.REQUEST_DEADLINE_SECONDS) -> list:
+    request = llm_trace.read_request(trace_dir)
+    if "plan" not in request:
+        raise ValueError(f"{trace_dir} has no recorded plan (the request failed before planning finished)")
+    await worker_pool.start_pool()
+    try:
+        return [await replay_once(trace_dir, request, replay_latency, budget_seconds) for _ in range(repeat)]
+    finally:
+        await worker_pool.stop_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded request without calling the LLM")
+    parser.add_argument("trace_dir", help="a directory under LLM_TRACE_DIR, one per recorded request")
+    parser.add_argument("--repeat", type=int, default=1, help="number of replays")
+    parser.add_argument("--latency", action="store_true", help="wait for each call's recorded latency")
+    parser.add_argument("--budget", type=float, default=deadline.REQUEST_DEADLINE_SECONDS,
+                        help="request deadline in seconds")
+    parser.add_argument("--profile", help="write cProfile stats to this file")
+    parser.add_argument("--json", dest="json_path", help="write the run reports to this file")
+    args = parser.parse_args()
+
+    trace_dir = os.path.abspath(args.trace_dir)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        runs = asyncio.run(replay(trace_dir, args.repeat, args.latency, args.budget))
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    recorded = llm_trace.read_request(trace_dir).get("stage_timings")
+    if recorded:
+        print(f"\nRecorded run: {recorded}")
+    for i, run in enumerate(runs, 1):
+        print(f"Replay {i}: {run['wall_seconds']}s, stages {run['stage_timings']}, "
+              f"LLM calls {run['llm_calls']}, same result: {run['matches_recording']}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(runs, f, indent=2, default=str)
+    sys.exit(0 if all(run["matches_recording"] for run in runs) else 1)
+
+
+if __name__ == "__main__":
+    main()
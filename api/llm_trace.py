@@ -0,0 +1,153 @@
+"""
+Record / replay of the LLM calls of a request.
+
+With LLM_TRACE=record, run_pipeline records every call that goes through
+llm.generate_text (all four agents) into a per-request trace directory:
+    <LLM_TRACE_DIR>/<session_id>/
+        calls.jsonl    one line per call: prompt hash, model, response, latency, source
+        request.json   questions, data profiles, the plan as the planner wrote it and as
+                       executed (after fusion), and the final result
+        inputs/        the workspace as uploaded (data files, converted Parquet copies)
+
+llm_replay.py re-runs TaskOrchestrator.execute_workflow on such a trace with a
+replaying Trace installed: every call is answered from calls.jsonl and nothing
+goes to the network, so execution (subprocesses, I/O, dependency checks) can be
+profiled without LLM variance.
+
+Calls are matched by their prompt hash (llm_cache.make_key). Prompts that differ
+slightly on replay (e.g. a peek printing something random) fall back to the next
+unused recording of the same agent, i.e. same model and system prompt.
+"""
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+LLM_TRACE = os.environ.get("LLM_TRACE", "off").lower()
+LLM_TRACE_DIR = os.environ.get("LLM_TRACE_DIR", "llm_traces")
+RECORDING = LLM_TRACE == "record"
+
+CALLS_FILE = "calls.jsonl"
+REQUEST_FILE = "request.json"
+INPUTS_DIR = "inputs"
+
+
+class TraceMiss(Exception):
+    """A replayed call that was never recorded."""
+    pass
+
+
+def agent_signature(model: str, config) -> str:
+    """Identifies the agent behind a call: its model and system prompt."""
+    system = [getattr(part, "text", None) or "" for part in (getattr(config, "system_instruction", None) or [])]
+    return hashlib.sha256(json.dumps([model, system]).encode()).hexdigest()[:16]
+
+
+class Trace:
+    """A request's trace directory, being recorded or replayed."""
+    def __init__(self, path: str, replay: bool = False, replay_latency: bool = False):
+        self.path = path
+        self.replay = replay
+        # on replay, wait as long as the recorded call took instead of answering at once
+        self.replay_latency = replay_latency
+        self.started_at = time.monotonic()
+        self.stats = {"calls": 0, "exact": 0, "fallback": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_signature = {}
+        if replay:
+            self._load()
+
+    # -- recording --
+
+    def record(self, key: str, signature: str, model: str, response: str, latency: float, source: str):
+        entry = {
+            "key": key,
+            "signature": signature,
+            "model": model,
+            "response": response,
+            "latency_ms": round(latency * 1000, 1),
+            "started_ms": round((time.monotonic() - self.started_at - latency) * 1000, 1),
+            "source": source,
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self.stats["calls"] += 1
+            with open(os.path.join(self.path, CALLS_FILE), "a") as f:
+                f.write(line)
+
+    def update_request(self, **fields):
+        """Merges `fields` into request.json."""
+        path = os.path.join(self.path, REQUEST_FILE)
+        with self._lock:
+            request = read_request(self.path) if os.path.exists(path) else {}
+            request.update(fields)
+            with open(path, "w") as f:
+                json.dump(request, f, indent=2, default=str)
+
+    # -- replay --
+
+    def _load(self):
+        with open(os.path.join(self.path, CALLS_FILE)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry["used"] = False
+                self._by_key.setdefault(entry["key"], []).append(entry)
+                self._by_signature.setdefault(entry["signature"], []).append(entry)
+
+    def lookup(self, key: str, signature: str) -> dict:
+        """The recorded call answering this prompt; raises TraceMiss when there is none."""
+        with self._lock:
+            self.stats["calls"] += 1
+            entries = self._by_key.get(key) or []
+            entry = next((e for e in entries if not e["used"]), None)
+            if entry is None and entries:
+                # asked more often than recorded (e.g. a retry came out the same): answer the same again
+                entry = entries[-1]
+            if entry is not None:
+                self.stats["exact"] += 1
+            else:
+                entry = next((e for e in self._by_signature.get(signature) or [] if not e["used"]), None)
+                if entry is None:
+                    self.stats["misses"] += 1
+                    raise TraceMiss(f"No recorded call for prompt {key[:12]} in {self.path}")
+                self.stats["fallback"] += 1
+            entry["used"] = True
+            return entry
+
+
+def read_request(path: str) -> dict:
+    with open(os.path.join(path, REQUEST_FILE)) as f:
+        return json.load(f)
+
+
+_current = contextvars.ContextVar("llm_trace", default=None)
+
+
+def current():
+    """The Trace of the request being served, or None."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def installed(trace: Trace):
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def start_recording(session_id: str, work_dir: str, root: str = LLM_TRACE_DIR) -> Trace:
+    """Creates the trace directory and snapshots the workspace as uploaded. Blocking."""
+    path = os.path.join(os.path.abspath(root), session_id)
+    os.makedirs(path, exist_ok=True)
+    inputs = os.path.join(path, INPUTS_DIR)
+    shutil.copytree(work_dir, inputs, dirs_exist_ok=True)
+    return Trace(path)
@@ -1,16 +1,51 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from main_agent import task_breakdown
 from orchestrator import TaskOrchestrator
+from workspace import (new_session_id, create_workspace, session_dir,
+                       cleanup_workspace, remove_workspace, sweep_expired_workspaces)
+from jobs import JobManager, QueueFullError
+import worker_pool
+import llm_cache
+import llm_client
+import llm_trace
+import llm
+import tracing
+import rate_limiter
+import sandbox
+import result_cache
+import schema_sniffer
+import upload_stream
+import plan_optimizer
+import deadline
+import fallback
 import subprocess
 import os
 import sys
 import shutil
 import json
+import asyncio
 
-app = FastAPI()
+# Background workers for POST /jobs, see jobs.py
+job_manager = JobManager()
+JOB_RETRY_AFTER_SECONDS = int(os.environ.get("JOB_RETRY_AFTER_SECONDS", 30))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sandbox.protect_server()
+    await worker_pool.start_pool()
+    job_manager.start()
+    yield
+    await job_manager.stop()
+    await worker_pool.stop_pool()
+    await llm_client.registry.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"]) # Allow GET requests from all origins
 # Or, provide more granular control:
@@ -20,6 +55,7 @@ app.add_middleware(
     allow_credentials=True,  # Allow cookies
     allow_methods=["GET", "POST", "PUT", "DELETE"],  # Allow specific methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Session-ID", "X-Result-Cache", "Server-Timing"],  # Let the frontend read these
 )
 
 @app.get("/")
@@ -97,56 +133,311 @@ async def home():
 #     # print(final_result)
 #     # print(type(final_result))
 
-@app.post("/upload")
-async def upload_files(request: Request):
-    form_data = await request.form()
-    files = form_data.multi_items()  # Get all form fields (including files)
+def _read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
 
-    questions = None
-    extra_files = []
 
-    for field_name, uploaded_file in files:
-        
-        if field_name == "questions.txt":
-            # Read questions.txt
-            questions = (await uploaded_file.read()).decode()
-            
+class UploadedBundle:
+    """What receive_upload got: the questions, the saved files and what we learned about them."""
+    def __init__(self, questions: str, files: list, fingerprint: str, data_profiles: list):
+        self.questions = questions
+        self.files = files
+        # identifies the exact bundle for the result cache
+        self.fingerprint = fingerprint
+        # schema_sniffer profiles of the data files
+        self.data_profiles = data_profiles
+
+
+async def receive_upload(request: Request, work_dir: str) -> UploadedBundle:
+    """
+    Streams every uploaded file into the workspace, see upload_stream.py. Data files
+    are profiled (and converted to Parquet) as soon as they are complete, while the
+    rest of the body is still arriving.
+    """
+    profiling = []
+
+    def start_profiling(saved):
+        file_format = schema_sniffer.sniff_format(saved.filename, saved.head)
+        if file_format:
+            profiling.append(asyncio.create_task(
+                asyncio.to_thread(schema_sniffer.profile_file, saved.path, file_format=file_format)
+            ))
+
+    try:
+        questions, saved_files = await upload_stream.receive(request, work_dir, on_file_saved=start_profiling,
+                                                             run_blocking=asyncio.to_thread)
+        if not questions:
+            raise HTTPException(status_code=400, detail="questions.txt is missing or empty")
+    except BaseException as e:
+        for job in profiling:
+            job.cancel()
+        if isinstance(e, upload_stream.UploadTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        if isinstance(e, upload_stream.UploadError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+
+    # the same name uploaded twice: the last part wins, as on disk
+    file_hashes = {saved.filename: saved.sha256 for saved in saved_files}
+    extra_files = list(file_hashes)
+    data_profiles = [profile for profile in await asyncio.gather(*profiling) if profile]
+    return UploadedBundle(questions, extra_files, result_cache.request_fingerprint(questions, file_hashes),
+                          data_profiles)
 
-        # Save other files to disk
-        os.makedirs("session_workspace", exist_ok=True)
-        file_path = f"session_workspace/{uploaded_file.filename}"
-        extra_files.append(uploaded_file.filename)
 
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(uploaded_file.file, buffer)
+async def lookup_cached_result(request: Request, questions: str, fingerprint: str):
+    """
+    Returns (cache_key, cached_result, status). cache_key is None when the result of
+    this request must not be cached; status is reported in the X-Result-Cache header.
+    """
+    if not result_cache.is_cacheable(questions):
+        return None, None, "skip"
+    if result_cache.bypass_requested(request.headers):
+        # don't serve the old answer, but do refresh it
+        return fingerprint, None, "bypass"
+    cached = await asyncio.to_thread(result_cache.lookup, fingerprint)
+    if cached is None:
+        return fingerprint, None, "miss"
+    return fingerprint, cached, "hit"
 
-        uploaded_file.file.close()
 
-    # remove the questions.txt from the extra_files list
-    extra_files = [f for f in extra_files if f != "questions.txt"]
+async def store_cached_result(cache_key: str, work_dir: str, final_result):
+    if cache_key is None or not result_cache.is_valid_result(work_dir, final_result):
+        return
+    try:
+        await asyncio.to_thread(result_cache.store, cache_key, final_result)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Could not store result in the result cache: {e}", file=sys.stderr)
 
-    if not questions:
-        raise HTTPException(status_code=400, detail="questions.txt is missing or empty")
+
+def _trace_request(**fields):
+    """Adds to request.json of the LLM trace being recorded, if any (see llm_trace.py)."""
+    trace = llm_trace.current()
+    if trace is None or trace.replay:
+        return
+    try:
+        trace.update_request(**fields)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Could not update LLM trace {trace.path}: {e}", file=sys.stderr)
+
+
+def _write_json(path: str, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+async def answer_after_deadline(session_id: str, work_dir: str, upload: UploadedBundle, on_event=None):
+    """Best-effort final_output.json for a request that ran out of time, see fallback.py."""
+    print(f"[{session_id}] request deadline exceeded, answering with placeholders", file=sys.stderr)
+    final_result = await asyncio.to_thread(fallback.write_fallback, work_dir, upload.questions)
+    if on_event is not None:
+        on_event({"type": "deadline_exceeded", **deadline.current().report()})
+    return final_result
+
+
+async def run_pipeline(session_id: str, work_dir: str, upload: UploadedBundle, on_event=None):
+    """
+    Plans and executes the questions in the given workspace and returns the final result,
+    within the current request deadline (a new one is started if there is none).
+    """
+    request_deadline = deadline.current()
+    if request_deadline is None:
+        with deadline.running():
+            return await run_pipeline(session_id, work_dir, upload, on_event)
+    if llm_trace.RECORDING and llm_trace.current() is None:
+        trace = await asyncio.to_thread(llm_trace.start_recording, session_id, work_dir)
+        with llm_trace.installed(trace):
+            return await run_pipeline(session_id, work_dir, upload, on_event)
 
     # Process files here as needed
-    questions = questions + f"\nFiles provided with the questions.txt are: {', '.join(extra_files)}"
+    questions = upload.questions + f"\nFiles provided with the questions.txt are: {', '.join(upload.files)}"
+    manifest = schema_sniffer.format_manifest(upload.data_profiles)
+    if manifest:
+        questions = questions + "\n\n" + manifest
 
     try:
-        task = task_breakdown(questions)
+        with deadline.stage("planning"), tracing.span("plan", **{"plan.prompt_bytes": len(questions.encode())}):
+            task = await task_breakdown(questions)
+    except (asyncio.TimeoutError, deadline.DeadlineExceeded):
+        return await answer_after_deadline(session_id, work_dir, upload, on_event)
     except Exception as e:
-        print(f"task_breakdown failed: {e}", file=sys.stderr)
+        print(f"[{session_id}] task_breakdown failed: {e}", file=sys.stderr)
         raise HTTPException(status_code=500, detail="Planner failed. Check GEMINI_API_KEY and logs.")
+    if on_event is not None:
+        on_event({"type": "planned"})
+    _trace_request(session_id=session_id, questions=upload.questions, files=upload.files,
+                   data_profiles=upload.data_profiles, planner_plan=task)
+
+    report = None
+    if plan_optimizer.PLAN_FUSION_ENABLED:
+        try:
+            task, report = plan_optimizer.optimize_plan(task)
+            print(f"[{session_id}] plan optimized: {report}")
+            if on_event is not None:
+                on_event({"type": "plan_optimized", **report})
+        except ValueError as e:
+            # unparseable plans are reported by the orchestrator
+            print(f"[{session_id}] plan optimizer skipped: {e}", file=sys.stderr)
+    # the plan as executed (fused, if the optimizer ran), which is what llm_replay runs
+    _trace_request(plan=task, plan_fusion=report)
 
     try:
-        orchestrator = TaskOrchestrator(task)
-        final_result = orchestrator.execute_workflow()
-        orchestrator.__del__()
-        print(final_result)
-        return final_result
+        orchestrator = TaskOrchestrator(task, work_dir=work_dir, on_event=on_event,
+                                        data_profiles=upload.data_profiles)
+        final_result = await orchestrator.execute_workflow()
     except Exception as e:
-        print(f"execute_workflow failed: {e}", file=sys.stderr)
+        print(f"[{session_id}] execute_workflow failed: {e}", file=sys.stderr)
         raise HTTPException(status_code=500, detail="Internal server error during task execution")
-    
+    if isinstance(final_result, dict) and final_result.get("deadline_exceeded"):
+        return await answer_after_deadline(session_id, work_dir, upload, on_event)
+    print(final_result)
+    print(f"[{session_id}] stage timings: {request_deadline.report()}")
+    _trace_request(final_result=final_result, stage_timings=request_deadline.report())
+    if on_event is not None:
+        on_event({"type": "stage_timings", **request_deadline.report()})
+    return final_result
+
+
+@app.post("/upload")
+async def upload_files(request: Request):
+    # Each request works in its own workspace so overlapping requests can't clobber each other
+    session_id = new_session_id()
+    work_dir = await asyncio.to_thread(create_workspace, session_id)
+    await asyncio.to_thread(sweep_expired_workspaces, active=set(job_manager.jobs))
+
+    try:
+        # The time budget covers the upload as well, it's what the client waits for
+        with deadline.running() as request_deadline, \
+                tracing.span("request", **{"http.route": "/upload", "session.id": session_id}) as request_span:
+            with request_deadline.stage("upload"), tracing.span("upload") as upload_span:
+                upload = await receive_upload(request, work_dir)
+                if upload_span is not None:
+                    upload_span.set(**{"upload.files": len(upload.files),
+                                       "artifact.bytes_written": tracing.file_bytes(work_dir, upload.files)})
+            cache_key, final_result, cache_status = await lookup_cached_result(request, upload.questions,
+                                                                               upload.fingerprint)
+            if request_span is not None:
+                request_span.set(result_cache=cache_status)
+            if final_result is not None:
+                print(f"[{session_id}] served from the result cache")
+                await asyncio.to_thread(_write_json, os.path.join(work_dir, "final_output.json"), final_result)
+            else:
+                final_result = await run_pipeline(session_id, work_dir, upload)
+                await store_cached_result(cache_key, work_dir, final_result)
+        return JSONResponse(content=final_result,
+                            headers={"X-Session-ID": session_id, "X-Result-Cache": cache_status,
+                                     "Server-Timing": request_deadline.server_timing()})
+    finally:
+        # Only final_output.json is kept, for /final-result/{session_id}
+        await asyncio.to_thread(cleanup_workspace, session_id)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    """
+    Queues a workflow and returns immediately. Poll GET /jobs/{job_id} or stream
+    GET /jobs/{job_id}/events for progress; the job id doubles as the session id.
+    """
+    if not job_manager.admit():
+        raise HTTPException(status_code=503, detail="Job queue is full, retry later",
+                            headers={"Retry-After": str(JOB_RETRY_AFTER_SECONDS)})
+
+    session_id = new_session_id()
+    work_dir = await asyncio.to_thread(create_workspace, session_id)
+    await asyncio.to_thread(sweep_expired_workspaces, active=set(job_manager.jobs))
+    try:
+        upload = await receive_upload(request, work_dir)
+        cache_key, cached_result, cache_status = await lookup_cached_result(request, upload.questions,
+                                                                            upload.fingerprint)
+    except BaseException:
+        await asyncio.to_thread(remove_workspace, session_id)
+        raise
+
+    if cached_result is not None:
+        await asyncio.to_thread(_write_json, os.path.join(work_dir, "final_output.json"), cached_result)
+        await asyncio.to_thread(cleanup_workspace, session_id)
+        job = job_manager.submit_finished(session_id, cached_result)
+        return {"job_id": job.job_id, "status": job.status, "result_cache": cache_status}
+
+    async def runner(on_event):
+        try:
+            with tracing.span("request", **{"http.route": "/jobs", "session.id": session_id}):
+                final_result = await run_pipeline(session_id, work_dir, upload, on_event=on_event)
+            await store_cached_result(cache_key, work_dir, final_result)
+            return final_result
+        except HTTPException as e:
+            raise RuntimeError(e.detail)
+        finally:
+            await asyncio.to_thread(cleanup_workspace, session_id)
+
+    try:
+        job = job_manager.submit(session_id, runner)
+    except QueueFullError as e:
+        await asyncio.to_thread(remove_workspace, session_id)
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(JOB_RETRY_AFTER_SECONDS)})
+    return {"job_id": job.job_id, "status": job.status, "result_cache": cache_status}
+
+
+@app.get("/jobs/metrics")
+async def jobs_metrics():
+    return job_manager.metrics()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Server-Sent-Events stream of a job's progress events, ending once the job has finished."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+
+    async def event_stream():
+        seq = 0
+        while True:
+            while seq < len(job.events):
+                event = job.events[seq]
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+                seq += 1
+            if job.done or await request.is_disconnected():
+                break
+            await job.wait_for_event(seq, timeout=15)
+            if seq >= len(job.events):
+                # keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: span timings and totals (see tracing.py) plus current pool, job and cache state."""
+    gauges = {"dataagent_llm_coalesced_calls": llm.coalesced_calls}
+    sources = {"jobs": job_manager.metrics(), "llm_cache": llm_cache.cache.stats(),
+               "llm_rate": rate_limiter.limiter.stats()}
+    pool = worker_pool.get_pool()
+    if pool is not None:
+        sources["worker_pool"] = pool.metrics()
+    for prefix, values in sources.items():
+        for name, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                gauges[f"dataagent_{prefix}_{name}"] = value
+    return PlainTextResponse(tracing.metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/llm-cache/stats")
+async def llm_cache_stats():
+    return llm_cache.cache.stats()
+
 
 @app.get("/debug")
 async def debug():
@@ -158,23 +449,29 @@ async def debug():
         "sys_path": sys.path[:5],  # First 5 paths
     }
 
-@app.get("/final-result")
-async def final_result():
-
-    path = os.path.join(os.getcwd(),'session_workspace', 'final_output.json')
-    with open(path) as f:
-        final_result = json.load(f)
-    return final_result
+@app.get("/final-result/{session_id}")
+async def final_result(session_id: str):
+    try:
+        path = os.path.join(session_dir(session_id), 'final_output.json')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid session id")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No final result for this session")
+    return await asyncio.to_thread(_read_json, path)
 
 @app.get("/run-script")
 async def run_script():
     current_dir = os.path.dirname(os.path.abspath(__file__))
     script_path = os.path.join(current_dir, 'try.py')
-    result = subprocess.run(['python', script_path], capture_output=True, text=True)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, script_path,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
     return {
-        "stdout": result.stdout,
-        "stderr": result.stderr,
-        "returncode": result.returncode
+        "stdout": stdout.decode(errors="replace"),
+        "stderr": stderr.decode(errors="replace"),
+        "returncode": process.returncode
     }
 
 @app.get("/task-breakdown")
@@ -194,7 +491,7 @@ Answer the following questions and respond with a JSON array of strings containi
    Return as a base-64 encoded data URI, `"data:image/png;base64,iVBORw0KG..."` under 100,000 bytes.
 """
     try:
-        tasks = task_breakdown(question)
+        tasks = await task_breakdown(question)
         # save the tasks into tasks.json
         # with open("tasks.json", "w") as f:
         #     f.write(tasks)
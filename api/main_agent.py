@@ -1,16 +1,13 @@
 # To run this code you need to install the following dependencies:
 # pip install google-genai
 
-import os
-from google import genai
 from google.genai import types
+import llm
+import rate_limiter
 from dotenv import load_dotenv
 load_dotenv()
 
-def task_breakdown(question: str):
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
+async def task_breakdown(question: str):
 
     model = "gemini-2.0-flash"
     contents = [
@@ -42,13 +39,14 @@ You are an expert AI project planner creating a data analysis workflow. Your goa
     - The "discovery" task's only job is to load the raw data into a DataFrame with minimal processing.
     - It **must** use a "peek" (e.g., `print(df.info())`, `print(df.head())`) to expose the true, messy structure of the data.
     - Subsequent tasks will then handle cleaning, renaming, and type conversion based on the verified structure revealed by the discovery task's peek.
+    - **Exception**: Files listed in a "DATA MANIFEST" section of the request have already been profiled (columns, dtypes, null rates, sample rows) and converted to Parquet. Do **not** create discovery or conversion tasks for them; start directly with cleaning or analysis, reading the listed Parquet copy.
 
 # STATE MANAGEMENT & FILE I/O
 
 State is managed exclusively through files. The output of one task (an "artifact") must be saved to disk to be used as input for subsequent tasks.
 
 -   **Parquet is Standard**: All intermediate DataFrames **must** be saved as `.parquet` files. This is non-negotiable for efficiency and schema integrity.
--   **Initial Conversion**: If the user provides data in other formats (e.g., `.csv`, `.xlsx`, `.json`), the very first task for that file must be to load it into a pandas DataFrame and immediately save it as a `.parquet` artifact. All subsequent tasks will use this new `.parquet` file.
+-   **Initial Conversion**: If the user provides data in other formats (e.g., `.csv`, `.xlsx`, `.json`), the very first task for that file must be to load it into a pandas DataFrame and immediately save it as a `.parquet` artifact. All subsequent tasks will use this new `.parquet` file. Skip this task when the DATA MANIFEST already lists a Parquet copy of the file.
 -   **Naming Convention**: Use a clear, sequential naming convention for artifacts, e.g., `task_1_raw_data.parquet`, `task_2_cleaned_data.parquet`.
 
 # CONTEXTUAL "PEEKS" FOR THE NEXT AGENT
@@ -96,7 +94,7 @@ You must respond with a single, valid JSON array of task objects. Do not add any
     
 - **tool_needed**: Can be "python" for code execution or "vision" for image analysis.
     
-- **dependencies**: A list of task_ids that must complete before this one starts.
+- **dependencies**: A list of task_ids that must complete before this one starts. It must include every task that produces one of this task's input_artifacts. Tasks that do not depend on each other are executed in parallel, so only list real dependencies.
     
 - **input_artifacts**: List of filenames this task reads.
     
@@ -106,12 +104,14 @@ You must respond with a single, valid JSON array of task objects. Do not add any
         ],
     )
 
-    response = client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    )
-    return response.text
+    # Nothing else can start before the plan exists: queue ahead of task calls
+    with rate_limiter.prioritized():
+        text = await llm.generate_text(
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+        )
+    return text
     # for chunk in client.models.generate_content_stream(
     #     model=model,
     #     contents=contents,
@@ -3,37 +3,78 @@ import sys
 import json
 import subprocess
 import ast
-import requests
 import shutil
 import re
+import asyncio
+from task_graph import TaskGraph, PlanValidationError
+from sandbox import run_script
+from task_context import TaskContext
+import schema_sniffer
+import script_validator
+import plan_optimizer
+import artifact_store
+import artifact_formats
+import deadline
+import tracing
+import rate_limiter
+import dependency_resolver
+from dependency_resolver import DependencyError
 # Import our dummy agents
 import code_generator_agent
 import debugger_agent
 import vision_agent
 
-class DependencyError(Exception):
-    """Custom exception for dependency issues."""
-    pass
+# Repair candidates run in workspace sub-directories with this prefix
+SANDBOX_PREFIX = ".repair_task_"
+
 
 class TaskOrchestrator:
     """
     Manages the entire workflow from planning to execution and debugging.
     """
-    def __init__(self, plan_data):
+    def __init__(self, plan_data, work_dir: str = "session_workspace", on_event=None, data_profiles=None):
         if isinstance(plan_data, str):
             self.plan = json.loads(plan_data)
         # If it's already a list/dict (Python object), use it directly
         else:
             self.plan = plan_data
-        self.work_dir = "session_workspace"
+        if artifact_formats.ARROW_ARTIFACTS and isinstance(self.plan, list) and all(
+            isinstance(task, dict) for task in self.plan
+        ):
+            # Tables passed between tasks go through memory-mapped Arrow IPC instead of Parquet
+            self.plan, renamed = artifact_formats.use_arrow_for_intermediates(self.plan)
+            if renamed:
+                print(f"Intermediate artifacts stored as Arrow IPC: {renamed}")
+        # Every request gets its own workspace, see workspace.py
+        self.work_dir = work_dir
         self.max_retries = 3 # 1 initial attempt + 3 retries
-        
-        # Clean up previous session if it exists
-        # if os.path.exists(self.work_dir):
-        #     shutil.rmtree(self.work_dir)
+        # Upper bound on tasks (LLM calls + subprocesses) running at the same time
+        self.max_parallel_tasks = int(os.environ.get("MAX_PARALLEL_TASKS", 4))
+        # Number of repair candidates raced per failed attempt; 1 keeps the serial debug loop
+        self.speculative_repair_k = int(os.environ.get("SPECULATIVE_REPAIR_K", 1))
+        self.repair_stats = {"rounds": 0, "candidates": 0, "wins": 0}
+        # Static checks before running a script, see script_validator.py
+        self.validate_scripts = os.environ.get("SCRIPT_VALIDATION", "1") not in ("0", "false", "off")
+        self.validation_stats = {"scripts_checked": 0, "runs_avoided": 0}
+        # Tasks served from / run despite the persistent artifact store, see artifact_store.py
+        self.reuse_stats = {"tasks_reused": 0, "tasks_executed": 0}
+        # Optional callback receiving progress events (dicts with a "type" key), see jobs.py
+        self.on_event = on_event
+        # schema_sniffer profiles of the uploaded data files, shown to the code generator
+        self.data_profiles = data_profiles or []
+
         os.makedirs(self.work_dir, exist_ok=True)
         print(f"Workspace created at: {os.path.abspath(self.work_dir)}")
 
+    def _emit(self, event_type: str, **fields):
+        """Reports a progress event to the on_event callback, if one was given."""
+        if self.on_event is None:
+            return
+        try:
+            self.on_event({"type": event_type, **fields})
+        except Exception as e:
+            print(f"on_event callback failed: {e}", file=sys.stderr)
+
     def extract_python_code(self,llm_output: str) -> str:
         """
         Extracts Python code from an LLM's output string.
@@ -61,147 +102,495 @@ class TaskOrchestrator:
                     for alias in node.names:
                         imports.add(alias.name.split('.')[0])
                 elif isinstance(node, ast.ImportFrom):
-                    if node.module:
+                    # relative imports refer to files next to the script, not packages
+                    if node.module and not node.level:
                         imports.add(node.module.split('.')[0])
             return imports
         except SyntaxError as e:
             print(f"Error parsing code for imports: {e}")
             return set()
 
-    def _check_and_install_dependencies(self, code: str):
+    async def _check_and_install_dependencies(self, code: str):
         """Checks for required imports and installs them if they are valid and missing."""
         imports = self._parse_imports(code)
         if not imports:
             return
-            
+
         print(f"Found potential dependencies: {imports}")
-        for package in imports:
-            try:
-                # Check if the package is already available
-                __import__(package)
-                print(f"Dependency '{package}' is already installed.")
-            except ImportError:
-                print(f"Dependency '{package}' not found. Verifying with PyPI...")
-                # Verify with PyPI to avoid installing hallucinated packages
-                response = requests.get(f"https://pypi.org/pypi/{package}/json")
-                if response.status_code == 200:
-                    print(f"'{package}' is a valid package. Installing...")
-                    # Use sys.executable to ensure pip is from the correct env
-                    subprocess.run(
-                        [sys.executable, "-m", "pip", "install", package],
-                        check=True, capture_output=True, text=True
+        with tracing.span("dependency_check", imports=len(imports)):
+            await dependency_resolver.resolver.ensure_async(imports, work_dir=self.work_dir)
+
+    async def _execute_script(self, script_path: str, cwd: str = None) -> subprocess.CompletedProcess:
+        """
+        Runs a generated script in the workspace (or `cwd`) without blocking the event loop,
+        under the sandbox's resource limits (see sandbox.py), as an "execute" span with its
+        exit code, output sizes, CPU time and peak RSS.
+        """
+        # Capped by the request deadline; raises DeadlineExceeded when nothing is left
+        timeout = deadline.stage_timeout(deadline.SCRIPT_TIMEOUT_SECONDS)
+        with tracing.span("execute", script=os.path.basename(script_path)):
+            result = await run_script(script_path, cwd or self.work_dir, timeout)
+            usage = result.usage
+            tracing.annotate(**{"process.exit_code": result.returncode,
+                                "process.runner": usage["runner"],
+                                "process.stdout_bytes": usage["stdout_bytes"],
+                                "process.stderr_bytes": usage["stderr_bytes"],
+                                "process.cpu_seconds": usage["cpu_seconds"],
+                                "process.max_rss_bytes": usage["max_rss_kb"] * 1024,
+                                "process.timed_out": usage["timed_out"]})
+            return result
+
+    async def _validate_script(self, code: str, task: dict) -> list:
+        """
+        Static violations of a script (see script_validator.py) plus imports that can't
+        be resolved. Every non-empty result is a subprocess run that didn't have to happen.
+        """
+        if not self.validate_scripts:
+            return []
+        self.validation_stats["scripts_checked"] += 1
+        with tracing.span("validate") as span:
+            violations = script_validator.validate(code, task, self.work_dir)
+            if not violations:
+                try:
+                    await self._check_and_install_dependencies(code)
+                except DependencyError as e:
+                    violations = [f"Unresolvable import: {e}"]
+            if violations:
+                self.validation_stats["runs_avoided"] += 1
+            if span is not None:
+                span.set(violations=len(violations))
+        return violations
+
+    async def _run_python_task(self, task: dict, last_task_output: str) -> dict:
+        """Generates, executes and debugs the code for a single python task."""
+        task_id = task.get("task_id")
+        current_code = ""
+        last_error = ""
+
+        request_deadline = deadline.current()
+        out_of_time = False
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0 and request_deadline is not None and request_deadline.low():
+                # Retries are optional; keep what's left of the budget for the other tasks
+                print(f"Task {task_id}: skipping further retries, the request deadline is close.")
+                out_of_time = True
+                break
+            with tracing.span("attempt", attempt=attempt + 1):
+                print(f"\n--- Task {task_id}: attempt {attempt + 1} of {self.max_retries + 1} ---")
+                self._emit("attempt_started", task_id=task_id, attempt=attempt + 1)
+
+                # 1. Generate or Debug Code
+                if attempt == 0:
+                    data_manifest = schema_sniffer.format_manifest(
+                        self.data_profiles, only_files=set(task.get("input_artifacts") or [])
                     )
-                    print(f"Successfully installed '{package}'.")
+                    try:
+                        with deadline.stage("codegen"), tracing.span("generate"):
+                            llm_code = await code_generator_agent.generate_code(task ,last_task_output, data_manifest)
+                    except asyncio.TimeoutError:
+                        print(f"Task {task_id}: code generation timed out.")
+                        continue
+                    if llm_code == '' or llm_code is None:
+                        print(f"Task {task_id}: code generation failed.")
+                        continue
+
+                    current_code = self.extract_python_code(llm_code)
+                elif self.speculative_repair_k > 1:
+                    # Race several fixes in parallel sandboxes instead of one fix per round-trip
+                    with deadline.stage("repair"), tracing.span("repair", candidates=self.speculative_repair_k):
+                        outcome = await self._speculative_repair(task, last_task_output, current_code, last_error)
+                    if outcome["status"] == "success":
+                        print(f"--- Task {task_id} SUCCEEDED on attempt {attempt + 1} (speculative repair). ---")
+                        print(f"Task {task_id} output:\n", outcome["output"])
+                        self._emit("task_succeeded", task_id=task_id, attempt=attempt + 1, output=outcome["output"])
+                        return {"status": "success", "output": outcome["output"]}
+                    current_code, last_error = outcome["code"], outcome["error"]
+                    print(f"--- Task {task_id} FAILED on attempt {attempt + 1}. ---")
+                    print(f"Task {task_id} error:\n", last_error)
+                    self._emit("attempt_failed", task_id=task_id, attempt=attempt + 1, error=last_error)
+                    continue
                 else:
-                    raise DependencyError(f"LLM hallucinated a non-existent package: '{package}'")
+                    # Pass the error to the debugger for a fix
+                    try:
+                        with deadline.stage("debug"), tracing.span("debug"):
+                            llm_code = await debugger_agent.debug_code(task,last_task_output, current_code, last_error)
+                    except asyncio.TimeoutError:
+                        print(f"Task {task_id}: the debugger timed out.")
+                        continue
+                    current_code = self.extract_python_code(llm_code)
 
-    def execute_workflow(self) -> dict:
-        """Executes the entire plan, task by task."""
-        last_task_output = ""
-        last_error = ""
-        for task in self.plan:
-            task_id = task.get("task_id")
-            print(f"\n{'='*20} EXECUTING TASK {task_id} {'='*20}")
-            print(f"Description: {task.get('description')}")
-
-            tool = task.get('tool_needed')
-            if tool not in ['python', 'vision']:
-                print(f"Unsupported tool: {tool}")
-                continue
-            
-            if tool.lower() == 'python':
-                current_code = ""
-                
-                is_successful = False
-
-                for attempt in range(self.max_retries + 1):
-                    print(f"\n--- Attempt {attempt + 1} of {self.max_retries + 1} ---")
-                    
-                    # 1. Generate or Debug Code
-                    if attempt == 0:
-                        llm_code = code_generator_agent.generate_code(task ,last_task_output)
-                        if llm_code == '' or llm_code is None:
-                            print("Code generation failed.")
-                            continue
-
-                        current_code = self.extract_python_code(llm_code)
-                    else:
-                        # Pass the error to the debugger for a fix
-                        llm_code = debugger_agent.debug_code(task,last_task_output, current_code, last_error)
-                        current_code = self.extract_python_code(llm_code)
+                # 2. Validate statically; scripts that are bound to fail go straight back to the debugger
+                with deadline.stage("validation"):
+                    violations = await self._validate_script(current_code, task)
+                if violations:
+                    last_error = "The script was rejected before execution:\n" + "\n".join(f"- {v}" for v in violations)
+                    print(f"--- Task {task_id} FAILED validation on attempt {attempt + 1}. ---")
+                    print(f"Task {task_id} error:\n", last_error)
+                    self._emit("attempt_failed", task_id=task_id, attempt=attempt + 1, error=last_error, static=True)
+                    continue
 
-                    # 2. Check Dependencies
+                # 3. Check Dependencies (already done by the validation)
+                if not self.validate_scripts:
                     try:
-                        self._check_and_install_dependencies(current_code)
+                        await self._check_and_install_dependencies(current_code)
                     except DependencyError as e:
                         print(f"FATAL ERROR: {e}")
+                        self._emit("task_failed", task_id=task_id, error=str(e))
                         return {"status": "failed", "reason": str(e)}
 
-                    # 3. Execute Code
-                    script_path = os.path.join(os.path.abspath(self.work_dir), "script.py")
-                    print(script_path,'-----------------------------------')
-                    with open(script_path, "w") as f:
-                        f.write(current_code)
+                # 4. Execute Code
+                # Each task gets its own script file so concurrent tasks don't overwrite each other.
+                script_path = os.path.join(os.path.abspath(self.work_dir), f"script_task_{task_id}.py")
+                with open(script_path, "w") as f:
+                    f.write(current_code)
 
-                    result = subprocess.run(
-                        [sys.executable, script_path],
-                        capture_output=True, text=True, cwd=self.work_dir
-                    )
+                with deadline.stage("execution"):
+                    result = await self._execute_script(script_path)
+
+                # 5. Check Result
+                missing = [a for a in task.get("output_artifacts") or []
+                           if not os.path.exists(os.path.join(self.work_dir, a))]
+                if result.returncode == 0 and not missing:
+                    print(f"--- Task {task_id} SUCCEEDED on attempt {attempt + 1}. ---")
+                    print(f"Task {task_id} output:\n", result.stdout)
+                    self._emit("task_succeeded", task_id=task_id, attempt=attempt + 1, output=result.stdout.strip())
+                    return {"status": "success", "output": result.stdout.strip()}
+                else:
+                    print(f"--- Task {task_id} FAILED on attempt {attempt + 1}. ---")
+                    last_error = result.stderr if result.returncode != 0 else (
+                        f"The script exited successfully but did not write the output artifacts: {missing}")
+                    print(f"Task {task_id} error:\n", last_error)
+                    self._emit("attempt_failed", task_id=task_id, attempt=attempt + 1, error=last_error)
+
+        print(f"\nFATAL: Task {task_id} failed after all retries. Aborting workflow.")
+        self._emit("task_failed", task_id=task_id, error=last_error)
+        return {
+            "status": "failed",
+            "failed_task_id": task_id,
+            "last_error": last_error,
+            "deadline_exceeded": out_of_time,
+        }
 
-                    # 4. Check Result
-                    if result.returncode == 0:
-                        print(f"--- Task {task_id} SUCCEEDED on attempt {attempt + 1}. ---")
-                        print("Output:\n", result.stdout)
+    def _make_sandbox(self, task: dict, index: int) -> str:
+        """
+        Creates a private directory for one repair candidate that sees every file of the
+        workspace (symlinked, or copied where symlinks aren't allowed) except the
+        task's own outputs, so candidates can't overwrite each other's results.
+        """
+        sandbox = os.path.join(self.work_dir, f"{SANDBOX_PREFIX}{task.get('task_id')}_{index}")
+        shutil.rmtree(sandbox, ignore_errors=True)
+        os.makedirs(sandbox)
+        outputs = set(task.get("output_artifacts") or [])
+        for entry in os.listdir(self.work_dir):
+            if entry in outputs or entry.startswith(SANDBOX_PREFIX) or entry.startswith("script_task_"):
+                continue
+            source = os.path.abspath(os.path.join(self.work_dir, entry))
+            target = os.path.join(sandbox, entry)
+            try:
+                os.symlink(source, target, target_is_directory=os.path.isdir(source))
+            except OSError:
+                if os.path.isdir(source):
+                    shutil.copytree(source, target)
+                else:
+                    shutil.copy2(source, target)
+        return sandbox
+
+    def _promote_sandbox(self, sandbox: str):
+        """Moves the files a winning candidate wrote into the real workspace."""
+        for entry in os.listdir(sandbox):
+            path = os.path.join(sandbox, entry)
+            if os.path.islink(path) or entry.startswith("script_task_"):
+                continue
+            target = os.path.join(self.work_dir, entry)
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            os.replace(path, target)
 
-                        last_task_output = last_task_output + f'{task_id} output: \n{result.stdout.strip()}'
+    async def _run_candidate(self, task: dict, code: str, sandbox: str) -> subprocess.CompletedProcess:
+        script_path = os.path.join(os.path.abspath(sandbox), f"script_task_{task.get('task_id')}.py")
+        with open(script_path, "w") as f:
+            f.write(code)
+        return await self._execute_script(script_path, cwd=sandbox)
 
-                        is_successful = True
-                        break
+    async def _speculative_repair(self, task: dict, last_task_output: str, failed_code: str,
+                                  error_message: str) -> dict:
+        """
+        Asks the debugger for several fixes at once and runs them concurrently, each in
+        its own sandbox. The first one that exits 0 and writes every declared output
+        artifact wins; the others are cancelled. Returns {"status": "success", "output"}
+        or {"status": "failed", "code", "error"} with the first failing candidate.
+        """
+        task_id = task.get("task_id")
+        llm_codes = await debugger_agent.debug_candidates(task, last_task_output, failed_code, error_message,
+                                                          self.speculative_repair_k)
+        # identical suggestions would just race each other
+        codes = list(dict.fromkeys(self.extract_python_code(code) for code in llm_codes))
+        if not codes:
+            return {"status": "failed", "code": failed_code, "error": error_message}
+
+        runnable = []
+        rejection = None
+        for code in codes:
+            violations = await self._validate_script(code, task)
+            if not violations and not self.validate_scripts:
+                try:
+                    await self._check_and_install_dependencies(code)
+                except DependencyError as e:
+                    violations = [str(e)]
+            if violations:
+                rejection = rejection or (code, "The script was rejected before execution:\n" +
+                                          "\n".join(f"- {v}" for v in violations))
+                continue
+            runnable.append(code)
+        if not runnable:
+            return {"status": "failed", "code": rejection[0], "error": rejection[1]}
+
+        print(f"Task {task_id}: racing {len(runnable)} repair candidates")
+        self._emit("speculative_repair", task_id=task_id, candidates=len(runnable))
+        self.repair_stats["rounds"] += 1
+        self.repair_stats["candidates"] += len(runnable)
+
+        outputs = task.get("output_artifacts") or []
+        sandboxes = [self._make_sandbox(task, i) for i in range(len(runnable))]
+        runs = {
+            asyncio.create_task(self._run_candidate(task, code, sandbox)): (code, sandbox)
+            for code, sandbox in zip(runnable, sandboxes)
+        }
+        winner = None
+        first_failure = None
+        try:
+            pending = set(runs)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for run in done:
+                    code, sandbox = runs[run]
+                    try:
+                        result = run.result()
+                    except Exception as e:
+                        result = subprocess.CompletedProcess(args=[], returncode=1, stdout="", stderr=str(e))
+                    missing = [a for a in outputs if not os.path.exists(os.path.join(sandbox, a))]
+                    if result.returncode == 0 and not missing and winner is None:
+                        winner = (code, sandbox, result)
+                    elif first_failure is None:
+                        error = result.stderr if result.returncode != 0 else (
+                            f"The script exited successfully but did not write the output artifacts: {missing}"
+                        )
+                        first_failure = (code, error)
+        finally:
+            for run in runs:
+                run.cancel()
+            await asyncio.gather(*runs, return_exceptions=True)
+
+        try:
+            if winner is not None:
+                code, sandbox, result = winner
+                self._promote_sandbox(sandbox)
+                with open(os.path.join(self.work_dir, f"script_task_{task_id}.py"), "w") as f:
+                    f.write(code)
+                self.repair_stats["wins"] += 1
+                return {"status": "success", "output": result.stdout.strip()}
+            return {"status": "failed", "code": first_failure[0], "error": first_failure[1]}
+        finally:
+            for sandbox in sandboxes:
+                shutil.rmtree(sandbox, ignore_errors=True)
+
+    async def _run_vision_task(self, task: dict) -> dict:
+        """Runs the vision agent on the task's input images and writes its JSON output artifact."""
+        task_id = task.get("task_id")
+        input_artifacts = task.get('input_artifacts', [])
+        input_artifacts = [os.path.join(self.work_dir, artifact) for artifact in input_artifacts]
+        output_filename = task.get('output_artifacts')[0]  # Get the first output artifact
+        task_description = task.get('description', 'Give a short description of the image and write all the text present in the image.')
+
+        request_deadline = deadline.current()
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0 and request_deadline is not None and request_deadline.low():
+                print(f"Task {task_id}: skipping further retries, the request deadline is close.")
+                break
+            with tracing.span("attempt", attempt=attempt + 1):
+                print(f"\n--- Task {task_id}: attempt {attempt + 1} of {self.max_retries + 1} ---")
+                self._emit("attempt_started", task_id=task_id, attempt=attempt + 1)
+
+                try:
+                    with deadline.stage("vision"), tracing.span("vision", images=len(input_artifacts)):
+                        vision_analysis = await vision_agent.visual_analysis(input_artifacts, task_description)
+                except asyncio.TimeoutError:
+                    vision_analysis = None
+                if vision_analysis==None or vision_analysis == '':
+                    print(f"Task {task_id}: vision analysis failed. Try again")
+                    self._emit("attempt_failed", task_id=task_id, attempt=attempt + 1, error="empty vision analysis")
+
+                if vision_analysis:
+                    with open(os.path.join(self.work_dir, output_filename), "w") as f:
+                        f.write(vision_analysis)
+                    print(f"Task {task_id}: vision analysis succeeded. Output written to {output_filename}")
+                    self._emit("task_succeeded", task_id=task_id, attempt=attempt + 1, output="")
+                    return {"status": "success", "output": ""}
+
+        print(f"\nFATAL: Task {task_id} failed after all retries. Aborting workflow.")
+        self._emit("task_failed", task_id=task_id, error="vision analysis failed")
+        return {
+            "status": "failed",
+            "failed_task_id": task_id,
+            "last_error": "",
+            "deadline_exceeded": request_deadline is not None and request_deadline.low(),
+        }
+
+    async def _run_task(self, task: dict, last_task_output: str, slots: asyncio.Semaphore) -> dict:
+        # The task writing the answer gets its LLM calls queued first, see rate_limiter.py
+        final = "final_output.json" in (task.get("output_artifacts") or [])
+        async with slots:
+            with tracing.span("task", **{"task.id": str(task.get("task_id")),
+                                         "task.tool": task.get("tool_needed")}) as span:
+                with rate_limiter.prioritized(final):
+                    result = await self._execute_task(task, last_task_output)
+                if span is not None:
+                    succeeded = result.get("status") == "success"
+                    # what the task read and (if it succeeded) wrote, as found in the workspace
+                    span.set(**{
+                        "task.status": result.get("status"),
+                        "artifact.bytes_read": tracing.file_bytes(self.work_dir, task.get("input_artifacts")),
+                        "artifact.bytes_written": tracing.file_bytes(self.work_dir, task.get("output_artifacts"))
+                                                  if succeeded else 0,
+                    })
+                return result
+
+    async def _execute_task(self, task: dict, last_task_output: str) -> dict:
+        """Runs one task, or restores its outputs from the artifact store."""
+        task_id = task.get("task_id")
+        print(f"\n{'='*20} EXECUTING TASK {task_id} {'='*20}")
+        print(f"Description: {task.get('description')}")
+        self._emit("task_started", task_id=task_id, description=task.get('description'),
+                   tool=task.get('tool_needed'))
+
+        tool = (task.get('tool_needed') or '').lower()
+        if tool not in ('python', 'vision'):
+            print(f"Unsupported tool: {task.get('tool_needed')}")
+            return {"status": "success", "output": ""}
+
+        # Reuse the outputs of an earlier run if this task's inputs haven't changed
+        store = artifact_store.store
+        key = await asyncio.to_thread(store.task_key, task, self.work_dir) if store else None
+        if key is not None:
+            meta = await asyncio.to_thread(store.restore, key, task, self.work_dir)
+            if meta is not None:
+                print(f"--- Task {task_id} REUSED from the artifact store. ---")
+                tracing.annotate(**{"task.reused": True})
+                self.reuse_stats["tasks_reused"] += 1
+                self._emit("task_succeeded", task_id=task_id, attempt=0, output=meta.get("output", ""),
+                           reused=True)
+                return {"status": "success", "output": meta.get("output", "")}
+
+        if tool == 'python':
+            result = await self._run_python_task(task, last_task_output)
+        else:
+            result = await self._run_vision_task(task)
+        self.reuse_stats["tasks_executed"] += 1
+
+        if key is not None and result.get("status") == "success":
+            await asyncio.to_thread(store.save, key, task, self.work_dir, result.get("output", ""))
+        return result
+
+    async def execute_workflow(self) -> dict:
+        """
+        Executes the plan as a DAG: every task whose dependencies have finished is
+        started right away, so independent branches run concurrently.
+        """
+        try:
+            graph = TaskGraph(self.plan)
+            self._emit("plan_validated", tasks=[
+                {"task_id": t.get("task_id"), "description": t.get("description"), "tool": t.get("tool_needed")}
+                for t in self.plan
+            ])
+        except PlanValidationError as e:
+            print(f"FATAL ERROR: invalid plan: {e}")
+            self._emit("workflow_failed", reason=f"Invalid plan: {e}")
+            return {"status": "failed", "reason": f"Invalid plan: {e}"}
+
+        context = TaskContext()
+        started = set()
+        completed = set()
+        failure = None
+
+        slots = asyncio.Semaphore(self.max_parallel_tasks)
+        running = {}
+        request_deadline = deadline.current()
+        try:
+            while True:
+                for task_id in graph.ready_tasks(completed, started):
+                    started.add(task_id)
+                    task = graph.tasks[task_id]
+                    # Only the (truncated) peeks of the declared dependencies are forwarded,
+                    # and none at all once the deadline is close (shorter prompts, faster calls)
+                    if request_deadline is not None and request_deadline.low():
+                        last_task_output = ""
                     else:
-                        print(f"--- Task {task_id} FAILED on attempt {attempt + 1}. ---")
-                        last_error = result.stderr
-                        print("Error:\n", last_error)
-                
-                if not is_successful:
-                    print(f"\nFATAL: Task {task_id} failed after all retries. Aborting workflow.")
-                    return {
-                        "status": "failed",
-                        "failed_task_id": task_id,
-                        "last_error": last_error
-                    }
+                        last_task_output = context.build(task, ancestors=graph.ancestors[task_id])
+                    job = asyncio.create_task(self._run_task(task, last_task_output, slots))
+                    running[job] = task_id
 
-            elif tool.lower() == 'vision':
-                is_successful = False
-
-                input_artifacts = task.get('input_artifacts', [])
-                input_artifacts = [os.path.join(self.work_dir, artifact) for artifact in input_artifacts]
-                output_filename = task.get('output_artifacts')[0]  # Get the first output artifact
-                task_description = task.get('description', 'Give a short description of the image and write all the text present in the image.')
-                for attempt in range(self.max_retries + 1):
-                    print(f"\n--- Attempt {attempt + 1} of {self.max_retries + 1} ---")
-
-                    vision_analysis = vision_agent.visual_analysis(input_artifacts, task_description)
-                    if vision_analysis==None or vision_analysis == '':
-                        print("Vision analysis failed. Try again")
-
-                    if vision_analysis:
-                        with open(os.path.join(self.work_dir, output_filename), "w") as f:
-                            f.write(vision_analysis)
-                        print(f"Vision analysis succeeded. Output written to {output_filename}")
-                        is_successful = True
-                        break
-
-                if not is_successful:
-                    print(f"\nFATAL: Task {task_id} failed after all retries. Aborting workflow.")
-                    return {
+                if not running:
+                    break
+
+                timeout = max(request_deadline.remaining(), 0) if request_deadline is not None else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Out of time: the tasks still in flight are cancelled in the finally below
+                    print("Request deadline exceeded, cancelling the running tasks.")
+                    failure = {
                         "status": "failed",
-                        "failed_task_id": task_id,
-                        "last_error": last_error
+                        "failed_task_id": next(iter(running.values())),
+                        "last_error": "Request deadline exceeded",
+                        "deadline_exceeded": True,
                     }
+                    break
+                for job in done:
+                    task_id = running.pop(job)
+                    try:
+                        result = job.result()
+                    except deadline.DeadlineExceeded as e:
+                        result = {"status": "failed", "failed_task_id": task_id, "last_error": str(e),
+                                  "deadline_exceeded": True}
+                    except Exception as e:
+                        result = {"status": "failed", "failed_task_id": task_id, "last_error": str(e)}
 
+                    if result.get("status") == "success":
+                        context.record(task_id, result.get("output", ""))
+                        task = graph.tasks[task_id]
+                        if task.get("fused_steps"):
+                            # keep each step's peek of a fused task, as if it had run on its own
+                            for step_id, peek in plan_optimizer.split_step_output(task, result.get("output")).items():
+                                context.record(step_id, peek)
+                                self._emit("step_succeeded", task_id=task_id, step_id=step_id, output=peek)
+                        completed.add(task_id)
+                    elif failure is None:
+                        failure = result
+                if failure is not None:
+                    # The request has failed: the tasks still in flight are cancelled below
+                    # instead of running their scripts and retries to completion for nothing
+                    break
+        finally:
+            # Reached with tasks in flight after a failure, or if the request was cancelled / ran out of time
+            for job in running:
+                job.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if failure is not None:
+            self._emit("workflow_failed", reason=failure.get("reason") or failure.get("last_error"),
+                       failed_task_id=failure.get("failed_task_id"))
+            return failure
 
         # 5. Finalize
-        print("\n{'='*20} WORKFLOW COMPLETED SUCCESSFULLY {'='*20}")
+        print(f"\n{'='*20} WORKFLOW COMPLETED SUCCESSFULLY {'='*20}")
+        print(f"Context stats: {context.stats()}")
+        if self.repair_stats["rounds"]:
+            print(f"Speculative repair stats: {self.repair_stats}")
+        print(f"Validation stats: {self.validation_stats}")
+        print(f"Reuse stats: {self.reuse_stats}")
+        self._emit("workflow_completed", **context.stats(), **self.validation_stats, **self.reuse_stats,
+                   **{f"repair_{name}": value for name, value in self.repair_stats.items()})
         final_output_path = os.path.join(self.work_dir, "final_output.json")
         if os.path.exists(final_output_path):
             with open(final_output_path, "r") as f:
@@ -210,11 +599,6 @@ class TaskOrchestrator:
             return {"status": "success", "reason": "Workflow finished but final_output.json was not found."}
 
 
-    # destructor to delete the session_workspace folder
-    def __del__(self):
-        print(f"Cleaning up workspace: {self.work_dir}")
-        shutil.rmtree(self.work_dir, ignore_errors=True)
-
 # if __name__ == "__main__":
 #     # This is the JSON plan produced by the "Planner" LLM.
 #     # It describes the multi-step process to achieve the user's goal.
@@ -0,0 +1,158 @@
+"""
+Optional pass between task_breakdown and TaskOrchestrator that fuses linear
+chains of python tasks into a single task, i.e. one generate_code call, one
+process and no Parquet write + read for the artifacts passed along the chain.
+
+Task A is fused with task B when both are python tasks, B is A's only dependent,
+A is B's only dependency, and every artifact A hands to B is consumed by B alone.
+The fused task keeps the steps' ids and descriptions in "fused_steps" and asks
+the script to print a "### STEP <id>" marker before each step, so the peek of
+every step can still be recovered (see split_step_output).
+"""
+import json
+import os
+
+from task_graph import TaskGraph, PlanValidationError
+
+PLAN_FUSION_ENABLED = os.environ.get("PLAN_FUSION", "0") in ("1", "true", "on")
+# Longer scripts get harder for the generator and debugger to get right
+PLAN_FUSION_MAX_STEPS = int(os.environ.get("PLAN_FUSION_MAX_STEPS", 4))
+
+STEP_MARKER = "### STEP "
+
+
+def _is_python(task: dict) -> bool:
+    return (task.get("tool_needed") or "").lower() == "python"
+
+
+def _consumers(tasks: dict) -> dict:
+    consumers = {}
+    for task_id, task in tasks.items():
+        for artifact in task.get("input_artifacts") or []:
+            consumers.setdefault(artifact, set()).add(task_id)
+    return consumers
+
+
+def _can_fuse(graph: TaskGraph, consumers: dict, parent, child) -> bool:
+    if not (_is_python(graph.tasks[parent]) and _is_python(graph.tasks[child])):
+        return False
+    if graph.dependents[parent] != {child} or graph.dependencies[child] != {parent}:
+        return False
+    handed_over = set(graph.tasks[parent].get("output_artifacts") or []) & set(
+        graph.tasks[child].get("input_artifacts") or []
+    )
+    return all(consumers.get(artifact) == {child} for artifact in handed_over)
+
+
+def _chains(graph: TaskGraph, max_steps: int) -> list:
+    consumers = _consumers(graph.tasks)
+    chains = []
+    in_chain = set()
+    for task_id in graph.order:
+        if task_id in in_chain:
+            continue
+        chain = [task_id]
+        while len(chain) < max_steps:
+            dependents = graph.dependents[chain[-1]]
+            if len(dependents) != 1:
+                break
+            child = next(iter(dependents))
+            if not _can_fuse(graph, consumers, chain[-1], child):
+                break
+            chain.append(child)
+        in_chain.update(chain)
+        chains.append(chain)
+    return chains
+
+
+def _fuse(steps: list, consumers: dict) -> tuple:
+    """Builds the fused task for a chain; returns (task, artifacts no longer written to disk)."""
+    step_ids = {step["task_id"] for step in steps}
+    produced, inputs, outputs, internal = set(), [], [], []
+    for step in steps:
+        for artifact in step.get("input_artifacts") or []:
+            if artifact not in produced and artifact not in inputs:
+                inputs.append(artifact)
+        produced.update(step.get("output_artifacts") or [])
+    for step in steps:
+        for artifact in step.get("output_artifacts") or []:
+            readers = consumers.get(artifact, set())
+            if readers and readers <= step_ids and artifact != "final_output.json":
+                internal.append(artifact)
+            else:
+                outputs.append(artifact)
+
+    lines = [
+        f"Run the following {len(steps)} steps in one script, passing intermediate results "
+        f"between steps in memory instead of through files.",
+        f"Before each step print a line '{STEP_MARKER}<step id>' followed by that step's own progress output.",
+    ]
+    for step in steps:
+        lines.append(f"{STEP_MARKER}{step['task_id']}: {step.get('description')}")
+    if internal:
+        lines.append(f"Do not write these intermediate files: {internal}.")
+
+    fused = {
+        "task_id": "+".join(str(step["task_id"]) for step in steps),
+        "description": "\n".join(lines),
+        "tool_needed": "python",
+        "dependencies": list(steps[0].get("dependencies") or []),
+        "input_artifacts": inputs,
+        "output_artifacts": outputs,
+        "fused_steps": [{"task_id": step["task_id"], "description": step.get("description")} for step in steps],
+    }
+    return fused, internal
+
+
+def optimize_plan(plan, max_steps: int = PLAN_FUSION_MAX_STEPS) -> tuple:
+    """
+    Returns (plan, report). Plans that don't validate are returned unchanged so
+    the orchestrator reports the problem as usual.
+    """
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    report = {"tasks_before": len(plan), "tasks_after": len(plan), "fused_chains": [],
+              "llm_calls_removed": 0, "artifact_round_trips_removed": 0}
+    try:
+        graph = TaskGraph(plan)
+    except PlanValidationError as e:
+        print(f"Plan optimizer skipped: {e}")
+        return plan, report
+
+    consumers = _consumers(graph.tasks)
+    renamed = {}
+    fused_plan = []
+    for chain in _chains(graph, max_steps):
+        if len(chain) == 1:
+            fused_plan.append(dict(graph.tasks[chain[0]]))
+            continue
+        fused, internal = _fuse([graph.tasks[task_id] for task_id in chain], consumers)
+        renamed[chain[-1]] = fused["task_id"]
+        fused_plan.append(fused)
+        report["fused_chains"].append([str(task_id) for task_id in chain])
+        report["llm_calls_removed"] += len(chain) - 1
+        report["artifact_round_trips_removed"] += len(internal)
+
+    for task in fused_plan:
+        task["dependencies"] = [renamed.get(dep, dep) for dep in task.get("dependencies") or []]
+    # keep the planner's order as far as possible: a fused task takes its last step's position
+    position = {task_id: i for i, task_id in enumerate(graph.order)}
+    fused_plan.sort(key=lambda t: position[t["fused_steps"][-1]["task_id"] if "fused_steps" in t else t["task_id"]])
+    report["tasks_after"] = len(fused_plan)
+    return fused_plan, report
+
+
+def split_step_output(task: dict, output: str) -> dict:
+    """Splits a fused task's stdout into {step id: peek} using the STEP markers."""
+    step_ids = {str(step["task_id"]): step["task_id"] for step in task.get("fused_steps") or []}
+    peeks = {}
+    current = None
+    for line in (output or "").splitlines():
+        if line.startswith(STEP_MARKER):
+            current = step_ids.get(line[len(STEP_MARKER):].split(":")[0].strip())
+            if current is not None:
+                peeks.setdefault(current, [])
+                continue
+        if current is not None:
+            peeks[current].append(line)
+    return {step_id: "\n".join(lines).strip() for step_id, lines in peeks.items()}
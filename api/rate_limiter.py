@@ -0,0 +1,286 @@
+"""
+Process-wide rate limiting and API key balancing for Gemini calls.
+
+Every network call made through llm.generate_text first takes a lease here.
+The limiter keeps, per API key and model, two token buckets mirroring Gemini's
+quotas: requests per minute and tokens per minute (prompt tokens estimated up
+front, settled against the reported usage afterwards). A call gets the key that
+can admit it right now with the fewest calls in flight; when none can, it
+queues until the first one will, instead of going out and collecting a 429.
+
+Waiters are served in priority order, then first come first served: the planner
+and the tasks writing final_output.json run under prioritized(), so they are
+not starved by a burst of codegen / vision calls. A 429 (or 503) that still gets
+through puts its key on a jittered, exponentially growing cooldown (or the
+server's retryDelay) and empties its request bucket, and the call is retried on
+whichever key is available then.
+
+Keys come from GEMINI_API_KEYS (comma-separated) or GEMINI_API_KEY; limits
+from LLM_RPM / LLM_TPM or per model from GEMINI_MODEL_CONFIG, e.g.
+    {"gemini-2.5-flash": {"rpm": 1000, "tpm": 1000000}}
+0 means unlimited, in which case only the 429 backoff and key balancing apply.
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import llm_client
+
+LLM_RPM = int(os.environ.get("LLM_RPM", 0))
+LLM_TPM = int(os.environ.get("LLM_TPM", 0))
+LLM_RETRY_ATTEMPTS = int(os.environ.get("LLM_RETRY_ATTEMPTS", 4))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get("LLM_BACKOFF_BASE_SECONDS", 1))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get("LLM_BACKOFF_MAX_SECONDS", 30))
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+# Longest a queued call sleeps before looking again, in case a wakeup was missed
+_MAX_SLEEP_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to one minute's worth; 0 means unlimited."""
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 when they are now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        # a call larger than the whole bucket still gets through once it is full
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        """Removes `amount` units; negative amounts give units back. The level may go into debt."""
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.level = min(self.capacity, self.level - min(amount, self.capacity))
+
+    def drain(self):
+        self.level = min(self.level, 0.0)
+
+
+class _KeyState:
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.api_key = api_key
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.throttled = 0
+        # model -> (requests bucket, tokens bucket)
+        self.buckets = {}
+
+
+class Lease:
+    """Permission for one call: which key to use, and how to report back."""
+    def __init__(self, limiter, key: _KeyState, model: str, tokens: int, queued_seconds: float):
+        self.limiter = limiter
+        self.key = key
+        self.model = model
+        self.tokens = tokens
+        self.queued_seconds = queued_seconds
+        self.released = False
+
+    @property
+    def api_key(self) -> str:
+        return self.key.api_key
+
+    def settle(self, actual_tokens: int):
+        """Corrects the tokens bucket with the usage the response reported."""
+        if actual_tokens:
+            self.limiter._settle(self, actual_tokens)
+
+    def throttled(self, attempt: int, retry_after: float = None) -> float:
+        """Backs the key off after a 429; returns the cooldown applied."""
+        return self.limiter._throttle(self, attempt, retry_after)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release(self)
+
+
+class _Waiter:
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with jitter, so throttled callers don't come back in lockstep."""
+    ceiling = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        # model -> keys that may serve it
+        self._keys = {}
+        # model -> heap of waiting calls
+        self._queues = {}
+        self.calls = 0
+        self.queued_calls = 0
+        self.queued_seconds = 0.0
+        self.throttled = 0
+
+    def _keys_for(self, model: str) -> list:
+        keys = self._keys.get(model)
+        if keys is None:
+            # keys shared between models share their state, like the quota does per project
+            by_key = {k.api_key: k for states in self._keys.values() for k in states}
+            keys = []
+            for api_key in llm_client.registry.api_keys(model):
+                if api_key not in by_key:
+                    by_key[api_key] = _KeyState(len(by_key), api_key)
+                keys.append(by_key[api_key])
+            self._keys[model] = keys
+        return keys
+
+    def _buckets(self, key: _KeyState, model: str) -> tuple:
+        buckets = key.buckets.get(model)
+        if buckets is None:
+            config = llm_client.registry.model_config.get(model, {})
+            buckets = (TokenBucket(int(config.get("rpm", LLM_RPM))), TokenBucket(int(config.get("tpm", LLM_TPM))))
+            key.buckets[model] = buckets
+        return buckets
+
+    def _choose(self, model: str, tokens: int, now: float) -> tuple:
+        """The least-loaded key that can take the call now, or (None, seconds until one can)."""
+        best, soonest = None, None
+        for key in self._keys_for(model):
+            requests, token_bucket = self._buckets(key, model)
+            wait = max(key.cooldown_until - now, requests.wait_time(1, now), token_bucket.wait_time(tokens, now))
+            if wait <= 0 and (best is None or key.in_flight < best.in_flight):
+                best = key
+            soonest = wait if soonest is None else min(soonest, wait)
+        return best, soonest
+
+    def _wake_head(self, model: str):
+        queue = self._queues.get(model)
+        if queue:
+            queue[0].wake()
+
+    async def acquire(self, model: str, tokens: int = 0, priority: int = None) -> Lease:
+        """Waits until a key may send a call of about `tokens` tokens to `model`."""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        waiter = _Waiter(priority, next(self._seq))
+        with self._lock:
+            queue = self._queues.setdefault(model, [])
+            heapq.heappush(queue, waiter)
+        try:
+            while True:
+                sleep = None
+                with self._lock:
+                    if queue[0] is waiter:
+                        now = time.monotonic()
+                        key, sleep = self._choose(model, tokens, now)
+                        if key is not None:
+                            heapq.heappop(queue)
+                            requests, token_bucket = self._buckets(key, model)
+                            requests.take(1, now)
+                            token_bucket.take(tokens, now)
+                            key.in_flight += 1
+                            queued = now - started
+                            self.calls += 1
+                            if queued > 0.001:
+                                self.queued_calls += 1
+                                self.queued_seconds += queued
+                            # the next in line may fit on another key
+                            self._wake_head(model)
+                            return Lease(self, key, model, tokens, queued)
+                        sleep = min(sleep, _MAX_SLEEP_SECONDS)
+                    waiter.event.clear()
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout=sleep)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                if waiter in queue:
+                    # cancelled or timed out while queued
+                    queue.remove(waiter)
+                    heapq.heapify(queue)
+                    self._wake_head(model)
+
+    def _settle(self, lease: Lease, actual_tokens: int):
+        with self._lock:
+            _, token_bucket = self._buckets(lease.key, lease.model)
+            token_bucket.take(actual_tokens - lease.tokens, time.monotonic())
+            lease.tokens = actual_tokens
+
+    def _throttle(self, lease: Lease, attempt: int, retry_after: float = None) -> float:
+        cooldown = max(retry_after or 0.0, backoff_seconds(attempt))
+        with self._lock:
+            key = lease.key
+            key.cooldown_until = max(key.cooldown_until, time.monotonic() + cooldown)
+            key.throttled += 1
+            self.throttled += 1
+            # after the cooldown the key ramps up again instead of being hit with a burst
+            self._buckets(key, lease.model)[0].drain()
+        return cooldown
+
+    def _release(self, lease: Lease):
+        with self._lock:
+            lease.key.in_flight -= 1
+            self._wake_head(lease.model)
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = {k.index: k for states in self._keys.values() for k in states}.values()
+            return {
+                "calls": self.calls,
+                "queued_calls": self.queued_calls,
+                "queued_seconds": round(self.queued_seconds, 3),
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "in_flight": sum(k.in_flight for k in keys),
+                "throttled": self.throttled,
+                "keys": len(keys),
+                "keys_cooling_down": sum(1 for k in keys if k.cooldown_until > time.monotonic()),
+            }
+
+
+limiter = RateLimiter()
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_NORMAL)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def prioritized(high: bool = True):
+    """Queues the LLM calls made in the block (and in tasks created in it) ahead of normal ones."""
+    token = _priority.set(PRIORITY_HIGH if high else _priority.get())
+    try:
+        yield
+    finally:
+        _priority.reset(token)
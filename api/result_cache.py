@@ -0,0 +1,92 @@
+"""
+Whole-request result cache: byte-identical resubmissions of the same
+questions.txt + files bundle are answered from a previous validated run
+without calling the planner.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+import fallback
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE", "1") not in ("0", "false", "off")
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", 6 * 3600))
+# Questions that point at live URLs (scraping) are not cached unless this is set
+RESULT_CACHE_LIVE_URLS = os.environ.get("RESULT_CACHE_LIVE_URLS", "0") in ("1", "true", "on")
+
+_URL_PATTERN = re.compile(r"https?://", re.IGNORECASE)
+_FINGERPRINT_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def request_fingerprint(questions: str, file_hashes: dict) -> str:
+    """Hash of the questions text plus the name and content hash of every uploaded file."""
+    payload = {
+        "questions": hashlib.sha256(questions.encode()).hexdigest(),
+        "files": sorted(file_hashes.items()),
+    }
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
+def is_cacheable(questions: str) -> bool:
+    if not RESULT_CACHE_ENABLED:
+        return False
+    if _URL_PATTERN.search(questions) and not RESULT_CACHE_LIVE_URLS:
+        # the answer depends on a page that may have changed since
+        return False
+    return True
+
+
+def bypass_requested(headers) -> bool:
+    """`Cache-Control: no-cache` / `no-store` or `X-Result-Cache: bypass` skip the lookup."""
+    cache_control = headers.get("cache-control", "").lower()
+    return (
+        "no-cache" in cache_control
+        or "no-store" in cache_control
+        or headers.get("x-result-cache", "").lower() == "bypass"
+    )
+
+
+def _entry_path(fingerprint: str) -> str:
+    if not _FINGERPRINT_PATTERN.match(fingerprint):
+        raise ValueError(f"Invalid fingerprint: {fingerprint!r}")
+    return os.path.join(RESULT_CACHE_DIR, f"{fingerprint}.json")
+
+
+def lookup(fingerprint: str):
+    """Returns the cached final result for a fingerprint, or None if missing or expired."""
+    path = _entry_path(fingerprint)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("created_at", 0) + RESULT_CACHE_TTL_SECONDS < time.time():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return entry.get("result")
+
+
+def store(fingerprint: str, result):
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    path = _entry_path(fingerprint)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"created_at": time.time(), "result": result}, f)
+    # atomic, so concurrent readers never see a half-written entry
+    os.replace(tmp_path, path)
+
+
+def is_valid_result(work_dir: str, result) -> bool:
+    """Only results that came from a final_output.json and aren't failure reports are cached."""
+    if isinstance(result, dict) and result.get("status") == "failed":
+        return False
+    if os.path.exists(os.path.join(work_dir, fallback.FALLBACK_MARKER)):
+        # placeholder answers of a request that ran out of time
+        return False
+    return os.path.exists(os.path.join(work_dir, "final_output.json"))
@@ -0,0 +1,291 @@
+"""
+Resource-limited execution of generated scripts.
+
+Every script runs with
+- rlimits: CPU seconds, address space, open files and the size of any file it
+  writes (which also bounds what it can print to a captured stream);
+- a filtered environment: only the variables listed in SANDBOX_ENV_PASSTHROUGH,
+  so API keys and other server secrets aren't handed to generated code. Pool
+  workers are started with that environment too, and the server makes itself
+  non-dumpable (SANDBOX_NONDUMPABLE) so a script can't read them back from
+  /proc/<server pid>/environ or ptrace it;
+- a wall-clock timeout after which its whole process group is killed;
+- stdout / stderr read incrementally and capped at SANDBOX_MAX_OUTPUT_KB each,
+  so a runaway print(df) can't take the server's memory with it.
+
+Scripts run in a warm worker of worker_pool.py when the pool is up (the child
+applies the limits right after the fork) and otherwise in a fresh interpreter
+started from a dedicated thread pool, which also bounds how many of those run
+at once. Either way the result is a SandboxResult: a CompletedProcess with the
+run's resource usage attached, and a note on stderr when a limit was hit, so the
+debugger sees why the script died.
+
+What this does not do is isolate scripts from the server's user: they run with
+its uid and can read every file it can, e.g. an api/.env holding the API key,
+and a server running as root gets no protection from being non-dumpable. Run it
+as an unprivileged user with the keys in its environment only, or in a container
+of its own, when generated code must not be able to reach them.
+"""
+import asyncio
+import ctypes
+import os
+import resource
+import selectors
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import worker_pool
+
+SANDBOX_CPU_SECONDS = int(os.environ.get("SANDBOX_CPU_SECONDS", 120))
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", 4096))
+SANDBOX_MAX_OPEN_FILES = int(os.environ.get("SANDBOX_MAX_OPEN_FILES", 256))
+SANDBOX_MAX_FILE_MB = int(os.environ.get("SANDBOX_MAX_FILE_MB", 1024))
+SANDBOX_MAX_OUTPUT_KB = int(os.environ.get("SANDBOX_MAX_OUTPUT_KB", 1024))
+# Scripts running in fresh interpreters at the same time, including the overflow of a busy pool
+SANDBOX_MAX_CONCURRENCY = int(os.environ.get("SANDBOX_MAX_CONCURRENCY", 8))
+SANDBOX_ENV_PASSTHROUGH = [
+    name.strip()
+    for name in os.environ.get(
+        "SANDBOX_ENV_PASSTHROUGH",
+        "PATH,HOME,USER,LANG,LC_ALL,LC_CTYPE,TZ,TMPDIR,PYTHONPATH,MPLBACKEND,MPLCONFIGDIR,"
+        "SSL_CERT_FILE,SSL_CERT_DIR,REQUESTS_CA_BUNDLE,HTTP_PROXY,HTTPS_PROXY,NO_PROXY,"
+        "http_proxy,https_proxy,no_proxy",
+    ).split(",")
+    if name.strip()
+]
+
+# Make the server process non-dumpable at startup, see protect_server()
+SANDBOX_NONDUMPABLE = os.environ.get("SANDBOX_NONDUMPABLE", "1") not in ("0", "false", "off")
+
+# Read size for the streams of a fresh interpreter
+_CHUNK_SIZE = 64 * 1024
+
+
+class Limits:
+    """Per-script resource limits; 0 means unlimited."""
+    def __init__(self, cpu_seconds: int = SANDBOX_CPU_SECONDS, memory_mb: int = SANDBOX_MEMORY_MB,
+                 open_files: int = SANDBOX_MAX_OPEN_FILES, file_size_mb: int = SANDBOX_MAX_FILE_MB,
+                 output_kb: int = SANDBOX_MAX_OUTPUT_KB):
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.open_files = open_files
+        self.file_size_mb = file_size_mb
+        self.output_kb = output_kb
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, values: dict):
+        return cls(**values)
+
+    @property
+    def output_bytes(self) -> int:
+        return self.output_kb * 1024 if self.output_kb > 0 else sys.maxsize
+
+
+def apply_limits(limits: Limits):
+    """Applies the rlimits to the current process. Runs in the child, before the script."""
+    def set_limit(which, value):
+        if value <= 0:
+            return
+        _, hard = resource.getrlimit(which)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        try:
+            resource.setrlimit(which, (value, hard))
+        except (ValueError, OSError):
+            pass
+
+    # SIGXCPU at the soft limit; the hard limit stays where it was
+    set_limit(resource.RLIMIT_CPU, limits.cpu_seconds)
+    set_limit(resource.RLIMIT_AS, limits.memory_mb * 1024 * 1024)
+    set_limit(resource.RLIMIT_NOFILE, limits.open_files)
+    set_limit(resource.RLIMIT_FSIZE, limits.file_size_mb * 1024 * 1024)
+
+
+def script_env(environ=None) -> dict:
+    """The environment a script gets: the passthrough variables only, plus a headless Matplotlib."""
+    environ = os.environ if environ is None else environ
+    env = {name: environ[name] for name in SANDBOX_ENV_PASSTHROUGH if name in environ}
+    env.setdefault("MPLBACKEND", "Agg")
+    env["PYTHONUNBUFFERED"] = "1"
+    return env
+
+
+def worker_env(environ=None) -> dict:
+    """The environment pool workers are started with: a script's, plus the pool and sandbox settings."""
+    environ = os.environ if environ is None else environ
+    env = script_env(environ)
+    env.update({name: value for name, value in environ.items() if name.startswith(("WORKER_", "SANDBOX_"))})
+    return env
+
+
+def protect_server() -> bool:
+    """
+    Marks the server process non-dumpable (Linux), so scripts running under the same
+    uid can't read its /proc/<pid>/environ or memory, or attach to it with ptrace.
+    Also disables core dumps and same-user profilers such as py-spy. Returns whether it applied.
+    """
+    if not SANDBOX_NONDUMPABLE or not sys.platform.startswith("linux"):
+        return False
+    PR_SET_DUMPABLE = 4
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.prctl(PR_SET_DUMPABLE, 0, 0, 0, 0) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (OSError, AttributeError) as e:
+        print(f"Could not make the server non-dumpable: {e}", file=sys.stderr)
+        return False
+    return True
+
+
+class SandboxResult(subprocess.CompletedProcess):
+    """A CompletedProcess plus what the run used: wall/CPU seconds, peak RSS, output sizes."""
+    def __init__(self, args, returncode: int, stdout: str, stderr: str, usage: dict):
+        super().__init__(args, returncode, stdout, stderr)
+        self.usage = usage
+
+
+def _explain(returncode: int, usage: dict, timeout, limits: Limits) -> str:
+    """Why the sandbox stopped the script, for the debugger; empty when it didn't."""
+    notes = []
+    if usage.get("timed_out"):
+        notes.append(f"TimeoutError: the script was killed after running for {timeout:.0f} seconds.")
+    elif returncode == -signal.SIGXCPU or (returncode == -signal.SIGKILL and limits.cpu_seconds > 0
+                                           and usage.get("cpu_seconds", 0) >= limits.cpu_seconds):
+        notes.append(f"The script was killed after using {limits.cpu_seconds} seconds of CPU time.")
+    elif returncode == -signal.SIGXFSZ:
+        notes.append(f"The script was killed for writing a file (or output) larger than {limits.file_size_mb} MB.")
+    for stream in ("stdout", "stderr"):
+        omitted = usage.get(f"{stream}_bytes", 0) - limits.output_bytes
+        if omitted > 0:
+            notes.append(f"[{stream} truncated: {omitted} bytes beyond the first {limits.output_kb} KB were dropped]")
+    return "\n".join(notes)
+
+
+def _result(args, returncode: int, stdout: bytes, stderr: bytes, usage: dict, timeout, limits: Limits) -> SandboxResult:
+    stderr = stderr.decode(errors="replace")
+    note = _explain(returncode, usage, timeout, limits)
+    if note:
+        stderr = f"{stderr}\n{note}" if stderr else note
+    return SandboxResult(args, returncode, stdout.decode(errors="replace"), stderr, usage)
+
+
+class _FreshRun:
+    """One script in a new interpreter. wait() blocks; kill() may be called from another thread."""
+    def __init__(self, script_path: str, cwd: str, timeout, limits: Limits):
+        self.args = [sys.executable, script_path]
+        self.cwd = cwd
+        self.timeout = timeout
+        self.limits = limits
+        self.process = None
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def wait(self) -> SandboxResult:
+        started = time.monotonic()
+        process = self.process = subprocess.Popen(
+            self.args, cwd=self.cwd, env=script_env(), stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            # own process group, so a kill takes the script's children too
+            start_new_session=True,
+            # only setrlimit calls (no imports, no locks), which is safe between fork and exec
+            preexec_fn=lambda: apply_limits(self.limits),
+        )
+        kept = {process.stdout: bytearray(), process.stderr: bytearray()}
+        sizes = {process.stdout: 0, process.stderr: 0}
+        timed_out = False
+        with selectors.DefaultSelector() as selector:
+            for stream in kept:
+                selector.register(stream, selectors.EVENT_READ)
+            while selector.get_map():
+                wait = None
+                if self.timeout is not None and not timed_out:
+                    wait = max(started + self.timeout - time.monotonic(), 0)
+                    if wait == 0:
+                        timed_out = True
+                        self.kill()
+                        wait = None
+                for key, _ in selector.select(wait):
+                    chunk = os.read(key.fd, _CHUNK_SIZE)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    sizes[key.fileobj] += len(chunk)
+                    room = self.limits.output_bytes - len(kept[key.fileobj])
+                    if room > 0:
+                        # past the cap the stream is still drained, just not kept
+                        kept[key.fileobj] += chunk[:room]
+
+        # reaped here rather than by Popen, to get the child's resource usage
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        for stream in kept:
+            stream.close()
+        usage = {
+            "runner": "subprocess",
+            "wall_seconds": round(time.monotonic() - started, 3),
+            "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+            "max_rss_kb": rusage.ru_maxrss,
+            "stdout_bytes": sizes[process.stdout],
+            "stderr_bytes": sizes[process.stderr],
+            "timed_out": timed_out,
+        }
+        return _result(self.args, process.returncode, bytes(kept[process.stdout]), bytes(kept[process.stderr]),
+                       usage, self.timeout, self.limits)
+
+
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SANDBOX_MAX_CONCURRENCY, thread_name_prefix="sandbox")
+    return _executor
+
+
+async def run_script(script_path: str, cwd: str, timeout: float = None, limits: Limits = None) -> SandboxResult:
+    """
+    Runs `script_path` in `cwd` under `limits` (the SANDBOX_* defaults) and kills it after
+    `timeout` seconds. Uses the worker pool when it is running, a fresh interpreter otherwise.
+    """
+    limits = limits or Limits()
+    pool = worker_pool.get_pool()
+    if pool is not None:
+        try:
+            response = await pool.run(script_path, cwd, timeout, limits.to_dict())
+        except worker_pool.NoIdleWorker:
+            # every worker is busy (or being respawned): run it fresh instead of queueing
+            pass
+        except worker_pool.WorkerError as e:
+            print(f"Worker pool run failed ({e}), falling back to a fresh interpreter.", file=sys.stderr)
+        else:
+            usage = {
+                "runner": "worker_pool",
+                "wall_seconds": round(response["wall_seconds"], 3),
+                "cpu_seconds": round(response["cpu_seconds"], 3),
+                "max_rss_kb": response["max_rss_kb"],
+                "stdout_bytes": response["stdout_bytes"],
+                "stderr_bytes": response["stderr_bytes"],
+                "timed_out": response["timed_out"],
+            }
+            return _result([sys.executable, script_path], response["returncode"], response["stdout"].encode(),
+                           response["stderr"].encode(), usage, timeout, limits)
+
+    run = _FreshRun(os.path.abspath(script_path), cwd, timeout, limits)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), run.wait)
+    except asyncio.CancelledError:
+        # the thread returns as soon as the killed script's pipes close
+        run.kill()
+        raise
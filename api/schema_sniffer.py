@@ -0,0 +1,224 @@
+"""
+Profiles uploaded data files as soon as they arrive: column names, dtypes, row
+counts, null rates and a few sample rows, plus a Parquet copy of every table
+(`<table>.sniffed.parquet`, a suffix uploads may not use, so a copy never races
+with a file of the same request still being received).
+The resulting manifest goes to the planner and code generator so plans can skip
+the "load + print(df.info())" discovery tasks.
+
+pandas/pyarrow are imported lazily so the API process only pays for them once a
+data file is actually uploaded.
+"""
+import json
+import os
+import sqlite3
+import time
+
+SNIFF_MAX_BYTES = int(os.environ.get("SNIFF_MAX_MB", 200)) * 1024 * 1024
+SNIFF_SAMPLE_ROWS = int(os.environ.get("SNIFF_SAMPLE_ROWS", 3))
+SNIFF_MAX_COLUMNS = int(os.environ.get("SNIFF_MAX_COLUMNS", 60))
+SNIFF_MAX_VALUE_CHARS = 60
+PARQUET_COPY_SUFFIX = ".sniffed.parquet"
+# Time an uploaded .sql script / SQLite database may take to load and read, in the API process
+SNIFF_SQL_TIMEOUT_SECONDS = float(os.environ.get("SNIFF_SQL_TIMEOUT_SECONDS", 10))
+
+# Pragmas an uploaded .sql script may set (e.g. the `PRAGMA foreign_keys=OFF;` of sqlite3 .dump);
+# setting any other one, like journal_mode or writable_schema, is denied
+_SETTABLE_PRAGMAS = {"foreign_keys", "defer_foreign_keys", "recursive_triggers", "case_sensitive_like"}
+# Progress handler granularity, in SQLite VM instructions
+_SQL_PROGRESS_STEPS = 10000
+
+_FORMATS = {
+    ".csv": "csv",
+    ".tsv": "csv",
+    ".xlsx": "excel",
+    ".xls": "excel",
+    ".json": "json",
+    ".parquet": "parquet",
+    ".sql": "sql",
+    ".db": "sqlite",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite",
+}
+
+
+# Leading bytes of binary formats, for files whose extension says nothing
+_MAGIC = (
+    (b"PAR1", "parquet"),
+    (b"SQLite format 3\x00", "sqlite"),
+    (b"PK\x03\x04", "excel"),
+    (b"\xd0\xcf\x11\xe0", "excel"),
+)
+
+
+def detect_format(filename: str):
+    return _FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+def sniff_format(filename: str, head: bytes):
+    """Format from the extension, or else from the first bytes of the content."""
+    file_format = detect_format(filename)
+    if file_format is not None or not head:
+        return file_format
+    for magic, magic_format in _MAGIC:
+        if head.startswith(magic):
+            return magic_format
+    return None
+
+
+def _short(value) -> str:
+    text = str(value)
+    return text if len(text) <= SNIFF_MAX_VALUE_CHARS else text[:SNIFF_MAX_VALUE_CHARS] + "..."
+
+
+def _profile_frame(df, name: str) -> dict:
+    columns = [
+        {
+            "name": str(column),
+            "dtype": str(df[column].dtype),
+            "null_rate": round(float(df[column].isna().mean()), 4) if len(df) else 0.0,
+        }
+        for column in list(df.columns)[:SNIFF_MAX_COLUMNS]
+    ]
+    sample = df.head(SNIFF_SAMPLE_ROWS)
+    sample_rows = [
+        {str(k): _short(v) for k, v in row.items()}
+        for row in sample.iloc[:, :SNIFF_MAX_COLUMNS].to_dict(orient="records")
+    ]
+    return {
+        "name": name,
+        "rows": int(len(df)),
+        "column_count": int(len(df.columns)),
+        "columns": columns,
+        "sample_rows": sample_rows,
+    }
+
+
+def _to_parquet(df, path: str) -> str:
+    """Writes df next to the upload unless a file of that name already exists."""
+    # Mixed-type object columns are what usually breaks parquet writers
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(lambda v: v if v is None or isinstance(v, str) else str(v))
+    df.columns = [str(c) for c in df.columns]
+    try:
+        # exclusive create: two tables of the same name (sales.csv + sales.xlsx) profiled at once
+        f = open(path, "xb")
+    except FileExistsError:
+        return None
+    try:
+        with f:
+            df.to_parquet(f, index=False)
+    except BaseException:
+        os.remove(path)
+        raise
+    return os.path.basename(path)
+
+
+def _sql_authorizer(action, arg1, arg2, db_name, trigger):
+    # ATTACH (which VACUUM INTO also goes through) would let an upload create or
+    # overwrite files anywhere the server can write
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA and arg2 is not None and arg1.lower() not in _SETTABLE_PRAGMAS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def _guard(db: sqlite3.Connection):
+    """Confines an upload's SQL to the connection's own database, for SNIFF_SQL_TIMEOUT_SECONDS."""
+    db.set_authorizer(_sql_authorizer)
+    expires_at = time.monotonic() + SNIFF_SQL_TIMEOUT_SECONDS
+    # a non-zero return aborts the statement, e.g. a runaway recursive CTE
+    db.set_progress_handler(lambda: time.monotonic() > expires_at, _SQL_PROGRESS_STEPS)
+
+
+def _read_tables(path: str, file_format: str) -> list:
+    """Returns [(table name, DataFrame), ...] for the file."""
+    import pandas as pd
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if file_format == "csv":
+        sep = "\t" if path.lower().endswith(".tsv") else None
+        return [(stem, pd.read_csv(path, sep=sep, engine="python" if sep is None else "c"))]
+    if file_format == "excel":
+        sheets = pd.read_excel(path, sheet_name=None)
+        if len(sheets) == 1:
+            return [(stem, next(iter(sheets.values())))]
+        return [(f"{stem}_{sheet}", df) for sheet, df in sheets.items()]
+    if file_format == "json":
+        try:
+            return [(stem, pd.read_json(path))]
+        except ValueError:
+            with open(path) as f:
+                return [(stem, pd.json_normalize(json.load(f)))]
+    if file_format == "parquet":
+        return [(stem, pd.read_parquet(path))]
+    if file_format in ("sql", "sqlite"):
+        if file_format == "sql":
+            db = sqlite3.connect(":memory:")
+        else:
+            db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            _guard(db)
+            if file_format == "sql":
+                with open(path) as f:
+                    db.executescript(f.read())
+            names = [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            return [(f"{stem}_{name}", pd.read_sql_query(f'SELECT * FROM "{name}"', db)) for name in names]
+        finally:
+            db.close()
+    return []
+
+
+def profile_file(path: str, convert: bool = True, file_format: str = None) -> dict:
+    """
+    Profiles one uploaded file. Returns None for formats we don't sniff; failures are
+    reported in an "error" key so the planner falls back to a discovery task.
+    """
+    file_format = file_format or detect_format(path)
+    if file_format is None:
+        return None
+    profile = {"file": os.path.basename(path), "format": file_format, "tables": []}
+    try:
+        if os.path.getsize(path) > SNIFF_MAX_BYTES:
+            profile["error"] = "file too large to profile upfront"
+            return profile
+        work_dir = os.path.dirname(path)
+        for name, df in _read_tables(path, file_format):
+            table = _profile_frame(df, name)
+            if convert and file_format != "parquet":
+                table["parquet"] = _to_parquet(df, os.path.join(work_dir, f"{name}{PARQUET_COPY_SUFFIX}"))
+            elif file_format == "parquet":
+                table["parquet"] = profile["file"]
+            profile["tables"].append(table)
+    except Exception as e:
+        profile["error"] = f"{type(e).__name__}: {e}"
+    return profile
+
+
+def format_manifest(profiles: list, only_files=None) -> str:
+    """Renders profiles as the DATA MANIFEST text block given to the agents."""
+    blocks = []
+    for profile in profiles:
+        if not profile or profile.get("error") or not profile.get("tables"):
+            continue
+        if only_files is not None and profile["file"] not in only_files and not any(
+            table.get("parquet") in only_files for table in profile["tables"]
+        ):
+            continue
+        for table in profile["tables"]:
+            lines = [f"## {profile['file']}" + (f" / {table['name']}" if len(profile["tables"]) > 1 else "")]
+            if table.get("parquet"):
+                lines.append(f"Parquet copy: {table['parquet']} (load this instead of re-parsing {profile['file']})")
+            lines.append(f"Rows: {table['rows']}, columns: {table['column_count']}")
+            lines.append("Columns (name: dtype, null rate):")
+            lines.extend(f"- {c['name']}: {c['dtype']}, {c['null_rate']:.1%} null" for c in table["columns"])
+            if table["column_count"] > len(table["columns"]):
+                lines.append(f"- ... {table['column_count'] - len(table['columns'])} more columns")
+            lines.append(f"Sample rows: {json.dumps(table['sample_rows'], ensure_ascii=False)}")
+            blocks.append("\n".join(lines))
+    if not blocks:
+        return ""
+    return "# DATA MANIFEST (already profiled, no discovery task needed)\n" + "\n\n".join(blocks)
@@ -0,0 +1,80 @@
+"""
+Helpers for generated scripts to pass tables between tasks.
+
+Intermediate artifacts (".arrow") are Arrow IPC files. Reading one memory-maps
+it, so the table's buffers are used straight from the page cache instead of
+being decoded like Parquet or CSV. Other extensions fall back to the matching
+pandas reader/writer, so scripts can use the same two calls for every table:
+
+    from artifact_io import read_table, write_table
+    df = read_table("task_2_clean.arrow")
+    write_table(df, "task_3_summary.arrow")
+"""
+import os
+
+ARROW_EXTENSIONS = (".arrow", ".ipc", ".feather")
+
+
+def is_arrow(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in ARROW_EXTENSIONS
+
+
+def read_arrow(path: str):
+    """Returns the pyarrow.Table of an Arrow IPC file, backed by a memory map (zero-copy)."""
+    import pyarrow as pa
+
+    source = pa.memory_map(path, "r")
+    try:
+        return pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        # written as a stream rather than a file
+        source.seek(0)
+        return pa.ipc.open_stream(source).read_all()
+
+
+def write_arrow(table, path: str):
+    """Writes a pyarrow.Table (or DataFrame) as an uncompressed Arrow IPC file, atomically."""
+    import pyarrow as pa
+
+    if not isinstance(table, pa.Table):
+        table = pa.Table.from_pandas(table, preserve_index=False)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def read_table(path: str, columns=None):
+    """Loads a table artifact as a pandas DataFrame, whatever its format."""
+    import pandas as pd
+
+    if is_arrow(path):
+        table = read_arrow(path)
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas(split_blocks=True)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    if extension == ".json":
+        df = pd.read_json(path)
+    else:
+        df = pd.read_csv(path)
+    return df[columns] if columns is not None else df
+
+
+def write_table(df, path: str):
+    """Saves a DataFrame (or pyarrow.Table) in the format given by the artifact's extension."""
+    if is_arrow(path):
+        write_arrow(df, path)
+        return
+    if hasattr(df, "to_pandas"):
+        df = df.to_pandas()
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        df.to_parquet(path, index=False)
+    elif extension == ".json":
+        df.to_json(path, orient="records")
+    else:
+        df.to_csv(path, index=False)
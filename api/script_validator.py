@@ -0,0 +1,210 @@
+"""
+Static checks run on a generated script before it is executed, so scripts that
+are certain to fail go straight back to the debugger without spawning a process.
+
+Checks are deliberately conservative - a false positive costs a debugger call
+and can push a working script out of the retry budget:
+- syntax errors,
+- names that are used but never bound anywhere (typically a forgotten import),
+- relative file literals that are read but neither exist in the workspace nor
+  are written by the script itself,
+- banned calls (blocking on stdin, shelling out, deleting or leaving the workspace).
+Unresolvable imports are checked by the orchestrator through dependency_resolver.
+Declared outputs are not checked here: scripts may build their paths at runtime
+(f"task_{tid}_out.parquet"), so the orchestrator looks for them after the run.
+"""
+import ast
+import builtins
+import os
+
+# Fully qualified call name -> why it is not allowed in a generated script
+BANNED_CALLS = {
+    "input": "reads from stdin, which is closed for generated scripts",
+    "os.system": "shells out; do the work in Python instead",
+    "os.popen": "shells out; do the work in Python instead",
+    "subprocess.run": "starts processes; dependencies are installed by the orchestrator",
+    "subprocess.call": "starts processes; dependencies are installed by the orchestrator",
+    "subprocess.check_call": "starts processes; dependencies are installed by the orchestrator",
+    "subprocess.check_output": "starts processes; dependencies are installed by the orchestrator",
+    "subprocess.Popen": "starts processes; dependencies are installed by the orchestrator",
+    "os.chdir": "changes the working directory that artifact paths are relative to",
+    "shutil.rmtree": "deletes directories in the shared workspace",
+}
+
+# Callables whose first argument (or one of these keywords) is a path that is read
+_READ_CALLS = {
+    "read_csv", "read_table", "read_parquet", "read_json", "read_excel", "read_feather",
+    "read_pickle", "read_orc", "read_fwf", "read_xml",
+    "load", "loadtxt", "genfromtxt", "imread", "read_text", "read_bytes", "read_arrow",
+}
+# Callables whose first argument (or one of these keywords) is a path that is written
+_WRITE_CALLS = {
+    "to_csv", "to_parquet", "to_json", "to_excel", "to_feather", "to_pickle", "to_html",
+    "savefig", "save", "savetxt", "imwrite", "write_text", "write_bytes", "write_parquet",
+    "write_table", "write_arrow", "write_feather",
+}
+# Writers that take the data first and the path second: write_table(df, path)
+_DATA_FIRST_WRITE_CALLS = {"write_table", "write_arrow", "write_feather"}
+_PATH_KEYWORDS = ("path", "where", "dest", "path_or_buf", "filepath_or_buffer", "fname", "filename", "io", "file")
+
+_BUILTIN_NAMES = set(dir(builtins)) | {"__file__", "__name__", "__builtins__", "__doc__", "__spec__"}
+
+
+def _dotted_name(node) -> str:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+        return ".".join(reversed(parts))
+    return None
+
+
+def _import_aliases(tree) -> dict:
+    """Maps local names to what they were imported as: {"sp": "subprocess", "system": "os.system"}."""
+    aliases = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                aliases[alias.asname or alias.name.split(".")[0]] = alias.name if alias.asname else alias.name.split(".")[0]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+    return aliases
+
+
+def _qualified_call(call: ast.Call, aliases: dict) -> str:
+    name = _dotted_name(call.func)
+    if name is None:
+        return None
+    head, _, rest = name.partition(".")
+    head = aliases.get(head, head)
+    return f"{head}.{rest}" if rest else head
+
+
+def _bound_names(tree) -> set:
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _undefined_names(tree) -> list:
+    if any(isinstance(node, ast.ImportFrom) and any(a.name == "*" for a in node.names) for node in ast.walk(tree)):
+        # anything could have come from the star import
+        return []
+    bound = _bound_names(tree) | _BUILTIN_NAMES
+    missing = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in bound:
+            if node.id not in missing:
+                missing.append(node.id)
+    return missing
+
+
+def _literal(node) -> str:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _path_argument(call: ast.Call, position: int = 0) -> str:
+    if len(call.args) > position:
+        return _literal(call.args[position])
+    for keyword in call.keywords:
+        if keyword.arg in _PATH_KEYWORDS:
+            return _literal(keyword.value)
+    return None
+
+
+def _open_mode(call: ast.Call) -> str:
+    if len(call.args) > 1:
+        return _literal(call.args[1]) or "r"
+    for keyword in call.keywords:
+        if keyword.arg == "mode":
+            return _literal(keyword.value) or "r"
+    return "r"
+
+
+def _is_local_file(path: str) -> bool:
+    """Only plain relative file names are checked; URLs, absolute paths and globs are left alone."""
+    return (
+        bool(path)
+        and "://" not in path
+        and not os.path.isabs(path)
+        and not any(ch in path for ch in "*?{}\n")
+        and bool(os.path.splitext(path)[1])
+    )
+
+
+def _file_accesses(tree, aliases: dict) -> tuple:
+    """Returns (paths read, paths written) from string literals passed to file APIs."""
+    reads, writes = [], []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = _qualified_call(node, aliases) or ""
+        short = name.rsplit(".", 1)[-1]
+        path = _path_argument(node, 1 if short in _DATA_FIRST_WRITE_CALLS else 0)
+        if not _is_local_file(path):
+            continue
+        if name in ("open", "io.open") or short == "open" and "Image" in name:
+            (writes if any(m in _open_mode(node) for m in "wax+") else reads).append(path)
+        elif short in _WRITE_CALLS:
+            writes.append(path)
+        elif short in _READ_CALLS:
+            reads.append(path)
+    return reads, writes
+
+
+def validate(code: str, task: dict, work_dir: str) -> list:
+    """
+    Returns a list of human-readable violations; an empty list means the script
+    may run. The messages are worded for the debugger, which receives them as the error.
+    """
+    try:
+        tree = ast.parse(code)
+        compile(tree, f"script_task_{task.get('task_id')}.py", "exec")
+    except SyntaxError as e:
+        return [f"SyntaxError: {e.msg} (line {e.lineno}): {(e.text or '').strip()}"]
+    except ValueError as e:
+        return [f"The script could not be compiled: {e}"]
+
+    violations = []
+    aliases = _import_aliases(tree)
+
+    for name in _undefined_names(tree):
+        violations.append(f"NameError: name '{name}' is used but never defined or imported.")
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            name = _qualified_call(node, aliases)
+            if name in BANNED_CALLS:
+                violations.append(f"Banned call '{name}()' on line {node.lineno}: {BANNED_CALLS[name]}.")
+
+    inputs = set(task.get("input_artifacts") or [])
+    reads, writes = _file_accesses(tree, aliases)
+    for path in dict.fromkeys(reads):
+        if path in writes or path in inputs or os.path.exists(os.path.join(work_dir, path)):
+            continue
+        violations.append(
+            f"The script reads '{path}', which does not exist and is not one of the input artifacts {sorted(inputs)}."
+        )
+    return violations
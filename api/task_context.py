@@ -0,0 +1,93 @@
+import math
+import os
+
+# Upper bound on the upstream peeks forwarded to one generate_code / debug_code call
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2000))
+# Upper bound for a single upstream task's peek
+CONTEXT_PEEK_TOKEN_BUDGET = int(os.environ.get("CONTEXT_PEEK_TOKEN_BUDGET", 800))
+# Lines longer than this are cut, so one wide row can't eat the whole budget
+CONTEXT_MAX_LINE_CHARS = int(os.environ.get("CONTEXT_MAX_LINE_CHARS", 400))
+# Rough chars-per-token ratio of English text and code for Gemini tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def truncate_peek(text: str, max_tokens: int, max_line_chars: int = CONTEXT_MAX_LINE_CHARS) -> str:
+    """
+    Shrinks a task's stdout to roughly `max_tokens`, keeping its first and last
+    lines (column listings and summaries usually live there) and noting what was cut.
+    """
+    lines = [
+        line if len(line) <= max_line_chars else line[:max_line_chars] + " ...[line truncated]"
+        for line in (text or "").splitlines()
+    ]
+    shortened = "\n".join(lines)
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(shortened) <= max_chars:
+        return shortened
+
+    head, tail = [], []
+    used = 0
+    # Two thirds of the budget for the head, the rest for the tail
+    for line in lines:
+        if used + len(line) + 1 > max_chars * 2 // 3:
+            break
+        head.append(line)
+        used += len(line) + 1
+    for line in reversed(lines[len(head):]):
+        if used + len(line) + 1 > max_chars:
+            break
+        tail.insert(0, line)
+        used += len(line) + 1
+
+    omitted = lines[len(head):len(lines) - len(tail)]
+    marker = f"... [{len(omitted)} lines, ~{estimate_tokens(chr(10).join(omitted))} tokens omitted] ..."
+    return "\n".join(head + [marker] + tail)
+
+
+class TaskContext:
+    """
+    Keeps the stdout ("peek") of every finished task and builds the context for a
+    task from its declared dependencies only, each peek truncated to the budget.
+    Also counts the tokens forwarded versus forwarding every upstream output in full.
+    """
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, peek_budget: int = CONTEXT_PEEK_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.peek_budget = peek_budget
+        self.outputs = {}
+        self.tokens_forwarded = 0
+        self.tokens_unbounded = 0
+
+    def record(self, task_id, output: str):
+        self.outputs[task_id] = output or ""
+
+    def build(self, task: dict, ancestors=None) -> str:
+        """
+        Context string for `task`. `ancestors` (all upstream task ids) is only used
+        to account for what the unbounded context would have cost.
+        """
+        dependencies = [dep for dep in (task.get("dependencies") or []) if self.outputs.get(dep)]
+        if dependencies:
+            per_peek = min(self.peek_budget, max(self.token_budget // len(dependencies), 1))
+        else:
+            per_peek = self.peek_budget
+        context = "\n".join(
+            f"{dep} output: \n{truncate_peek(self.outputs[dep], per_peek)}"
+            for dep in dependencies
+        )
+
+        upstream = ancestors if ancestors is not None else dependencies
+        self.tokens_unbounded += sum(
+            estimate_tokens(f"{t} output: \n{self.outputs[t]}\n") for t in upstream if self.outputs.get(t)
+        )
+        self.tokens_forwarded += estimate_tokens(context)
+        return context
+
+    def stats(self) -> dict:
+        return {
+            "context_tokens_forwarded": self.tokens_forwarded,
+            "context_tokens_saved": max(self.tokens_unbounded - self.tokens_forwarded, 0),
+        }
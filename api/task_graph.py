@@ -0,0 +1,103 @@
+from collections import deque
+
+
+class PlanValidationError(Exception):
+    """Raised when the planner's task list cannot be executed as a DAG."""
+    pass
+
+
+class TaskGraph:
+    """
+    Dependency graph built from the planner's task list.
+
+    Every task must declare the tasks it depends on in `dependencies`. The graph
+    checks that those ids exist, that there are no cycles, and that an artifact
+    produced by one task is only consumed by tasks that (transitively) depend on
+    it. Artifacts that no task produces are treated as user uploads.
+    """
+    def __init__(self, plan: list):
+        self.tasks = {}
+        for task in plan:
+            task_id = task.get("task_id")
+            if task_id is None:
+                raise PlanValidationError(f"Task without a task_id: {task}")
+            if task_id in self.tasks:
+                raise PlanValidationError(f"Duplicate task_id: {task_id}")
+            self.tasks[task_id] = task
+
+        self.dependencies = {}
+        self.dependents = {task_id: set() for task_id in self.tasks}
+        for task_id, task in self.tasks.items():
+            deps = set(task.get("dependencies") or [])
+            missing = deps - self.tasks.keys()
+            if missing:
+                raise PlanValidationError(f"Task {task_id} depends on unknown task(s): {sorted(missing)}")
+            if task_id in deps:
+                raise PlanValidationError(f"Task {task_id} depends on itself")
+            self.dependencies[task_id] = deps
+            for dep in deps:
+                self.dependents[dep].add(task_id)
+
+        self.order = self._topological_order()
+        self.ancestors = self._compute_ancestors()
+        self._validate_artifacts()
+
+    def _topological_order(self) -> list:
+        """Kahn's algorithm; ties are broken by the original plan order."""
+        position = {task_id: i for i, task_id in enumerate(self.tasks)}
+        remaining = {task_id: len(deps) for task_id, deps in self.dependencies.items()}
+        ready = deque(sorted((t for t, n in remaining.items() if n == 0), key=position.get))
+        order = []
+        while ready:
+            task_id = ready.popleft()
+            order.append(task_id)
+            for child in sorted(self.dependents[task_id], key=position.get):
+                remaining[child] -= 1
+                if remaining[child] == 0:
+                    ready.append(child)
+
+        if len(order) != len(self.tasks):
+            cyclic = sorted(t for t, n in remaining.items() if n > 0)
+            raise PlanValidationError(f"Dependency cycle between tasks: {cyclic}")
+        return order
+
+    def _compute_ancestors(self) -> dict:
+        ancestors = {}
+        for task_id in self.order:
+            found = set()
+            for dep in self.dependencies[task_id]:
+                found.add(dep)
+                found |= ancestors[dep]
+            ancestors[task_id] = found
+        return ancestors
+
+    def _validate_artifacts(self):
+        producers = {}
+        for task_id, task in self.tasks.items():
+            for artifact in task.get("output_artifacts") or []:
+                if artifact in producers:
+                    raise PlanValidationError(
+                        f"Artifact '{artifact}' is produced by both task {producers[artifact]} and task {task_id}"
+                    )
+                producers[artifact] = task_id
+
+        for task_id, task in self.tasks.items():
+            for artifact in task.get("input_artifacts") or []:
+                producer = producers.get(artifact)
+                if producer is None:
+                    # Not produced by any task, so it must be an uploaded file.
+                    continue
+                if producer == task_id:
+                    raise PlanValidationError(f"Task {task_id} consumes its own output '{artifact}'")
+                if producer not in self.ancestors[task_id]:
+                    raise PlanValidationError(
+                        f"Task {task_id} consumes '{artifact}' from task {producer} without depending on it"
+                    )
+        self.producers = producers
+
+    def ready_tasks(self, completed: set, started: set) -> list:
+        """Returns the ids of tasks whose dependencies are all completed, in topological order."""
+        return [
+            task_id for task_id in self.order
+            if task_id not in started and self.dependencies[task_id] <= completed
+        ]
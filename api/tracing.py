@@ -0,0 +1,281 @@
+"""
+Span-based tracing of the pipeline, plus the Prometheus metrics derived from it.
+
+A request is a tree of spans:
+    request -> upload, plan, task -> attempt -> generate / debug / repair / validate
+    (-> dependency_check) / execute, with vision calls under their task and an
+    llm_call span under every agent call.
+The current span lives in a context variable, like the request deadline, so
+spans opened in concurrent tasks and worker threads nest under whatever was
+current when they were created.
+
+Spans carry their wall time plus attributes set while they run: LLM model, token
+counts, prompt / response sizes and time queued for quota, subprocess CPU time and peak RSS, artifact
+bytes read and written. Every finished span is aggregated into `metrics`
+(served by GET /metrics). With TRACE_EXPORT_FILE set, finished traces are also
+appended to that file as OTLP/JSON, one ExportTraceServiceRequest per line, which
+the OpenTelemetry collector's otlpjsonfile receiver (or jq) can read.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+TRACING = os.environ.get("TRACING", "1") not in ("0", "false", "off")
+TRACE_EXPORT_FILE = os.environ.get("TRACE_EXPORT_FILE")
+SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "data-analyst-agent")
+
+# Upper bounds (seconds) of the span duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 180)
+
+# Span attributes summed into counters: attribute -> (metric, extra labels)
+SUMMED_ATTRIBUTES = {
+    "llm.prompt_tokens": ("dataagent_llm_tokens_total", {"kind": "prompt"}),
+    "llm.response_tokens": ("dataagent_llm_tokens_total", {"kind": "response"}),
+    "llm.prompt_bytes": ("dataagent_llm_bytes_total", {"kind": "prompt"}),
+    "llm.response_bytes": ("dataagent_llm_bytes_total", {"kind": "response"}),
+    "llm.queue_seconds": ("dataagent_llm_queue_seconds_total", {}),
+    "process.cpu_seconds": ("dataagent_subprocess_cpu_seconds_total", {}),
+    "artifact.bytes_read": ("dataagent_artifact_bytes_total", {"direction": "read"}),
+    "artifact.bytes_written": ("dataagent_artifact_bytes_total", {"direction": "written"}),
+}
+# Span attributes kept as the largest value seen
+MAX_ATTRIBUTES = {
+    "process.max_rss_bytes": "dataagent_subprocess_max_rss_bytes",
+}
+# Span attributes that become labels of the metrics above
+LABEL_ATTRIBUTES = {"llm.model": "model"}
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount):
+        """Adds to a numeric attribute, e.g. bytes accumulated over several reads."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self):
+        self.duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # SPAN_KIND_SERVER for the root, SPAN_KIND_INTERNAL below it
+            "kind": 2 if self.parent_id is None else 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in self.attributes.items() if value is not None],
+            # STATUS_CODE_ERROR / STATUS_CODE_UNSET
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """Aggregates finished spans into Prometheus counters, gauges and a duration histogram."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (span name) -> [bucket counts..., +Inf count], sum
+        self._durations = {}
+        self._duration_sums = {}
+        # metric -> {labels tuple: value}
+        self._counters = {}
+        self._maxima = {}
+
+    def observe(self, span: Span):
+        labels = [("span", span.name)]
+        labels += [(label, span.attributes[attribute]) for attribute, label in LABEL_ATTRIBUTES.items()
+                   if span.attributes.get(attribute) is not None]
+        status = "error" if span.error else "ok"
+        with self._lock:
+            buckets = self._durations.setdefault(span.name, [0] * (len(DURATION_BUCKETS) + 1))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+            buckets[-1] += 1
+            self._duration_sums[span.name] = self._duration_sums.get(span.name, 0.0) + span.duration
+            self._inc("dataagent_spans_total", (("span", span.name), ("status", status)), 1)
+            for attribute, (metric, extra) in SUMMED_ATTRIBUTES.items():
+                value = span.attributes.get(attribute)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._inc(metric, tuple(labels) + tuple(extra.items()), value)
+            for attribute, metric in MAX_ATTRIBUTES.items():
+                value = span.attributes.get(attribute)
+                if isinstance(value, (int, float)):
+                    series = self._maxima.setdefault(metric, {})
+                    key = tuple(labels)
+                    series[key] = max(series.get(key, 0), value)
+
+    def _inc(self, metric: str, labels: tuple, amount):
+        series = self._counters.setdefault(metric, {})
+        series[labels] = series.get(labels, 0) + amount
+
+    def render(self, gauges: dict = None) -> str:
+        """Prometheus text exposition; `gauges` adds {name: value} point-in-time values."""
+        lines = []
+        with self._lock:
+            if self._durations:
+                lines += ["# HELP dataagent_span_duration_seconds Wall time of pipeline spans.",
+                          "# TYPE dataagent_span_duration_seconds histogram"]
+                for name, buckets in sorted(self._durations.items()):
+                    for bound, count in zip(DURATION_BUCKETS, buckets):
+                        lines.append(f"dataagent_span_duration_seconds_bucket"
+                                     f"{_label_text((('span', name), ('le', bound)))} {count}")
+                    lines.append(f"dataagent_span_duration_seconds_bucket{_label_text((('span', name), ('le', '+Inf')))} {buckets[-1]}")
+                    lines.append(f"dataagent_span_duration_seconds_sum{_label_text((('span', name),))} {self._duration_sums[name]}")
+                    lines.append(f"dataagent_span_duration_seconds_count{_label_text((('span', name),))} {buckets[-1]}")
+            for kind, table in (("counter", self._counters), ("gauge", self._maxima)):
+                for metric, series in sorted(table.items()):
+                    lines.append(f"# TYPE {metric} {kind}")
+                    for labels, value in sorted(series.items(), key=lambda item: str(item[0])):
+                        lines.append(f"{metric}{_label_text(labels)} {value}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonFileExporter:
+    """
+    Appends each finished trace to a file as one OTLP/JSON line.
+
+    Spans are buffered until their root ends. Spans ending after their root (a shielded
+    LLM call outliving a cancelled request) are written right away as a line of their
+    own; traces whose root never ends are flushed once more than MAX_PENDING_TRACES are
+    buffered, and a trace with more than MAX_PENDING_SPANS spans is written in parts.
+    """
+    MAX_PENDING_TRACES = 256
+    MAX_PENDING_SPANS = 2000
+    # Traces remembered as exported, so their late spans aren't buffered forever
+    MAX_EXPORTED_TRACES = 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()
+        self._exported = collections.OrderedDict()
+
+    def export(self, span: Span):
+        with self._lock:
+            if span.trace_id in self._exported:
+                self._write([span])
+                return
+            spans = self._pending.setdefault(span.trace_id, [])
+            spans.append(span)
+            if span.parent_id is None:
+                # the root ends last: the trace is complete, written in one line
+                del self._pending[span.trace_id]
+                self._write(spans)
+                self._exported[span.trace_id] = True
+                if len(self._exported) > self.MAX_EXPORTED_TRACES:
+                    self._exported.popitem(last=False)
+            elif len(spans) >= self.MAX_PENDING_SPANS:
+                self._write(self._pending.pop(span.trace_id))
+            if len(self._pending) > self.MAX_PENDING_TRACES:
+                _, oldest = self._pending.popitem(last=False)
+                self._write(oldest)
+
+    def _write(self, spans: list):
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "dataagent"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(request, default=str) + "\n")
+        except OSError as e:
+            print(f"Could not export spans to {self.path}: {e}")
+
+
+metrics = Metrics()
+exporter = JsonFileExporter(TRACE_EXPORT_FILE) if TRACE_EXPORT_FILE else None
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+
+
+def current():
+    """The innermost open span, or None."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Opens a child of the current span (a new trace without one) for the block."""
+    if not TRACING:
+        yield None
+        return
+    parent = _current.get()
+    new_span = Span(name, parent.trace_id if parent else os.urandom(16).hex(),
+                    parent.span_id if parent else None, attributes)
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current.reset(token)
+        new_span.end()
+        metrics.observe(new_span)
+        if exporter is not None:
+            exporter.export(new_span)
+
+
+def annotate(**attributes):
+    """Sets attributes on the current span, if there is one."""
+    current_span = _current.get()
+    if current_span is not None:
+        current_span.set(**attributes)
+
+
+def file_bytes(work_dir: str, names) -> int:
+    """Total size of the named files in work_dir; missing ones count as 0."""
+    total = 0
+    for name in names or []:
+        try:
+            total += os.path.getsize(os.path.join(work_dir, name))
+        except (OSError, TypeError):
+            pass
+    return total
@@ -0,0 +1,192 @@
+"""
+Streaming multipart/form-data receiver.
+
+The body is parsed part by part as it arrives from the socket and every file is
+written straight into the session workspace, hashed on the way. Nothing is
+spooled to a temporary file first. Size limits are checked per chunk, so an
+oversized upload is rejected as soon as it crosses the limit (or immediately
+from its Content-Length). A callback fires as soon as a file is complete, so it
+can be profiled while the rest of the body is still being received.
+"""
+import hashlib
+import os
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from schema_sniffer import PARQUET_COPY_SUFFIX
+from workspace import safe_filename
+
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_MB", 200)) * 1024 * 1024
+UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get("UPLOAD_MAX_TOTAL_MB", 500)) * 1024 * 1024
+QUESTIONS_FIELD = "questions.txt"
+# Bytes of a file kept to sniff its format from the content
+SNIFF_HEAD_BYTES = 64
+
+
+class UploadError(Exception):
+    """The request body is not a usable multipart upload."""
+    pass
+
+
+class UploadTooLarge(UploadError):
+    """A file or the whole upload exceeds the configured size limits."""
+    pass
+
+
+class SavedFile:
+    def __init__(self, filename: str, path: str, sha256: str, size: int, head: bytes):
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        # first bytes of the content, for format sniffing
+        self.head = head
+
+
+class _Receiver:
+    """Parser callbacks: routes each part to memory (questions) or to a workspace file."""
+    def __init__(self, work_dir: str, max_file_bytes: int, max_total_bytes: int):
+        self.work_dir = work_dir
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.total_bytes = 0
+        self.questions = None
+        self.saved = []
+        self.finished = []
+        self._begin_part()
+
+    def _begin_part(self):
+        self._field = b""
+        self._value = b""
+        self._headers = {}
+        self._kind = None
+        self._name = None
+        self._handle = None
+        self._digest = None
+        self._size = 0
+        self._head = b""
+        self._chunks = []
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._begin_part,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = b""
+        self._value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        field_name = params.get(b"name", b"").decode("utf-8", "replace")
+        filename = params.get(b"filename")
+        if field_name == QUESTIONS_FIELD:
+            self._kind = "questions"
+        elif filename is None:
+            # plain form fields carry no file
+            self._kind = "field"
+        else:
+            try:
+                self._name = safe_filename(filename.decode("utf-8", "replace") or field_name)
+            except ValueError as e:
+                raise UploadError(str(e))
+            if self._name.lower().endswith(PARQUET_COPY_SUFFIX):
+                # reserved for the Parquet copies made while the upload is still arriving
+                raise UploadError(f"Invalid filename: {self._name!r} (*{PARQUET_COPY_SUFFIX} is reserved)")
+            self._kind = "file"
+            self._digest = hashlib.sha256()
+            self._handle = open(os.path.join(self.work_dir, self._name), "wb")
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        self._size += len(chunk)
+        self.total_bytes += len(chunk)
+        if self._size > self.max_file_bytes:
+            raise UploadTooLarge(f"'{self._name or QUESTIONS_FIELD}' is larger than "
+                                 f"{self.max_file_bytes // (1024 * 1024)} MB")
+        if self.total_bytes > self.max_total_bytes:
+            raise UploadTooLarge(f"Upload is larger than {self.max_total_bytes // (1024 * 1024)} MB")
+        if self._kind == "questions":
+            self._chunks.append(chunk)
+        elif self._kind == "file":
+            if len(self._head) < SNIFF_HEAD_BYTES:
+                self._head += chunk[:SNIFF_HEAD_BYTES - len(self._head)]
+            self._digest.update(chunk)
+            self._handle.write(chunk)
+
+    def _on_part_end(self):
+        if self._kind == "questions":
+            self.questions = b"".join(self._chunks).decode("utf-8", "replace")
+        elif self._kind == "file":
+            self._handle.close()
+            self._handle = None
+            saved = SavedFile(self._name, os.path.join(self.work_dir, self._name),
+                              self._digest.hexdigest(), self._size, self._head)
+            self.saved.append(saved)
+            self.finished.append(saved)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def _boundary(content_type: str) -> bytes:
+    media_type, params = parse_options_header(content_type or "")
+    if media_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise UploadError("Expected a multipart/form-data upload")
+    return params[b"boundary"]
+
+
+async def receive(request, work_dir: str, on_file_saved=None, run_blocking=None,
+                  max_file_bytes: int = UPLOAD_MAX_FILE_BYTES, max_total_bytes: int = UPLOAD_MAX_TOTAL_BYTES):
+    """
+    Streams the request body into `work_dir`. Returns (questions text or None,
+    [SavedFile, ...]). `on_file_saved(saved_file)` is called (on the event loop) as
+    soon as each file is complete. `run_blocking` runs the parser + file writes for a
+    chunk, e.g. asyncio.to_thread; by default they run inline.
+    """
+    boundary = _boundary(request.headers.get("content-type"))
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_total_bytes:
+        raise UploadTooLarge(f"Upload is larger than {max_total_bytes // (1024 * 1024)} MB")
+
+    receiver = _Receiver(work_dir, max_file_bytes, max_total_bytes)
+    parser = MultipartParser(boundary, receiver.callbacks())
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if run_blocking is not None:
+                await run_blocking(parser.write, chunk)
+            else:
+                parser.write(chunk)
+            while receiver.finished:
+                saved = receiver.finished.pop(0)
+                if on_file_saved is not None:
+                    on_file_saved(saved)
+        parser.finalize()
+    except UploadError:
+        raise
+    except ValueError as e:
+        # python-multipart reports malformed bodies as MultipartParseError (a ValueError)
+        raise UploadError(f"Malformed multipart body: {e}")
+    finally:
+        receiver.close()
+    return receiver.questions, receiver.saved
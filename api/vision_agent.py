@@ -1,46 +1,90 @@
 # To run this code you need to install the following dependencies:
 # pip install google-genai
 
+import asyncio
 import base64
+import json
 import os
 import re
-from xmlrpc import client
-from google import genai
 from google.genai import types
+import image_prep
+import llm
 from dotenv import load_dotenv 
 load_dotenv()  # Load environment variables from .env file
 
 
 
-def visual_analysis(image_file_paths: list,task_description: str) -> str:
-    # Open the image file in binary mode
-    
-
-    client = genai.Client(
-        api_key=os.environ.get("GEMINI_API_KEY"),
-    )
-
-
-    for image_file_path in image_file_paths:
-        with open(image_file_path, 'rb') as f:
-            image_bytes = f.read()
-
-    # Prepare the second image as inline data
-    # image2_path = "path/to/image2.png"
-    # with open(image2_path, 'rb') as f:
-    #     img2_bytes = f.read()
-
-    
-    model = "gemini-2.5-flash"
+VISION_MODEL = "gemini-2.5-flash"
+# Upper bound on images sent in one request; more images are split across calls
+VISION_IMAGES_PER_CALL = int(os.environ.get("VISION_IMAGES_PER_CALL", 8))
+# Vision calls in flight across all tasks and requests of this process
+VISION_MAX_CONCURRENCY = int(os.environ.get("VISION_MAX_CONCURRENCY", 4))
+
+_slots = {}
+
+
+def _vision_slots() -> asyncio.Semaphore:
+    """The process-wide vision semaphore of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots.clear()
+        _slots[loop] = asyncio.Semaphore(VISION_MAX_CONCURRENCY)
+    return _slots[loop]
+
+
+def _dedupe(images: list) -> list:
+    """Collapses identical images (same hash and dimensions) into one, named after all of them."""
+    names = {}
+    unique = {}
+    for image in images:
+        key = image.fingerprint or id(image)
+        names.setdefault(key, []).append(image.name)
+        unique.setdefault(key, image)
+    return [image.renamed(", ".join(names[key])) if len(names[key]) > 1 else image
+            for key, image in unique.items()]
+
+
+def _image_parts(images: list) -> list:
+    parts = []
+    for image in images:
+        if len(images) > 1:
+            # name every image so the answer can refer to it
+            parts.append(types.Part.from_text(text=f"Image: {image.name}"))
+        parts.append(types.Part.from_bytes(mime_type=image.mime_type, data=image.data))
+    return parts
+
+
+async def visual_analysis(image_file_paths: list,task_description: str) -> str:
+    # Read, type-check and shrink all images off the event loop
+    images = await asyncio.to_thread(lambda: [image_prep.prepare_image(path) for path in image_file_paths])
+    for image in images:
+        if len(image.data) < image.original_bytes:
+            print(f"Vision: {image.name} reduced from {image.original_bytes // 1024} KB "
+                  f"to {len(image.data) // 1024} KB ({image.width}x{image.height})")
+
+    images = _dedupe(images)
+
+    # Batches go out concurrently, bounded by VISION_MAX_CONCURRENCY for the whole process
+    batches = [images[i:i + VISION_IMAGES_PER_CALL] for i in range(0, len(images), VISION_IMAGES_PER_CALL)]
+    outputs = await asyncio.gather(*(_analyze_batch(batch, task_description) for batch in batches or [[]]))
+    if len(outputs) == 1:
+        return outputs[0]
+    # One JSON document for the task's output artifact, keyed by the images of each call
+    merged = {}
+    for batch, output in zip(batches, outputs):
+        try:
+            merged[", ".join(image.name for image in batch)] = json.loads(output)
+        except ValueError:
+            merged[", ".join(image.name for image in batch)] = output
+    return json.dumps(merged)
+
+
+async def _analyze_batch(images: list, task_description: str) -> str:
+    model = VISION_MODEL
     contents = [
         types.Content(
             role="user",
-            parts=[
-                types.Part.from_bytes(
-                    mime_type="image/jpeg",
-                    # data=base64.b64decode(base64_string),
-                    data=image_bytes,
-                ),
+            parts=_image_parts(images) + [
                 types.Part.from_text(text=task_description),
             ],
         ),
@@ -53,7 +97,7 @@ You are a specialized AI Vision Analyst. You act as the \"eyes\" for a larger au
 ---
 # INPUTS YOU WILL RECEIVE
 
-1.  **IMAGE:** The input image file (`.png`, `.jpg`, etc.) that you must analyze.
+1.  **IMAGE:** The input image file(s) (`.png`, `.jpg`, etc.) that you must analyze. When there are several, each one is preceded by its file name.
 2.  **TEXT PROMPT:** A clear, specific instruction detailing what information needs to be extracted, transcribed, or inferred from the image.
 
 ---
@@ -94,13 +138,12 @@ If you cannot confidently fulfill the request in the `TEXT PROMPT` (e.g., the im
         ],
     )
 
-    res = client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    )
-
-    llm_output = res.text
+    async with _vision_slots():
+        llm_output = await llm.generate_text(
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+        )
 
     # text might sometime contain backtickes, so we need to handle that
     pattern = r"```(?:json\n)?(.*?)```"
@@ -0,0 +1,465 @@
+"""
+Pool of pre-imported Python worker processes for running generated scripts.
+
+Starting `python script.py` for every attempt pays interpreter startup plus the
+pandas/numpy/matplotlib/pyarrow/duckdb imports each time. A worker imports
+those once and then forks a child per script, so every script still runs in its
+own process (fresh globals, own cwd, own stdout/stderr) but starts from a warm
+interpreter. Workers are recycled after WORKER_MAX_RUNS scripts or once their
+RSS grows past WORKER_MAX_RSS_MB; a replacement that fails to start is retried
+with backoff.
+
+The pool never queues: a script that finds no idle worker (all busy, or none
+alive) gets NoIdleWorker and sandbox.py runs it in a fresh interpreter, so up to
+WORKER_POOL_SIZE scripts run warm and the rest are bounded by
+SANDBOX_MAX_CONCURRENCY as before.
+
+The worker side of this module only works where os.fork exists; elsewhere the
+pool is never started and sandbox.py runs every script in a fresh interpreter.
+Either way the child gets sandbox.py's rlimits and filtered environment.
+
+Protocol: one JSON object per line on the worker's stdin/stdout.
+"""
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", 2))
+WORKER_MAX_RUNS = int(os.environ.get("WORKER_MAX_RUNS", 50))
+WORKER_MAX_RSS_MB = int(os.environ.get("WORKER_MAX_RSS_MB", 1024))
+WORKER_PRELOAD = [
+    name.strip()
+    for name in os.environ.get(
+        "WORKER_PRELOAD", "numpy,pandas,matplotlib,matplotlib.pyplot,pyarrow,pyarrow.parquet,duckdb,requests,bs4"
+    ).split(",")
+    if name.strip()
+]
+# Responses carry the full stdout/stderr of a script on a single line
+_MAX_LINE_BYTES = 256 * 1024 * 1024
+# Delay before retrying a failed respawn, doubled per attempt up to the max
+_RESPAWN_BACKOFF_SECONDS = 0.5
+_RESPAWN_BACKOFF_MAX_SECONDS = 30.0
+
+
+class WorkerError(Exception):
+    """Raised when a worker dies or answers with something that isn't a result."""
+
+
+class NoIdleWorker(WorkerError):
+    """Raised by WorkerPool.run when every worker is busy or none is alive."""
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Worker process side
+# ---------------------------------------------------------------------------
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_script_in_child(script_path: str, cwd: str, stdout_path: str, stderr_path: str, protocol_fd: int,
+                         limits: dict = None):
+    """
+    Runs in the forked child: behaves like `python script_path` started in `cwd`, under
+    the sandbox's rlimits and environment (see sandbox.py), then exits.
+    """
+    import atexit
+    import random
+    import runpy
+    import traceback
+    import sandbox
+
+    exit_code = 0
+    try:
+        os.close(protocol_fd)
+        os.setpgid(0, 0)
+        # Handlers registered by the worker must not run in the child
+        atexit._clear()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(os.open(stdout_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 1)
+        os.dup2(os.open(stderr_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 2)
+
+        os.chdir(cwd)
+        env = sandbox.script_env()
+        os.environ.clear()
+        os.environ.update(env)
+        if limits:
+            sandbox.apply_limits(sandbox.Limits.from_dict(limits))
+        sys.argv = [script_path]
+        sys.path[0] = os.path.dirname(script_path)
+
+        # Children of the same worker would otherwise share the worker's RNG state
+        random.seed()
+        if "numpy" in sys.modules:
+            sys.modules["numpy"].random.seed()
+
+        try:
+            runpy.run_path(script_path, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except BaseException as e:
+            # Hide the runpy frames so the traceback looks like a plain `python script.py` run
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename != script_path:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb or e.__traceback__)
+            exit_code = 1
+
+        try:
+            atexit._run_exitfuncs()
+        except BaseException:
+            traceback.print_exc()
+    except BaseException:
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def _wait_child(pid: int, timeout):
+    """waitpid with an optional timeout; kills the child's process group when it runs over."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.001
+    timed_out = False
+    while True:
+        waited, status, usage = os.wait4(pid, os.WNOHANG)
+        if waited == pid:
+            break
+        if deadline is not None and time.monotonic() > deadline and not timed_out:
+            timed_out = True
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        time.sleep(delay)
+        delay = min(delay * 2, 0.02)
+
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    return returncode, usage, timed_out
+
+
+def serve():
+    """Worker main loop: preload modules, then fork one child per request."""
+    # Keep the real stdout for the protocol; anything else printed goes to stderr
+    protocol_fd = os.dup(1)
+    os.dup2(2, 1)
+    protocol = os.fdopen(protocol_fd, "w")
+    requests_in = sys.stdin
+
+    for module in WORKER_PRELOAD + ["sandbox"]:
+        try:
+            __import__(module)
+        except Exception as e:
+            print(f"worker {os.getpid()}: could not preload {module}: {e}", file=sys.stderr)
+
+    current_child = {"pid": None}
+
+    def terminate(signum, frame):
+        if current_child["pid"]:
+            try:
+                os.killpg(current_child["pid"], signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    protocol.write(json.dumps({"ready": True, "pid": os.getpid()}) + "\n")
+    protocol.flush()
+
+    for line in requests_in:
+        request = json.loads(line)
+        script_path = request["script"]
+        cwd = request["cwd"]
+        out_fd, stdout_path = tempfile.mkstemp(prefix="worker_out_")
+        err_fd, stderr_path = tempfile.mkstemp(prefix="worker_err_")
+        os.close(out_fd)
+        os.close(err_fd)
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            started = time.monotonic()
+            pid = os.fork()
+            if pid == 0:
+                _run_script_in_child(script_path, cwd, stdout_path, stderr_path, protocol_fd, request.get("limits"))
+            try:
+                # Also done in the child; whichever runs first avoids a killpg race
+                os.setpgid(pid, pid)
+            except OSError:
+                pass
+            current_child["pid"] = pid
+            returncode, usage, timed_out = _wait_child(pid, request.get("timeout"))
+            current_child["pid"] = None
+
+            # only the first output_kb of each stream is sent back, see sandbox.py
+            max_output = (request.get("limits") or {}).get("output_kb", 0) * 1024 or None
+            with open(stdout_path, "rb") as f:
+                stdout = f.read(max_output).decode(errors="replace")
+            with open(stderr_path, "rb") as f:
+                stderr = f.read(max_output).decode(errors="replace")
+            response = {
+                "returncode": returncode,
+                "stdout": stdout,
+                "stderr": stderr,
+                "stdout_bytes": os.path.getsize(stdout_path),
+                "stderr_bytes": os.path.getsize(stderr_path),
+                "timed_out": timed_out,
+                "wall_seconds": time.monotonic() - started,
+                "cpu_seconds": usage.ru_utime + usage.ru_stime,
+                "max_rss_kb": usage.ru_maxrss,
+                "worker_rss_kb": _rss_kb(),
+            }
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}", "worker_rss_kb": _rss_kb()}
+        finally:
+            for path in (stdout_path, stderr_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        protocol.write(json.dumps(response) + "\n")
+        protocol.flush()
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+class _Worker:
+    def __init__(self, process):
+        self.process = process
+        self.runs = 0
+        self.rss_kb = 0
+        # set once the protocol broke; returncode may lag behind a worker's death
+        self.dead = False
+
+    @classmethod
+    async def spawn(cls):
+        import sandbox
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", os.path.abspath(__file__),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            # the forked children can read their inherited environment back from /proc,
+            # so workers never get the server's secrets in the first place
+            env=sandbox.worker_env(),
+            limit=_MAX_LINE_BYTES,
+        )
+        worker = cls(process)
+        hello = await worker._read()
+        if not hello.get("ready"):
+            await worker.kill()
+            raise WorkerError(f"Worker failed to start: {hello}")
+        return worker
+
+    async def _read(self) -> dict:
+        try:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise WorkerError(f"Worker {self.process.pid} exited unexpectedly")
+            return json.loads(line)
+        except (OSError, EOFError, ValueError) as e:
+            # a broken pipe, an oversized or garbled line: the worker can't be trusted any more
+            self.dead = True
+            raise WorkerError(f"Worker {self.process.pid} failed: {type(e).__name__}: {e}") from e
+        except WorkerError:
+            self.dead = True
+            raise
+
+    async def run(self, script_path: str, cwd: str, timeout, limits: dict = None) -> dict:
+        request = {"script": script_path, "cwd": cwd, "timeout": timeout, "limits": limits}
+        try:
+            self.process.stdin.write((json.dumps(request) + "\n").encode())
+            await self.process.stdin.drain()
+        except OSError as e:
+            # e.g. ConnectionResetError / BrokenPipeError from a worker killed while idle
+            self.dead = True
+            raise WorkerError(f"Worker {self.process.pid} is gone: {type(e).__name__}: {e}") from e
+        response = await self._read()
+        self.runs += 1
+        self.rss_kb = response.get("worker_rss_kb", 0)
+        if "error" in response:
+            raise WorkerError(response["error"])
+        return response
+
+    @property
+    def alive(self) -> bool:
+        return not self.dead and self.process.returncode is None
+
+    async def kill(self):
+        if self.alive:
+            # SIGTERM lets the worker take its running child down with it
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+
+class WorkerPool:
+    """Fixed-size pool of warm workers with recycling; run() is safe to call concurrently and never waits."""
+    def __init__(self, size: int = WORKER_POOL_SIZE, max_runs: int = WORKER_MAX_RUNS,
+                 max_rss_mb: int = WORKER_MAX_RSS_MB):
+        self.size = size
+        self.max_runs = max_runs
+        self.max_rss_kb = max_rss_mb * 1024
+        self._idle = asyncio.Queue()
+        self._replacements = set()
+        self._closing = asyncio.Event()
+        self.busy = 0
+        self.runs = 0
+        self.recycled = 0
+        self.respawn_failures = 0
+        self.overflow = 0
+        self.closed = False
+
+    async def start(self):
+        workers = await asyncio.gather(*(_Worker.spawn() for _ in range(self.size)))
+        for worker in workers:
+            self._idle.put_nowait(worker)
+        print(f"Worker pool started with {self.size} pre-imported workers")
+
+    def _replace(self, worker: _Worker):
+        """Kills a worker and spawns its replacement in the background, retrying until one starts."""
+        async def replace():
+            await worker.kill()
+            attempt = 0
+            while not self.closed:
+                try:
+                    replacement = await _Worker.spawn()
+                except Exception as e:
+                    self.respawn_failures += 1
+                    delay = min(_RESPAWN_BACKOFF_MAX_SECONDS, _RESPAWN_BACKOFF_SECONDS * 2 ** attempt)
+                    attempt += 1
+                    print(f"Could not respawn pool worker ({e}), retrying in {delay:.1f}s", file=sys.stderr)
+                    try:
+                        await asyncio.wait_for(self._closing.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.closed:
+                    await replacement.kill()
+                else:
+                    self._idle.put_nowait(replacement)
+                return
+
+        self.recycled += 1
+        task = asyncio.create_task(replace())
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    async def run(self, script_path: str, cwd: str, timeout: float = None, limits: dict = None) -> dict:
+        """
+        Runs a script in an idle worker and returns the worker's response: returncode,
+        (capped) stdout / stderr, their full sizes, timed_out and the child's resource usage.
+        Raises NoIdleWorker instead of waiting when no live worker is idle.
+        """
+        worker = self._take_idle()
+        self.busy += 1
+        try:
+            response = await worker.run(os.path.abspath(script_path), os.path.abspath(cwd), timeout, limits)
+        except BaseException:
+            # Cancelled mid-run or the worker died: either way it can't be trusted any more
+            self._replace(worker)
+            raise
+        finally:
+            self.busy -= 1
+
+        self.runs += 1
+        if worker.runs >= self.max_runs or worker.rss_kb > self.max_rss_kb or not worker.alive:
+            self._replace(worker)
+        else:
+            self._idle.put_nowait(worker)
+
+        return response
+
+    def _take_idle(self) -> _Worker:
+        while not self.closed:
+            try:
+                worker = self._idle.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if worker.alive:
+                return worker
+            # died while idle: replace it and look at the next one
+            self._replace(worker)
+        self.overflow += 1
+        raise NoIdleWorker(f"No idle worker ({self.busy} of {self.size} busy)")
+
+    async def close(self):
+        self.closed = True
+        self._closing.set()
+        while not self._idle.empty():
+            await self._idle.get_nowait().kill()
+        await asyncio.gather(*self._replacements, return_exceptions=True)
+
+    def metrics(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "busy": self.busy,
+            "runs": self.runs,
+            "recycled": self.recycled,
+            "respawn_failures": self.respawn_failures,
+            "overflow": self.overflow,
+        }
+
+
+_pool = None
+
+
+async def start_pool():
+    """Starts the process-wide pool if it is enabled and supported on this platform."""
+    global _pool
+    if _pool is not None or WORKER_POOL_SIZE <= 0 or not hasattr(os, "fork"):
+        return _pool
+    pool = WorkerPool()
+    try:
+        await pool.start()
+    except Exception as e:
+        print(f"Worker pool disabled, could not start workers: {e}", file=sys.stderr)
+        await pool.close()
+        return None
+    _pool = pool
+    return _pool
+
+
+async def stop_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool():
+    return _pool
+
+
+if __name__ == "__main__":
+    serve()
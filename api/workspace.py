@@ -0,0 +1,78 @@
+import os
+import re
+import shutil
+import time
+import uuid
+
+# All session workspaces live under this directory, one sub-directory per request.
+WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT", "session_workspace")
+# Finished sessions are kept around (for /final-result/{session_id}) this long.
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", 3600))
+# Files that survive the end-of-request cleanup.
+KEEP_AFTER_CLEANUP = ("final_output.json",)
+
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def session_dir(session_id: str) -> str:
+    """Returns the workspace path of a session, rejecting anything that isn't a session id."""
+    if not _SESSION_ID_PATTERN.match(session_id or ""):
+        raise ValueError(f"Invalid session id: {session_id!r}")
+    return os.path.join(os.path.abspath(WORKSPACE_ROOT), session_id)
+
+
+def create_workspace(session_id: str) -> str:
+    path = session_dir(session_id)
+    os.makedirs(path, exist_ok=False)
+    return path
+
+
+def safe_filename(filename: str) -> str:
+    """Strips any directory components from an uploaded filename."""
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    if name in ("", ".", ".."):
+        raise ValueError(f"Invalid filename: {filename!r}")
+    return name
+
+
+def cleanup_workspace(session_id: str, keep: tuple = KEEP_AFTER_CLEANUP):
+    """Deletes everything in a session's workspace except the files in `keep`."""
+    path = session_dir(session_id)
+    if not os.path.isdir(path):
+        return
+    for entry in os.listdir(path):
+        if entry in keep:
+            continue
+        entry_path = os.path.join(path, entry)
+        if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+
+
+def remove_workspace(session_id: str):
+    shutil.rmtree(session_dir(session_id), ignore_errors=True)
+
+
+def sweep_expired_workspaces(ttl_seconds: int = SESSION_TTL_SECONDS, active: set = frozenset()):
+    """Removes session workspaces that haven't been touched for `ttl_seconds`."""
+    root = os.path.abspath(WORKSPACE_ROOT)
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - ttl_seconds
+    for entry in os.listdir(root):
+        if not _SESSION_ID_PATTERN.match(entry) or entry in active:
+            continue
+        path = os.path.join(root, entry)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
@@ -0,0 +1,245 @@
+"""
+A deterministic stand-in for the Gemini REST API.
+
+Answers generateContent requests with the scripted plans, scripts and vision
+answers of the benchmark corpus (see scenarios.py), after a fixed simulated
+latency per agent. The agent is recognised from its system instruction, so the
+prompts in api/ are exercised unchanged. Point the app at it with
+GEMINI_BASE_URL=http://127.0.0.1:<port>.
+
+With rpm_per_key set it also enforces a requests-per-minute quota per API key
+and model like Gemini's, answering 429 RESOURCE_EXHAUSTED with a retryDelay, so the rate
+limiter and key balancing of api/rate_limiter.py can be exercised locally.
+
+Standalone, for benchmarking a separately started server:
+    python benchmarks/fake_gemini.py --port 8765 --latency-ms 200
+"""
+import argparse
+import ast
+import collections
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import scenarios
+
+# A distinctive phrase of each agent's system instruction
+AGENT_MARKERS = {
+    "planner": "AI project planner",
+    "code": "Python data engineer",
+    "debug": "Python debugging service",
+    "vision": "Vision Analyst",
+}
+
+_PATH_PATTERN = re.compile(r"^/v1(?:beta|alpha)?/models/([^/:]+):generateContent")
+_BUNDLE_PATTERN = re.compile(r"Benchmark bundle: (\w+)")
+_TASK_PATTERN = re.compile(r"\[bench:(\w+):(\w+)\]")
+_ARTIFACTS_PATTERN = {
+    "IN": re.compile(r"[Ii]nput[_ ]artifacts'?\"?: (\[[^\]]*\])"),
+    "OUT": re.compile(r"[Oo]utput[_ ]artifacts'?\"?: (\[[^\]]*\])"),
+}
+_PLACEHOLDER_PATTERN = re.compile(r"__(IN|OUT)(\d+)__")
+
+
+class ScriptError(Exception):
+    """The request can't be answered from the corpus."""
+    pass
+
+
+def _texts(parts) -> str:
+    return "\n".join(part.get("text", "") for part in parts or [] if isinstance(part, dict))
+
+
+def _artifacts(prompt: str) -> dict:
+    found = {}
+    for kind, pattern in _ARTIFACTS_PATTERN.items():
+        match = pattern.search(prompt)
+        found[kind] = ast.literal_eval(match.group(1)) if match else []
+    return found
+
+
+def fill_template(template: str, prompt: str) -> str:
+    """Replaces __IN<n>__ / __OUT<n>__ with the artifact names given in the prompt."""
+    artifacts = _artifacts(prompt)
+
+    def replace(match):
+        names = artifacts[match.group(1)]
+        index = int(match.group(2))
+        if index >= len(names):
+            raise ScriptError(f"prompt lists no {match.group(0)} artifact")
+        return names[index]
+    return _PLACEHOLDER_PATTERN.sub(replace, template)
+
+
+class FakeGemini:
+    """The scripted model plus the HTTP server exposing it."""
+    def __init__(self, corpus: dict, latency_ms: dict = None, host: str = "127.0.0.1", port: int = 0,
+                 rpm_per_key: int = 0):
+        self.corpus = corpus
+        # simulated latency per agent, e.g. {"planner": 800, "code": 400}
+        self.latency_ms = latency_ms or {}
+        # requests per minute allowed per API key, 0 for no quota
+        self.rpm_per_key = rpm_per_key
+        self.calls = {agent: 0 for agent in AGENT_MARKERS}
+        self.errors = 0
+        self.key_calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self._windows = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"calls": dict(self.calls), "errors": self.errors}
+            if self.rpm_per_key or len(self.key_calls) > 1:
+                stats["key_calls"] = dict(self.key_calls)
+                stats["throttled"] = dict(self.throttled)
+            return stats
+
+    def admit(self, api_key: str, model: str) -> float:
+        """Counts a request against the key's quota for the model: 0 if admitted, else seconds until it would be."""
+        now = time.monotonic()
+        with self._lock:
+            self.key_calls[api_key] += 1
+            if not self.rpm_per_key:
+                return 0.0
+            window = self._windows[(api_key, model)]
+            while window and window[0] <= now - 60:
+                window.popleft()
+            if len(window) >= self.rpm_per_key:
+                self.throttled[api_key] += 1
+                return window[0] + 60 - now
+            window.append(now)
+            return 0.0
+
+    def answer(self, body: dict) -> str:
+        """The scripted response text for one generateContent request body."""
+        system = _texts((body.get("systemInstruction") or body.get("system_instruction") or {}).get("parts"))
+        prompt = "\n".join(_texts(content.get("parts")) for content in body.get("contents") or [])
+        agent = next((name for name, marker in AGENT_MARKERS.items() if marker in system), None)
+        if agent is None:
+            raise ScriptError("unrecognised agent")
+        with self._lock:
+            self.calls[agent] += 1
+        time.sleep(self.latency_ms.get(agent, 0) / 1000)
+
+        if agent == "planner":
+            match = _BUNDLE_PATTERN.search(prompt)
+            if not match or match.group(1) not in self.corpus:
+                raise ScriptError("no benchmark bundle named in the questions")
+            return scenarios.plan_json(self.corpus[match.group(1)])
+
+        match = _TASK_PATTERN.search(prompt)
+        if not match or match.group(1) not in self.corpus:
+            raise ScriptError(f"no benchmark task tag in the {agent} prompt")
+        bundle, task_id = self.corpus[match.group(1)], match.group(2)
+        if agent == "vision":
+            return json.dumps(bundle.vision[task_id])
+        if agent == "code" and task_id in bundle.broken_code:
+            return fill_template(bundle.broken_code[task_id], prompt)
+        # the debugger always comes back with the working script
+        return fill_template(bundle.code[task_id], prompt)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                match = _PATH_PATTERN.match(self.path)
+                if not match:
+                    self._reply(404, {"error": {"code": 404, "message": f"Unknown path {self.path}", "status": "NOT_FOUND"}})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                retry_after = fake.admit(self.headers.get("x-goog-api-key") or "", match.group(1))
+                if retry_after:
+                    self.rfile.read(length)
+                    self._reply(429, {"error": {
+                        "code": 429, "message": "fake gemini: quota exceeded", "status": "RESOURCE_EXHAUSTED",
+                        "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                                     "retryDelay": f"{math.ceil(retry_after)}s"}],
+                    }})
+                    return
+                try:
+                    text = fake.answer(json.loads(self.rfile.read(length) or b"{}"))
+                except (ScriptError, KeyError, ValueError) as e:
+                    with fake._lock:
+                        fake.errors += 1
+                    self._reply(400, {"error": {"code": 400, "message": f"fake gemini: {e}", "status": "INVALID_ARGUMENT"}})
+                    return
+                self._reply(200, {
+                    "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                    "finishReason": "STOP", "index": 0}],
+                    "usageMetadata": {"promptTokenCount": length // 4, "candidatesTokenCount": len(text) // 4,
+                                      "totalTokenCount": length // 4 + len(text) // 4},
+                    "modelVersion": match.group(1),
+                })
+
+            def _reply(self, status: int, payload: dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def latency_profile(latency_ms: float, overrides: list = None) -> dict:
+    """Per-agent latency from a default plus "agent=ms" overrides."""
+    profile = {agent: latency_ms for agent in AGENT_MARKERS}
+    for override in overrides or []:
+        agent, _, value = override.partition("=")
+        if agent not in AGENT_MARKERS or not value:
+            raise ValueError(f"Invalid latency override '{override}', expected one of "
+                             f"{', '.join(AGENT_MARKERS)}=<ms>")
+        profile[agent] = float(value)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic fake Gemini server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated latency of every call")
+    parser.add_argument("--agent-latency", action="append", metavar="AGENT=MS",
+                        help="per-agent latency, e.g. planner=1500 (repeatable)")
+    parser.add_argument("--rpm-per-key", type=int, default=0, help="answer 429 beyond this many requests per minute per key and model")
+    args = parser.parse_args()
+    fake = FakeGemini(scenarios.build_corpus(), latency_profile(args.latency_ms, args.agent_latency),
+                      host=args.host, port=args.port, rpm_per_key=args.rpm_per_key)
+    print(f"Fake Gemini listening on {fake.url} (GEMINI_BASE_URL={fake.url})")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
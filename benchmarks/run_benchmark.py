@@ -0,0 +1,251 @@
+"""
+End-to-end benchmark of /upload against the fake Gemini server.
+
+Sends the bundles of scenarios.py through the real app (planner, orchestrator,
+worker pool, agents) at one or more concurrency levels, with every LLM call
+answered by fake_gemini.py after a fixed simulated latency. Reports:
+- requests/sec and client-side latency percentiles per concurrency level;
+- per-stage latency percentiles from the Server-Timing header (upload, planning,
+  codegen, debug, validation, execution, vision, ... and total);
+- peak RSS of the server process and of its largest child (worker / script);
+- fake LLM calls per agent, and answers that didn't match the expected ones.
+
+By default the app runs in-process (httpx over ASGI), with the LLM cache, result
+cache and artifact store switched off so every request does the full work;
+set those variables yourself to benchmark them too. --fake-rpm makes the fake
+server enforce a per-key quota (answering 429 beyond it) and --api-keys spreads
+calls over that many keys, to measure api/rate_limiter.py; set LLM_RPM to let the
+limiter queue calls instead of collecting 429s. With --url, an already
+running server is measured instead (start it with GEMINI_BASE_URL pointing at
+`python benchmarks/fake_gemini.py`); peak RSS is then not reported.
+
+    python benchmarks/run_benchmark.py --requests 20 --concurrency 1 4 8 --latency-ms 100
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "api")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import httpx
+
+import fake_gemini
+import scenarios
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def parse_server_timing(header: str) -> dict:
+    """{stage: milliseconds} from a Server-Timing header value."""
+    timings = {}
+    for metric in (header or "").split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
+
+def _peak_rss_mb(who) -> float:
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Sample:
+    def __init__(self, bundle: str, status: int, latency_ms: float, stages: dict, correct: bool, error: str = None):
+        self.bundle = bundle
+        self.status = status
+        self.latency_ms = latency_ms
+        self.stages = stages
+        self.correct = correct
+        self.error = error
+
+
+async def send_bundle(client: httpx.AsyncClient, bundle: scenarios.Bundle) -> Sample:
+    files = [("questions.txt", ("questions.txt", bundle.questions.encode(), "text/plain"))]
+    files += [(name, (name, data, "application/octet-stream")) for name, data in bundle.files.items()]
+    started = time.perf_counter()
+    try:
+        response = await client.post("/upload", files=files)
+    except httpx.HTTPError as e:
+        return Sample(bundle.name, 0, (time.perf_counter() - started) * 1000, {}, False, str(e))
+    latency_ms = (time.perf_counter() - started) * 1000
+    stages = parse_server_timing(response.headers.get("server-timing"))
+    if response.status_code != 200:
+        return Sample(bundle.name, response.status_code, latency_ms, stages, False, response.text[:200])
+    try:
+        answer = response.json()
+    except ValueError:
+        answer = None
+    # compare through JSON, so tuples / ints vs floats don't count as differences
+    correct = json.loads(json.dumps(bundle.expected)) == answer
+    return Sample(bundle.name, 200, latency_ms, stages, correct, None if correct else f"unexpected answer: {answer}")
+
+
+async def run_level(client: httpx.AsyncClient, corpus: dict, requests: int, concurrency: int) -> dict:
+    """Sends `requests` bundles (round robin over the corpus) with `concurrency` in flight."""
+    bundles = list(corpus.values())
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(bundles[i % len(bundles)])
+    samples = []
+
+    async def worker():
+        while not queue.empty():
+            samples.append(await send_bundle(client, queue.get_nowait()))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarize(samples, concurrency, elapsed)
+
+
+def summarize(samples: list, concurrency: int, elapsed: float) -> dict:
+    ok = [s for s in samples if s.status == 200]
+    stages = {}
+    for sample in ok:
+        for name, ms in sample.stages.items():
+            stages.setdefault(name, []).append(ms)
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "wrong_answers": sum(1 for s in ok if not s.correct),
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(samples) / elapsed, 3) if elapsed else None,
+        "latency_ms": {f"p{p}": round(percentile([s.latency_ms for s in samples], p), 1)
+                       for p in PERCENTILES} if samples else {},
+        "stage_ms": {name: {f"p{p}": round(percentile(values, p), 1) for p in PERCENTILES}
+                     for name, values in sorted(stages.items())},
+        "errors": [f"{s.bundle}: {s.status} {s.error}" for s in samples if s.error][:10],
+    }
+
+
+def print_report(report: dict):
+    print(f"\nBundles: {', '.join(report['bundles'])}; fake LLM latency: {report['llm_latency_ms']}")
+    for level in report["levels"]:
+        latency = level["latency_ms"]
+        print(f"\n== concurrency {level['concurrency']}: {level['requests']} requests in "
+              f"{level['elapsed_seconds']}s -> {level['requests_per_second']} req/s "
+              f"({level['succeeded']} ok, {level['wrong_answers']} wrong answers)")
+        print(f"   {'stage':<14}" + "".join(f"{f'p{p} ms':>12}" for p in PERCENTILES))
+        print(f"   {'client':<14}" + "".join(f"{latency.get(f'p{p}', 0):>12}" for p in PERCENTILES))
+        for name, values in level["stage_ms"].items():
+            print(f"   {name:<14}" + "".join(f"{values[f'p{p}']:>12}" for p in PERCENTILES))
+        for error in level["errors"]:
+            print(f"   ! {error}")
+    if report.get("peak_rss_mb"):
+        rss = report["peak_rss_mb"]
+        print(f"\nPeak RSS: server {rss['server']} MB, largest child process {rss['children']} MB")
+    if report.get("llm_calls"):
+        print(f"Fake LLM calls: {report['llm_calls']}")
+    if report.get("rate_limiter"):
+        print(f"Rate limiter: {report['rate_limiter']}")
+
+
+def _configure_in_process(work_root: str, fake_url: str, api_keys: int = 1):
+    """Environment for the in-process app; must run before api/ modules are imported."""
+    os.environ["GEMINI_BASE_URL"] = fake_url
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    if api_keys > 1:
+        os.environ["GEMINI_API_KEYS"] = ",".join(f"benchmark-{i}" for i in range(1, api_keys + 1))
+    # the fake server's 429s come with short retry delays; don't let a backoff outlast the run
+    os.environ.setdefault("LLM_BACKOFF_MAX_SECONDS", "5")
+    os.environ["WORKSPACE_ROOT"] = os.path.join(work_root, "workspaces")
+    os.environ.setdefault("LLM_CACHE", "off")
+    os.environ.setdefault("RESULT_CACHE", "0")
+    os.environ.setdefault("ARTIFACT_STORE", "0")
+    os.environ.setdefault("DEPENDENCY_OFFLINE", "1")
+    os.environ.setdefault("DEPENDENCY_CACHE_PATH", os.path.join(work_root, "dependency_verdicts.json"))
+    sys.path.insert(0, API_DIR)
+
+
+async def _run_in_process(main, args, corpus: dict, report: dict, timeout: httpx.Timeout):
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+            if args.warmup:
+                await run_level(client, corpus, args.warmup, 1)
+            for concurrency in args.concurrency:
+                report["levels"].append(await run_level(client, corpus, args.requests, concurrency))
+
+
+async def run(args) -> dict:
+    corpus = scenarios.build_corpus(args.bundles)
+    latency = fake_gemini.latency_profile(args.latency_ms, args.agent_latency)
+    report = {"bundles": list(corpus), "llm_latency_ms": latency, "levels": []}
+    timeout = httpx.Timeout(args.timeout)
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            for concurrency in args.concurrency:
+                report["levels"].append(await run_level(client, corpus, args.requests, concurrency))
+        return report
+
+    fake = fake_gemini.FakeGemini(corpus, latency, rpm_per_key=args.fake_rpm).start()
+    with tempfile.TemporaryDirectory(prefix="dataagent-bench-") as work_root:
+        _configure_in_process(work_root, fake.url, args.api_keys)
+        import main
+
+        try:
+            # the app logs every task; keep it out of the report
+            with open(args.app_log, "a") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+                await _run_in_process(main, args, corpus, report, timeout)
+        finally:
+            fake.stop()
+    # children are only accounted once reaped, i.e. after the worker pool has stopped
+    report["peak_rss_mb"] = {"server": _peak_rss_mb(resource.RUSAGE_SELF),
+                             "children": _peak_rss_mb(resource.RUSAGE_CHILDREN)}
+    report["llm_calls"] = fake.stats()
+    report["rate_limiter"] = main.rate_limiter.limiter.stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /upload end to end against a fake Gemini server")
+    parser.add_argument("--requests", type=int, default=20, help="requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="concurrency levels")
+    parser.add_argument("--bundles", nargs="+", help=f"subset of: {', '.join(scenarios.BUILDERS)}")
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated latency of every LLM call")
+    parser.add_argument("--agent-latency", action="append", metavar="AGENT=MS",
+                        help="per-agent latency, e.g. planner=1500 (repeatable)")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests before measuring")
+    parser.add_argument("--timeout", type=float, default=300, help="client timeout per request (seconds)")
+    parser.add_argument("--fake-rpm", type=int, default=0, help="requests per minute per key and model the fake server allows")
+    parser.add_argument("--api-keys", type=int, default=1, help="number of API keys the in-process app spreads calls over")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--app-log", default=os.devnull, help="where the in-process app's output goes")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = sum(level["requests"] - level["succeeded"] + level["wrong_answers"] for level in report["levels"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
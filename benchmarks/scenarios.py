@@ -0,0 +1,351 @@
+"""
+The benchmark corpus: representative question bundles with scripted LLM answers.
+
+Every bundle has a questions.txt, the data files uploaded with it, the plan the
+fake planner returns, the code the fake code generator returns for each task and
+the answer the pipeline must produce. Data files are generated deterministically
+at start-up, so nothing binary is checked in.
+
+The fake server (fake_gemini.py) finds its way around with two markers:
+- "Benchmark bundle: <name>" in questions.txt selects the plan;
+- "[bench:<bundle>:<task_id>]" in a task description selects the code.
+Code templates use __IN<n>__ / __OUT<n>__ for the task's n-th input / output
+artifact, filled in from the prompt, so they keep working when the orchestrator
+renames artifacts (e.g. intermediate .parquet files to .arrow).
+Tasks listed in `broken_code` first get a script that fails at run time, so the
+debugger round trip is part of the measurement.
+"""
+import io
+import json
+import random
+import sqlite3
+
+SEED = 7
+
+
+class Bundle:
+    def __init__(self, name: str, questions: str, files: dict, plan: list, code: dict, expected,
+                 broken_code: dict = None, vision: dict = None):
+        self.name = name
+        self.questions = f"Benchmark bundle: {name}\n{questions}"
+        # {filename: bytes}
+        self.files = files
+        self.plan = plan
+        # {task_id: script template}
+        self.code = code
+        self.broken_code = broken_code or {}
+        # {task_id: JSON answer of the vision model}
+        self.vision = vision or {}
+        self.expected = expected
+
+
+def _task(bundle: str, task_id, description: str, inputs: list, outputs: list, dependencies=(), tool="python") -> dict:
+    return {
+        "task_id": task_id,
+        "description": f"[bench:{bundle}:{task_id}] {description}",
+        "tool_needed": tool,
+        "dependencies": list(dependencies),
+        "input_artifacts": inputs,
+        "output_artifacts": outputs,
+    }
+
+
+def csv_sales() -> Bundle:
+    rng = random.Random(SEED)
+    regions = ["north", "south", "east", "west"]
+    rows = [(rng.choice(regions), f"p{rng.randint(1, 40)}", rng.randint(1, 20), rng.randint(5, 500))
+            for _ in range(5000)]
+    csv = "region,product,units,price\n" + "".join(f"{r},{p},{u},{c}\n" for r, p, u, c in rows)
+    totals = {}
+    for region, _, units, price in rows:
+        totals[region] = totals.get(region, 0) + units * price
+    expected = [sum(totals.values()), max(totals, key=totals.get), dict(sorted(totals.items()))]
+
+    name = "csv_sales"
+    plan = [
+        _task(name, 1, "Load sales.csv, add a revenue column (units * price), save the table to "
+                       "sales_clean.parquet and print df.head().", ["sales.csv"], ["sales_clean.parquet"]),
+        _task(name, 2, "From sales_clean.parquet compute the total revenue, the region with the highest "
+                       "revenue and the revenue per region; save the three answers as a JSON array to "
+                       "final_output.json.", ["sales_clean.parquet"], ["final_output.json"], [1]),
+    ]
+    code = {
+        "1": '''import pandas as pd
+from artifact_io import write_table
+
+df = pd.read_csv("__IN0__")
+df["revenue"] = df["units"] * df["price"]
+write_table(df, "__OUT0__")
+print(df.head())
+''',
+        "2": '''import json
+from artifact_io import read_table
+
+df = read_table("__IN0__")
+totals = df.groupby("region")["revenue"].sum().sort_index()
+answer = [int(df["revenue"].sum()), str(totals.idxmax()), {str(k): int(v) for k, v in totals.items()}]
+with open("__OUT0__", "w") as f:
+    json.dump(answer, f)
+print(answer)
+''',
+    }
+    # the column is misspelled: a KeyError for the debugger to fix
+    broken = {"2": code["2"].replace('["revenue"].sum()', '["revenu"].sum()', 1)}
+    questions = ("Answer using sales.csv:\n1. What is the total revenue?\n"
+                 "2. Which region has the highest revenue?\n3. What is the revenue per region?\n")
+    return Bundle(name, questions, {"sales.csv": csv.encode()}, plan, code, expected, broken_code=broken)
+
+
+def parquet_sensors() -> Bundle:
+    import pandas as pd
+
+    rng = random.Random(SEED + 1)
+    sensors = [f"s{i:02d}" for i in range(12)]
+    rows = [(sensor, hour, rng.randint(-40, 80) / 2) for sensor in sensors for hour in range(24 * 30)]
+    frame = pd.DataFrame(rows, columns=["sensor", "hour", "temperature"])
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, index=False)
+
+    peak = {}
+    for sensor, _, temperature in rows:
+        peak[sensor] = max(peak.get(sensor, temperature), temperature)
+    hourly_max = max(temperature for _, _, temperature in rows)
+    expected = [max(peak, key=lambda s: (peak[s], s)), hourly_max, len(sensors)]
+
+    name = "parquet_sensors"
+    plan = [
+        _task(name, 1, "Compute the maximum temperature per sensor from readings.parquet and save it "
+                       "as a JSON object to sensor_peaks.json.", ["readings.parquet"], ["sensor_peaks.json"]),
+        _task(name, 2, "Compute the highest temperature over all hours from readings.parquet and save it "
+                       "to hourly_max.json.", ["readings.parquet"], ["hourly_max.json"]),
+        _task(name, 3, "Combine sensor_peaks.json and hourly_max.json into the final answers and save them "
+                       "as a JSON array to final_output.json.", ["sensor_peaks.json", "hourly_max.json"],
+              ["final_output.json"], [1, 2]),
+    ]
+    code = {
+        "1": '''import json
+import pandas as pd
+
+df = pd.read_parquet("__IN0__")
+peaks = df.groupby("sensor")["temperature"].max()
+with open("__OUT0__", "w") as f:
+    json.dump({str(k): float(v) for k, v in peaks.items()}, f)
+print(peaks.head())
+''',
+        "2": '''import json
+import pandas as pd
+
+df = pd.read_parquet("__IN0__", columns=["hour", "temperature"])
+hourly = df.groupby("hour")["temperature"].max()
+with open("__OUT0__", "w") as f:
+    json.dump(float(hourly.max()), f)
+print(hourly.describe())
+''',
+        "3": '''import json
+
+with open("__IN0__") as f:
+    peaks = json.load(f)
+with open("__IN1__") as f:
+    hourly_max = json.load(f)
+hottest = max(peaks, key=lambda s: (peaks[s], s))
+answer = [hottest, hourly_max, len(peaks)]
+with open("__OUT0__", "w") as f:
+    json.dump(answer, f)
+print(answer)
+''',
+    }
+    questions = ("Answer using readings.parquet:\n1. Which sensor recorded the highest temperature?\n"
+                 "2. What is the highest temperature?\n3. How many sensors are there?\n")
+    return Bundle(name, questions, {"readings.parquet": buffer.getvalue()}, plan, code, expected)
+
+
+def sql_orders() -> Bundle:
+    rng = random.Random(SEED + 2)
+    customers = [f"c{i:03d}" for i in range(60)]
+    rows = [(i, rng.choice(customers), rng.randint(100, 99999)) for i in range(1, 3001)]
+    statements = ["CREATE TABLE orders (id INTEGER PRIMARY KEY, customer TEXT, amount_cents INTEGER);"]
+    statements += [f"INSERT INTO orders VALUES ({i}, '{c}', {a});" for i, c, a in rows]
+    sql = "\n".join(statements) + "\n"
+
+    # the expected answer comes from the same SQL, so both sides agree on ties
+    connection = sqlite3.connect(":memory:")
+    connection.executescript(sql)
+    top = connection.execute("SELECT customer, SUM(amount_cents) AS total FROM orders GROUP BY customer "
+                             "ORDER BY total DESC, customer LIMIT 1").fetchone()
+    count = connection.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    connection.close()
+    expected = [count, top[0], top[1]]
+
+    name = "sql_orders"
+    plan = [
+        _task(name, 1, "Load orders.sql into an in-memory SQLite database, read the orders table and save it "
+                       "to orders.parquet; print df.head().", ["orders.sql"], ["orders.parquet"]),
+        _task(name, 2, "From orders.parquet find the number of orders and the customer with the highest "
+                       "total amount (and that total); save the answers as a JSON array to final_output.json.",
+              ["orders.parquet"], ["final_output.json"], [1]),
+    ]
+    code = {
+        "1": '''import sqlite3
+import pandas as pd
+from artifact_io import write_table
+
+with open("__IN0__") as f:
+    script = f.read()
+connection = sqlite3.connect(":memory:")
+connection.executescript(script)
+df = pd.read_sql_query("SELECT * FROM orders", connection)
+connection.close()
+write_table(df, "__OUT0__")
+print(df.head())
+''',
+        "2": '''import json
+from artifact_io import read_table
+
+df = read_table("__IN0__")
+totals = df.groupby("customer")["amount_cents"].sum().reset_index()
+totals = totals.sort_values(["amount_cents", "customer"], ascending=[False, True])
+top = totals.iloc[0]
+answer = [int(len(df)), str(top["customer"]), int(top["amount_cents"])]
+with open("__OUT0__", "w") as f:
+    json.dump(answer, f)
+print(answer)
+''',
+    }
+    broken = {"1": code["1"].replace("FROM orders", "FROM order_lines", 1)}
+    questions = ("Answer using orders.sql:\n1. How many orders are there?\n"
+                 "2. Which customer spent the most?\n3. How much did they spend (in cents)?\n")
+    return Bundle(name, questions, {"orders.sql": sql.encode()}, plan, code, expected, broken_code=broken)
+
+
+def image_chart() -> Bundle:
+    from PIL import Image, ImageDraw
+
+    values = {"alpha": 42, "beta": 77, "gamma": 19, "delta": 63}
+    image = Image.new("RGB", (1600, 1200), "white")
+    draw = ImageDraw.Draw(image)
+    for i, (label, value) in enumerate(values.items()):
+        left = 150 + i * 350
+        draw.rectangle([left, 1100 - value * 12, left + 200, 1100], fill=(60, 110, 200))
+        draw.text((left + 70, 1120), label, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    expected = [max(values, key=values.get), sum(values.values())]
+
+    name = "image_chart"
+    plan = [
+        _task(name, 1, "Read the bar chart in chart.png and report the value of every bar as a JSON object "
+                       "in chart_values.json.", ["chart.png"], ["chart_values.json"], tool="vision"),
+        _task(name, 2, "From chart_values.json find the label of the tallest bar and the sum of all bars; "
+                       "save them as a JSON array to final_output.json.", ["chart_values.json"],
+              ["final_output.json"], [1]),
+    ]
+    code = {
+        "2": '''import json
+
+with open("__IN0__") as f:
+    bars = json.load(f)["bars"]
+answer = [max(bars, key=bars.get), sum(bars.values())]
+with open("__OUT0__", "w") as f:
+    json.dump(answer, f)
+print(answer)
+''',
+    }
+    questions = ("Answer using chart.png:\n1. Which bar is the tallest?\n2. What is the sum of all bars?\n")
+    return Bundle(name, questions, {"chart.png": buffer.getvalue()}, plan, code, expected,
+                  vision={"1": {"chart_type": "bar", "bars": values}})
+
+
+def html_table() -> Bundle:
+    rng = random.Random(SEED + 3)
+    rows = [(f"Country {i:03d}", rng.randint(100_000, 90_000_000), rng.randint(1_000, 2_000_000))
+            for i in range(400)]
+    cells = "".join(f"<tr><td>{n}</td><td>{p:,}</td><td>{a:,}</td></tr>\n" for n, p, a in rows)
+    html = ("<html><body><h1>Countries</h1><table id='countries'>\n"
+            "<tr><th>Name</th><th>Population</th><th>Area</th></tr>\n" + cells + "</table></body></html>\n")
+    densest = max(rows, key=lambda r: (r[1] / r[2], r[0]))
+    expected = [len(rows), densest[0], sum(r[1] for r in rows)]
+
+    name = "html_table"
+    plan = [
+        _task(name, 1, "Parse the countries table in countries.html into a DataFrame with numeric population "
+                       "and area columns and save it to countries.parquet; print df.head().",
+              ["countries.html"], ["countries.parquet"]),
+        _task(name, 2, "From countries.parquet find the number of countries, the most densely populated "
+                       "country and the total population; save them as a JSON array to final_output.json.",
+              ["countries.parquet"], ["final_output.json"], [1]),
+    ]
+    code = {
+        "1": '''from html.parser import HTMLParser
+import pandas as pd
+from artifact_io import write_table
+
+
+class TableParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag in ("td", "th"):
+            self.cell = ""
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self.cell is not None:
+            self.rows[-1].append(self.cell.strip())
+            self.cell = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell += data
+
+
+parser = TableParser()
+with open("__IN0__") as f:
+    parser.feed(f.read())
+header, *body = [row for row in parser.rows if row]
+df = pd.DataFrame(body, columns=[h.lower() for h in header])
+for column in ("population", "area"):
+    df[column] = df[column].str.replace(",", "").astype("int64")
+write_table(df, "__OUT0__")
+print(df.head())
+''',
+        "2": '''import json
+from artifact_io import read_table
+
+df = read_table("__IN0__")
+df["density"] = df["population"] / df["area"]
+densest = df.sort_values(["density", "name"], ascending=[False, False]).iloc[0]
+answer = [int(len(df)), str(densest["name"]), int(df["population"].sum())]
+with open("__OUT0__", "w") as f:
+    json.dump(answer, f)
+print(answer)
+''',
+    }
+    questions = ("Answer using countries.html:\n1. How many countries are listed?\n"
+                 "2. Which country is the most densely populated?\n3. What is the total population?\n")
+    return Bundle(name, questions, {"countries.html": html.encode()}, plan, code, expected)
+
+
+BUILDERS = {
+    "csv_sales": csv_sales,
+    "parquet_sensors": parquet_sensors,
+    "sql_orders": sql_orders,
+    "image_chart": image_chart,
+    "html_table": html_table,
+}
+
+
+def build_corpus(names=None) -> dict:
+    """{name: Bundle} for the given bundle names (all of them by default)."""
+    names = names or list(BUILDERS)
+    unknown = [name for name in names if name not in BUILDERS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark bundles: {', '.join(unknown)} (known: {', '.join(BUILDERS)})")
+    return {name: BUILDERS[name]() for name in names}
+
+
+def plan_json(bundle: Bundle) -> str:
+    return json.dumps(bundle.plan)